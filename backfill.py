@@ -0,0 +1,242 @@
+"""
+Догоняющая загрузка событий за длительный период (python3 main.py backfill).
+
+Период делится на отрезки по BACKFILL_SHARD_HOURS для каждого источника,
+отрезки обрабатываются в пуле процессов: каждый процесс сам загружает,
+нормализует и форматирует события своего отрезка и отправляет их
+получателям через собственные соединения, поэтому нормализация и
+форматирование не упираются в одно ядро.
+
+Дедупликация общая - через БД хранилища: перед отправкой страница
+событий проверяется запросом по ID (existing_ids), после доставки всем
+получателям ID сохраняются (store_many). Записи процессов ждут друг друга
+по busy_timeout. Outbox и отметки источников не используются: позиция
+получателя в outbox рассчитана на одного писателя, а период backfill
+задан явно. Отрезок, на котором отправка не удалась, прерывается - при
+повторном запуске уже доставленные события будут отсеяны.
+
+Правила EVENT_RULES применяются так же, как в цикле экспорта; счетчики
+sample и rate_cap у каждого процесса свои.
+
+Фильтр Блума процессы не ведут (файл открыт одним процессом), после
+загрузки он пересоздается из БД.
+"""
+
+import logging
+import multiprocessing
+import os
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config import BACKFILL_SHARD_HOURS, BACKFILL_WORKERS, OUTBOX_BATCH_SIZE
+from event_id_store import EventStore
+from event_normalizer import NormalizedEvent
+from event_rules import EventRules, apply_routes
+from pipeline import (
+    FETCHERS,
+    NORMALIZERS,
+    SOURCE_LABELS,
+    SOURCES,
+    TIMESTAMP_PARSERS,
+    new_stats,
+)
+from syslog_sender import Destination, create_destinations, format_syslog_messages
+
+logger = logging.getLogger(__name__)
+
+Shard = Tuple[str, float, float]
+
+
+def make_shards(
+    since: float,
+    until: float,
+    sources: Iterable[str] = SOURCES,
+    shard_hours: float = BACKFILL_SHARD_HOURS,
+) -> List[Shard]:
+    """Делит период [since, until) на отрезки (источник, начало, конец)."""
+    step = shard_hours * 3600
+    shards = []
+    for kind in sources:
+        start = since
+        while start < until:
+            end = min(start + step, until)
+            shards.append((kind, start, end))
+            start = end
+    return shards
+
+
+def run_backfill(
+    since: float,
+    until: float,
+    sources: Sequence[str] = SOURCES,
+    workers: Optional[int] = BACKFILL_WORKERS,
+    shard_hours: float = BACKFILL_SHARD_HOURS,
+) -> Dict[str, int]:
+    """
+    Загружает и отправляет события источников за период [since, until).
+
+    Args:
+        workers: Число процессов; None - по числу ядер
+
+    Returns:
+        Счетчики, как у run_cycle (ошибка отрезка учитывается в errors)
+    """
+    shards = make_shards(since, until, sources, shard_hours)
+    # Ошибка в правилах - до запуска процессов, а не в каждом отрезке
+    EventRules().check_destinations([d.name for d in create_destinations()])
+    with EventStore() as store:
+        legacy_hash = store.legacy_id_hash()
+
+    workers = min(workers or os.cpu_count() or 1, len(shards)) or 1
+    logger.info(f"Backfill: {len(shards)} отрезков, {workers} процессов")
+
+    stats = new_stats()
+    # spawn: дочерние процессы не наследуют соединения с БД, получателями
+    # и HTTP сессию родителя
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {
+            pool.submit(backfill_shard, kind, start, end, legacy_hash): (kind, start)
+            for kind, start, end in shards
+        }
+        for future in as_completed(futures):
+            kind, start = futures[future]
+            try:
+                shard_stats = future.result()
+            except Exception as ex:
+                logger.error(f"Ошибка отрезка {kind} с {start:.0f}: {ex}")
+                stats["errors"] += 1
+                continue
+            for key, value in shard_stats.items():
+                stats[key] = stats.get(key, 0) + value
+
+    with EventStore() as store:
+        if store.bloom is not None:
+            logger.info("Пересоздание фильтра Блума после backfill")
+            store.rebuild_bloom()
+    return stats
+
+
+def backfill_shard(
+    kind: str, since: float, until: float, legacy_hash: Optional[str] = None
+) -> Dict[str, int]:
+    """Обрабатывает один отрезок в процессе пула; возвращает счетчики."""
+    stats = new_stats()
+    normalize = NORMALIZERS[kind]
+    event_timestamp = TIMESTAMP_PARSERS[kind]
+    rules = EventRules()
+    with EventStore(use_bloom=False) as store, ExitStack() as stack:
+        destinations = [stack.enter_context(d) for d in create_destinations()]
+        for d in destinations:
+            stats[f"sent_{d.name}"] = 0
+
+        # Отрезки не должны пересекаться: событие на границе, отданное
+        # двум процессам, оба могут не найти в БД и отправить дважды
+        events = (
+            e
+            for e in FETCHERS[kind](
+                since=since, until=until, **rules.fetch_filter(kind)
+            )
+            if since <= (event_timestamp(e) or since) < until
+        )
+        while True:
+            page = list(islice(events, OUTBOX_BATCH_SIZE))
+            if not page:
+                break
+
+            page, routes, dropped = rules.select(kind, page)
+            stats[f"filtered_{kind}"] += len(dropped)
+            if not page:
+                continue
+
+            normalized, errors = normalize(page, legacy_hash=legacy_hash)
+            for _, ex in errors:
+                logger.error(f"Ошибка нормализации {SOURCE_LABELS[kind]}: {ex}")
+            stats["errors"] += len(errors)
+            apply_routes(normalized, routes)
+
+            new_events = _new_events(store, normalized, kind, stats)
+            if new_events and not _deliver(store, destinations, new_events, stats):
+                break
+    return stats
+
+
+def _new_events(
+    store: EventStore,
+    normalized: List[Optional[NormalizedEvent]],
+    kind: str,
+    stats: Dict[str, int],
+) -> List[NormalizedEvent]:
+    """Отбрасывает события, уже сохраненные в БД или повторенные в странице."""
+    events = [ne for ne in normalized if ne is not None]
+    ids = [ne.id for ne in events]
+    ids.extend(ne.legacy_id for ne in events if ne.legacy_id is not None)
+    seen = store.existing_ids(ids)
+
+    new_events = []
+    for ne in events:
+        if ne.id in seen or (ne.legacy_id is not None and ne.legacy_id in seen):
+            stats[f"duplicates_{kind}"] += 1
+            continue
+        seen.add(ne.id)
+        stats[kind] += 1
+        new_events.append(ne)
+    return new_events
+
+
+def _deliver(
+    store: EventStore,
+    destinations: List[Destination],
+    events: List[NormalizedEvent],
+    stats: Dict[str, int],
+) -> bool:
+    """
+    Отправляет события всем получателям и сохраняет ID доставленных.
+
+    Сохраняется начало списка, доставленное всем своим получателям (событие
+    из нескольких сообщений - если доставлены все его части; событие с
+    destination отправляется только этому получателю).
+
+    Returns:
+        False, если хотя бы одному получателю отправлено не все
+    """
+    formatted: List[NormalizedEvent] = []
+    parts: List[List[bytes]] = []
+    for event in events:
+        try:
+            parts.append(format_syslog_messages(event, event.priority, event.facility))
+        except Exception as ex:
+            logger.error(f"Ошибка форматирования события {event.id}: {ex}")
+            stats["errors"] += 1
+            continue
+        formatted.append(event)
+
+    delivered = len(formatted)  # число событий, доставленных всем получателям
+    for destination in destinations:
+        indexes = [
+            i
+            for i, event in enumerate(formatted)
+            if event.destination is None or event.destination == destination.name
+        ]
+        messages: List[bytes] = []
+        ends: List[int] = []  # число сообщений до конца каждого события
+        for i in indexes:
+            messages.extend(parts[i])
+            ends.append(len(messages))
+
+        sent = destination.sender.send_messages(messages) if messages else 0
+        stats["sent"] += sent
+        stats[f"sent_{destination.name}"] += sent
+        if sent < len(messages):
+            logger.error(
+                f"Получатель {destination.name}: отправлено {sent} "
+                f"из {len(messages)}, отрезок прерван"
+            )
+            stats["errors"] += 1
+            delivered = min(delivered, indexes[bisect_right(ends, sent)])
+
+    store.store_many(formatted[:delivered])
+    return delivered == len(formatted)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк хранилища ID событий: вставок в секунду.
+
+Сравнивает исходную схему записи (новое подключение, CREATE TABLE/INDEX
+и commit на каждое событие) с EventStore.store_many() (одно подключение,
+WAL, executemany пачками в одной транзакции).
+
+Запуск:
+    python3 benchmarks/bench_event_store.py --events 100000
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_id_store import EventStore  # noqa: E402
+
+
+def _make_records(count: int) -> List[Dict[str, Any]]:
+    now = datetime.now(timezone.utc).isoformat()
+    return [
+        {
+            "id": f"{i:032x}",
+            "timestamp": now,
+            "user": f"user{i % 100}",
+            "event_type": "LOGIN",
+            "source": "keycloak",
+            "priority": 14,
+            "facility": 4,
+        }
+        for i in range(count)
+    ]
+
+
+def _legacy_store(path: str, record: Dict[str, Any]) -> None:
+    """Исходная реализация store_event_id: подключение и commit на событие."""
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            id TEXT PRIMARY KEY,
+            timestamp TEXT NOT NULL,
+            event_type TEXT,
+            source TEXT,
+            user TEXT,
+            priority INTEGER,
+            facility INTEGER,
+            created_at TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON events(timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_source ON events(source)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_created_at ON events(created_at)")
+    conn.commit()
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO events
+        (id, timestamp, event_type, source, user, priority, facility, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            record["id"],
+            record["timestamp"],
+            record["event_type"],
+            record["source"],
+            record["user"],
+            record["priority"],
+            record["facility"],
+            datetime.now(timezone.utc).isoformat(),
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def bench_legacy(records: List[Dict[str, Any]], workdir: str) -> float:
+    path = os.path.join(workdir, "legacy.db")
+    start = time.perf_counter()
+    for record in records:
+        _legacy_store(path, record)
+    return len(records) / (time.perf_counter() - start)
+
+
+def bench_store_many(
+    records: List[Dict[str, Any]], workdir: str, batch_size: int
+) -> float:
+    path = os.path.join(workdir, "store.db")
+    start = time.perf_counter()
+    with EventStore(path) as store:
+        for i in range(0, len(records), batch_size):
+            store.store_many(records[i : i + batch_size])
+    return len(records) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument(
+        "--legacy-events",
+        type=int,
+        default=None,
+        help="событий для исходной схемы (по умолчанию как --events)",
+    )
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    records = _make_records(args.events)
+    legacy_count = args.legacy_events or args.events
+
+    with tempfile.TemporaryDirectory() as workdir:
+        legacy_rate = bench_legacy(records[:legacy_count], workdir)
+        print(
+            f"до    (store_event_id, {legacy_count} событий): "
+            f"{legacy_rate:,.0f} вставок/сек"
+        )
+
+        rate = bench_store_many(records, workdir, args.batch_size)
+        print(
+            f"после (store_many по {args.batch_size}, {args.events} событий): "
+            f"{rate:,.0f} вставок/сек"
+        )
+        print(f"ускорение: x{rate / legacy_rate:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк формирования RFC5424 сообщений: сообщений в секунду.
+
+Сравнивает исходную реализацию format_syslog_message (json.dumps, разбор
+source и timestamp, f-строка и encode на каждое событие) с SyslogFormatter
+(кеш заголовков в bytes, JSON сразу в bytes через orjson, если установлен).
+
+Запуск:
+    python3 benchmarks/bench_formatter.py --events 200000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from syslog_sender import SyslogFormatter, _normalize_timestamp, orjson  # noqa: E402
+
+
+def _make_events(count: int, with_details: bool) -> List[Dict[str, Any]]:
+    start = datetime.now(timezone.utc)
+    events = []
+    for i in range(count):
+        if i % 3:
+            events.append(
+                {
+                    "id": f"{i:032x}",
+                    "timestamp": int(start.timestamp() * 1000) + i,
+                    "user": f"user{i % 100}",
+                    "realm": "master",
+                    "event_type": "LOGIN" if i % 3 == 1 else "UPDATE",
+                    "details": {"auth_method": "openid-connect", "ip": "10.0.0.1"},
+                    "source": "keycloak",
+                    "priority": 14 if i % 3 == 1 else 4,
+                    "facility": 4 if i % 3 == 1 else 13,
+                }
+            )
+        else:
+            events.append(
+                {
+                    "id": f"{i:032x}",
+                    "timestamp": (start + timedelta(seconds=i)).isoformat(),
+                    "user": f"user{i % 100}",
+                    "project_id": f"{i % 50:08x}-0000-0000-0000-000000000000",
+                    "project_name": f"Проект {i % 50}",
+                    "event_type": "proj-upd",
+                    "details": (
+                        {"hosts": [f"10.0.{j // 256}.{j % 256}" for j in range(200)]}
+                        if with_details
+                        else {}
+                    ),
+                    "priority": 7,
+                    "facility": 16,
+                    "source": "app",
+                }
+            )
+    return events
+
+
+def _legacy_format(
+    event: Dict[str, Any], priority: int, facility: Optional[int] = None
+) -> bytes:
+    """Исходная реализация format_syslog_message."""
+    msg = json.dumps(event, ensure_ascii=False)
+
+    hostname = "audit-client"
+
+    source = event.get("source", "unknown")
+    if source == "app":
+        app_name = "scanfactory-app"
+    elif source == "keycloak":
+        app_name = "keycloak"
+    else:
+        app_name = "unknown"
+
+    timestamp = _normalize_timestamp(event.get("timestamp"))
+
+    if facility is None:
+        facility = event.get("facility", 16)
+
+    facility_int = facility if isinstance(facility, int) else 16
+
+    severity = priority if priority <= 7 else 7
+    pri = facility_int * 8 + severity
+
+    procid = "-"
+    msgid = event.get("event_type", "-")
+    structured_data = "-"
+
+    bom = "\ufeff"
+    rfc5424_msg = (
+        f"<{pri}>1 {timestamp} {hostname} {app_name} {procid} {msgid} "
+        f"{structured_data} {bom}{msg}"
+    )
+    return rfc5424_msg.encode("utf-8")
+
+
+def bench(format_event: Any, events: List[Dict[str, Any]]) -> float:
+    start = time.perf_counter()
+    for event in events:
+        format_event(event, event["priority"], event.get("facility"))
+    return len(events) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=200_000)
+    parser.add_argument(
+        "--details",
+        action="store_true",
+        help="события приложения с большим details (как при SHORT_LOGS = False)",
+    )
+    args = parser.parse_args()
+
+    events = _make_events(args.events, args.details)
+
+    # Без orjson вывод должен совпадать с исходной реализацией байт в байт
+    json_formatter = SyslogFormatter(use_orjson=False)
+    for event in events[:1000]:
+        expected = _legacy_format(event, event["priority"], event.get("facility"))
+        actual = json_formatter.format(event, event["priority"], event.get("facility"))
+        assert actual == expected, (actual, expected)
+
+    legacy_rate = bench(_legacy_format, events)
+    print(f"до    (format_syslog_message):  {legacy_rate:,.0f} сообщений/сек")
+
+    rate = bench(json_formatter.format, events)
+    print(
+        f"после (SyslogFormatter, json):  {rate:,.0f} сообщений/сек "
+        f"(x{rate / legacy_rate:.1f})"
+    )
+
+    if orjson is not None:
+        rate = bench(SyslogFormatter(use_orjson=True).format, events)
+        print(
+            f"после (SyslogFormatter, orjson): {rate:,.0f} сообщений/сек "
+            f"(x{rate / legacy_rate:.1f})"
+        )
+    else:
+        print("orjson не установлен, вариант с orjson пропущен")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк нормализации: событий в секунду и память на событие.
+
+Сравнивает исходную нормализацию (словарь на событие и его копия с
+метаданными для БД) с NormalizedEvent (слоты, без копии метаданных) и
+пакетную нормализацию страницами с разными алгоритмами ID.
+Память - прирост после нормализации всех событий, как при накоплении
+пачки событий за длительный период (догоняющий запуск).
+
+Запуск:
+    python3 benchmarks/bench_normalizer.py --events 1000000
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import APP_EVENT_PRIORITIES, USER_EVENT_PRIORITIES  # noqa: E402
+from event_normalizer import (  # noqa: E402
+    ID_HASHES,
+    _generate_event_id,
+    normalize_app_batch,
+    normalize_app_event,
+    normalize_keycloak_batch,
+    normalize_keycloak_event,
+)
+
+
+def _make_raw_events(count: int) -> List[Tuple[str, Dict[str, Any]]]:
+    start = datetime.now(timezone.utc)
+    events = []
+    for i in range(count):
+        if i % 2:
+            events.append(
+                (
+                    "keycloak",
+                    {
+                        "time": int(start.timestamp() * 1000) + i,
+                        "type": "LOGIN",
+                        "realmId": "master",
+                        "userId": f"user{i % 1000}",
+                        "sessionId": f"{i:036x}",
+                        "details": {"auth_method": "openid-connect"},
+                    },
+                )
+            )
+        else:
+            events.append(
+                (
+                    "app",
+                    {
+                        "project": {
+                            "id": f"{i % 50:032x}",
+                            "name": f"Проект {i % 50}",
+                        },
+                        "by": f"user{i % 1000}",
+                        "at": (start + timedelta(milliseconds=i)).isoformat(),
+                        "type": "proj-upd",
+                        "info": {"name": "x"},
+                    },
+                )
+            )
+    return events
+
+
+def _legacy_keycloak(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Исходная normalize_keycloak_event (пользовательские события)."""
+    event_type = event.get("type") or event.get("operationType") or "unknown"
+    timestamp = event.get("time") or event.get("timestamp")
+    user_id = event.get("userId")
+    session_id = event.get("sessionId", "")
+    event_id = _generate_event_id(
+        str(event_type or ""), timestamp, str(user_id or ""), session_id
+    )
+    base = {
+        "id": event_id,
+        "timestamp": timestamp,
+        "user": user_id,
+        "realm": event.get("realmId"),
+        "event_type": event_type,
+        "details": event.get("details"),
+        "source": "keycloak",
+    }
+    priority_facility = USER_EVENT_PRIORITIES.get(event_type, (14, 16))
+    base["priority"] = priority_facility[0]
+    base["facility"] = priority_facility[1]
+    return base
+
+
+def _legacy_app(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Исходная normalize_app_event (SHORT_LOGS = True)."""
+    event_type = event.get("type", "unknown")
+    project = event.get("project", {})
+    timestamp = event.get("at")
+    user = event.get("by", "system")
+    event_id = _generate_event_id(event_type, timestamp, user, project.get("id"))
+    priority_facility = APP_EVENT_PRIORITIES.get(event_type, (14, 16))
+    return {
+        "id": event_id,
+        "timestamp": timestamp,
+        "user": user,
+        "project_id": str(project.get("id", "")),
+        "project_name": project.get("name", ""),
+        "event_type": event_type,
+        "details": {},
+        "priority": priority_facility[0],
+        "facility": priority_facility[1],
+        "source": "app",
+    }
+
+
+def _legacy_metadata(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Исходная extract_metadata - копия ключевых полей для БД."""
+    return {
+        "id": event.get("id", ""),
+        "timestamp": event.get("timestamp", ""),
+        "user": event.get("user", ""),
+        "event_type": event.get("event_type", ""),
+        "source": event.get("source", ""),
+        "priority": event.get("priority", 0),
+        "facility": event.get("facility", 0),
+    }
+
+
+def _legacy_normalize(source: str, event: Dict[str, Any]) -> Any:
+    ne = _legacy_keycloak(event) if source == "keycloak" else _legacy_app(event)
+    return ne, _legacy_metadata(ne)
+
+
+def _normalize(source: str, event: Dict[str, Any]) -> Any:
+    if source == "keycloak":
+        return normalize_keycloak_event(event)
+    return normalize_app_event(event)
+
+
+def bench_batch_rate(
+    raw: List[Tuple[str, Dict[str, Any]]], id_hash: str, page_size: int
+) -> float:
+    keycloak = [event for source, event in raw if source == "keycloak"]
+    app = [event for source, event in raw if source == "app"]
+    gc.collect()
+    start = time.perf_counter()
+    for i in range(0, len(keycloak), page_size):
+        normalize_keycloak_batch(keycloak[i : i + page_size], id_hash=id_hash)
+    for i in range(0, len(app), page_size):
+        normalize_app_batch(app[i : i + page_size], id_hash=id_hash)
+    return len(raw) / (time.perf_counter() - start)
+
+
+def bench_rate(
+    normalize: Callable[[str, Dict[str, Any]], Any],
+    raw: List[Tuple[str, Dict[str, Any]]],
+) -> float:
+    gc.collect()
+    start = time.perf_counter()
+    result = [normalize(source, event) for source, event in raw]
+    elapsed = time.perf_counter() - start
+    del result
+    return len(raw) / elapsed
+
+
+def bench_memory(
+    normalize: Callable[[str, Dict[str, Any]], Any],
+    raw: List[Tuple[str, Dict[str, Any]]],
+) -> float:
+    """Возвращает прирост памяти на одно нормализованное событие, байт."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = [normalize(source, event) for source, event in raw]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return used / len(raw)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=200_000)
+    parser.add_argument("--page-size", type=int, default=100)
+    args = parser.parse_args()
+
+    raw = _make_raw_events(args.events)
+
+    # Скорость измеряется отдельно от памяти: tracemalloc замедляет выделения
+    legacy_rate = bench_rate(_legacy_normalize, raw)
+    rate = bench_rate(_normalize, raw)
+    legacy_bytes = bench_memory(_legacy_normalize, raw)
+    event_bytes = bench_memory(_normalize, raw)
+
+    print(
+        f"до    (dict + копия метаданных): {legacy_rate:,.0f} событий/сек, "
+        f"{legacy_bytes:,.0f} байт/событие"
+    )
+    print(
+        f"после (NormalizedEvent):         {rate:,.0f} событий/сек, "
+        f"{event_bytes:,.0f} байт/событие"
+    )
+    print(
+        f"память: x{legacy_bytes / event_bytes:.1f} меньше, "
+        f"на {args.events} событий: {legacy_bytes * args.events / 2**20:,.0f} -> "
+        f"{event_bytes * args.events / 2**20:,.0f} МБ"
+    )
+
+    for id_hash in ID_HASHES:
+        batch_rate = bench_batch_rate(raw, id_hash, args.page_size)
+        print(
+            f"страницами по {args.page_size}, ID {id_hash}: "
+            f"{batch_rate:,.0f} событий/сек (x{batch_rate / legacy_rate:.1f})"
+        )
+
+
+if __name__ == "__main__":
+    main()
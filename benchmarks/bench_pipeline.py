@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк экспортера на локальных заменителях сервисов (см. fake_services.py).
+
+Стадии измеряются каждая в отдельном процессе (пиковая память - своя):
+
+- fetch     - загрузка событий из fake Keycloak и Scanfactory по HTTP;
+- normalize - пакетная нормализация и дедупликация;
+- format    - формирование RFC5424 сообщений;
+- store     - постановка в outbox (SQLite);
+- send      - отправка готовых сообщений в fake коллектор;
+- pipeline  - полный запуск main.py run (все стадии вместе).
+
+Для каждой стадии выводятся события в секунду, перцентили времени
+обработки одной порции (страницы, пачки), пиковый RSS процесса и размер БД;
+для pipeline - также время стадий по метрикам экспортера и число сообщений,
+принятых и проверенных коллектором. Результаты можно сохранить в JSON
+(--json) и сравнивать до и после изменения.
+
+Запуск:
+    python3 benchmarks/bench_pipeline.py --events 50000 [--transport tls] [--async]
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+import fake_services
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCES = ("keycloak_user", "keycloak_admin", "app")
+STAGES = ("fetch", "normalize", "format", "store", "send", "pipeline")
+
+
+def _configure(settings: Dict[str, Any], stage: str) -> None:
+    """
+    Настраивает config.py на fake сервисы в процессе стадии.
+
+    Вызывается до импорта модулей экспортера: они читают настройки при импорте.
+    """
+    sys.path.insert(0, REPO_DIR)
+    workdir = os.path.join(settings["workdir"], stage)
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    if settings["certfile"]:
+        os.environ["SSL_CERT_FILE"] = settings["certfile"]
+
+    import config
+
+    config.KEYCLOAK_URL = f"http://127.0.0.1:{settings['sources_port']}"
+    config.KEYCLOAK_REALMS = "*" if settings["realms"] > 1 else []
+    config.APP_API_URL = f"http://127.0.0.1:{settings['sources_port']}/api"
+    config.FETCH_WINDOW_HOURS = settings["window_hours"]
+    config.SHORT_LOGS = not settings["details"]
+    config.SYSLOG_MAX_MESSAGE_SIZE = settings["max_message_size"]
+    config.SYSLOG_HOST = "127.0.0.1"
+    config.SYSLOG_PORT = settings["sink_port"]
+    transport = "udp" if settings["transport"] == "udp" else "tcp"
+    config.SYSLOG_TRANSPORT = transport
+    config.SYSLOG_TRANSPORT_PORTS = {transport: settings["sink_port"]}
+    config.EVENT_ID_FILE = os.path.join(workdir, "events.db")
+    config.METRICS_SUMMARY_FILE = None
+
+    if settings["transport"] == "tls":
+        # TLS включается по номеру порта (6514), у коллектора порт случайный
+        import syslog_sender
+
+        syslog_sender.TRANSPORTS["tcp"] = partial(
+            syslog_sender.SyslogSender, use_tls=True
+        )
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    """Перцентили времени порции, мс."""
+    if len(samples) < 2:
+        value = samples[0] * 1000 if samples else 0.0
+        return {"p50_ms": value, "p95_ms": value, "p99_ms": value}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "p50_ms": cuts[49] * 1000,
+        "p95_ms": cuts[94] * 1000,
+        "p99_ms": cuts[98] * 1000,
+    }
+
+
+def _result(count: int, elapsed: float, samples: List[float]) -> Dict[str, Any]:
+    return {
+        "events": count,
+        "seconds": elapsed,
+        "events_per_sec": count / elapsed if elapsed else 0.0,
+        **_percentiles(samples),
+        # ru_maxrss в Linux - КБ
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def _timed_pages(pages: Iterable[Any]) -> Iterator[Tuple[Any, float]]:
+    start = time.perf_counter()
+    for page in pages:
+        now = time.perf_counter()
+        yield page, now - start
+        start = time.perf_counter()
+
+
+def _pages(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    page: List[Any] = []
+    for item in items:
+        page.append(item)
+        if len(page) >= size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def _raw_events(settings: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """События источников без HTTP - те же, что отдает FakeSources."""
+    sources = fake_services.FakeSources(
+        settings["events"], settings["window_hours"], settings["details"]
+    )
+    count = settings["events"]
+    return {
+        "keycloak_user": [
+            fake_services.keycloak_user_event(i, sources.user.time(i))
+            for i in range(count)
+        ],
+        "keycloak_admin": [
+            fake_services.keycloak_admin_event(i, sources.admin.time(i))
+            for i in range(count)
+        ],
+        "app": [
+            fake_services.app_event(i, sources.app.time(i), settings["details"])
+            for i in range(count)
+        ],
+    }
+
+
+def _normalized(settings: Dict[str, Any]) -> List[Any]:
+    from pipeline import NORMALIZERS
+
+    events = []
+    for kind, raw in _raw_events(settings).items():
+        for page in _pages(raw, 100):
+            normalized, _ = NORMALIZERS[kind](page)
+            events.extend(ne for ne in normalized if ne is not None)
+    return events
+
+
+def stage_fetch(settings: Dict[str, Any]) -> Dict[str, Any]:
+    _configure(settings, "fetch")
+    from config import KEYCLOAK_PAGE_SIZE
+    from pipeline import FETCHERS
+
+    count = 0
+    samples: List[float] = []
+    start = time.perf_counter()
+    for kind in SOURCES:
+        pages = _pages(FETCHERS[kind](), KEYCLOAK_PAGE_SIZE)
+        for page, elapsed in _timed_pages(pages):
+            count += len(page)
+            samples.append(elapsed)
+    return _result(count, time.perf_counter() - start, samples)
+
+
+def stage_normalize(settings: Dict[str, Any]) -> Dict[str, Any]:
+    _configure(settings, "normalize")
+    from config import PIPELINE_CHUNK_SIZE
+    from event_id_store import EventIdCache
+    from pipeline import new_stats, normalize_events
+
+    raw = _raw_events(settings)
+    stats = new_stats()
+    event_ids = EventIdCache()
+    count = 0
+    samples: List[float] = []
+    start = time.perf_counter()
+    for kind, events in raw.items():
+        for page in _pages(events, PIPELINE_CHUNK_SIZE):
+            page_start = time.perf_counter()
+            count += sum(1 for _ in normalize_events(page, kind, event_ids, stats))
+            samples.append(time.perf_counter() - page_start)
+    return _result(count, time.perf_counter() - start, samples)
+
+
+def stage_format(settings: Dict[str, Any]) -> Dict[str, Any]:
+    _configure(settings, "format")
+    from syslog_sender import format_syslog_message
+
+    events = _normalized(settings)
+    samples: List[float] = []
+    start = time.perf_counter()
+    for page in _pages(events, 100):
+        page_start = time.perf_counter()
+        for event in page:
+            format_syslog_message(event, event.priority, event.facility)
+        samples.append(time.perf_counter() - page_start)
+    return _result(len(events), time.perf_counter() - start, samples)
+
+
+def stage_store(settings: Dict[str, Any]) -> Dict[str, Any]:
+    _configure(settings, "store")
+    from config import EVENT_ID_FILE, SYSLOG_BATCH_MAX_MESSAGES
+    from event_id_store import EventStore
+    from syslog_sender import format_syslog_message
+
+    records = [
+        (event, format_syslog_message(event, event.priority, event.facility))
+        for event in _normalized(settings)
+    ]
+    samples: List[float] = []
+    with EventStore() as store:
+        start = time.perf_counter()
+        for page in _pages(records, SYSLOG_BATCH_MAX_MESSAGES):
+            page_start = time.perf_counter()
+            store.spool_many(page)
+            samples.append(time.perf_counter() - page_start)
+        elapsed = time.perf_counter() - start
+    result = _result(len(records), elapsed, samples)
+    result["store_mb"] = _store_size(EVENT_ID_FILE) / 2**20
+    return result
+
+
+def stage_send(settings: Dict[str, Any]) -> Dict[str, Any]:
+    _configure(settings, "send")
+    from config import OUTBOX_BATCH_SIZE
+    from syslog_sender import create_sender, format_syslog_message
+
+    messages = [
+        format_syslog_message(event, event.priority, event.facility)
+        for event in _normalized(settings)
+    ]
+    sender = create_sender()
+    samples: List[float] = []
+    sent = 0
+    with sender:
+        start = time.perf_counter()
+        for page in _pages(messages, OUTBOX_BATCH_SIZE):
+            page_start = time.perf_counter()
+            sent += sender.send_messages(page)
+            samples.append(time.perf_counter() - page_start)
+        elapsed = time.perf_counter() - start
+    return _result(sent, elapsed, samples)
+
+
+def stage_pipeline(settings: Dict[str, Any]) -> Dict[str, Any]:
+    _configure(settings, "pipeline")
+    import logging
+
+    import main
+    import metrics
+    from config import EVENT_ID_FILE
+
+    logging.getLogger().setLevel(logging.WARNING)
+    start = time.perf_counter()
+    code = main.main(["--async" if settings["use_async"] else "--sync", "run"])
+    elapsed = time.perf_counter() - start
+
+    summary = metrics.REGISTRY.summary()
+    count = int(
+        sum(
+            value
+            for key, value in summary["counters"].items()
+            if key.startswith("exporter_events_total") and 'result="new"' in key
+        )
+    )
+    result = _result(count, elapsed, [])
+    # Перцентили pipeline - время отправки одной пачки получателю
+    send = metrics.Histogram()
+    for key, histogram in metrics.REGISTRY._histograms[metrics.STAGE_SECONDS].items():
+        if dict(key)["stage"] == "send":
+            send.counts = [a + b for a, b in zip(send.counts, histogram.counts)]
+            send.count += histogram.count
+            send.max = max(send.max, histogram.max)
+    result.update(
+        {
+            "p50_ms": send.quantile(0.5) * 1000,
+            "p95_ms": send.quantile(0.95) * 1000,
+            "p99_ms": send.quantile(0.99) * 1000,
+            "exit_code": code,
+            "store_mb": _store_size(EVENT_ID_FILE) / 2**20,
+            "stages": [s for s in summary["stages"] if s["stage"] != "cycle"],
+        }
+    )
+    return result
+
+
+def _store_size(path: str) -> int:
+    return sum(
+        os.path.getsize(path + suffix)
+        for suffix in ("", "-wal")
+        if os.path.exists(path + suffix)
+    )
+
+
+STAGE_FUNCTIONS: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    "fetch": stage_fetch,
+    "normalize": stage_normalize,
+    "format": stage_format,
+    "store": stage_store,
+    "send": stage_send,
+    "pipeline": stage_pipeline,
+}
+
+
+def _run_stage(stage: str, settings: Dict[str, Any]) -> Dict[str, Any]:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(STAGE_FUNCTIONS[stage], settings).result()
+
+
+def _print_result(stage: str, result: Dict[str, Any]) -> None:
+    line = (
+        f"{stage:<9} {result['events']:>9,} событий  "
+        f"{result['events_per_sec']:>10,.0f} событий/сек  "
+        f"p50/p95/p99 {result['p50_ms']:.2f}/{result['p95_ms']:.2f}/"
+        f"{result['p99_ms']:.2f} мс  RSS {result['peak_rss_mb']:.0f} МБ"
+    )
+    if "store_mb" in result:
+        line += f"  БД {result['store_mb']:.1f} МБ"
+    print(line)
+    if "sink" in result:
+        sink = result["sink"]
+        line = (
+            f"{'':<9} коллектор: принято {sink['messages']:,} "
+            f"(RFC5424 корректно: {sink['valid']:,}, ошибок: {sink['invalid']:,}), "
+            f"{sink['bytes'] / 2**20:.1f} МБ, соединений {sink['connections']}"
+        )
+        if sink["tls_resumed"]:
+            line += f" (TLS сессия возобновлена: {sink['tls_resumed']})"
+        print(line)
+    for s in result.get("stages", [])[:6]:
+        labels = ",".join(
+            f"{k}={v}"
+            for k, v in s.items()
+            if k not in ("stage", "count", "errors") and not k.endswith("seconds")
+        )
+        print(
+            f"{'':<9} {s['stage']}{'[' + labels + ']' if labels else ''}: "
+            f"{s['total_seconds']:.3f} сек за {s['count']} вызовов, "
+            f"p95 {s['p95_seconds'] * 1000:.1f} мс"
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--events", type=int, default=20_000, help="событий на каждый источник"
+    )
+    parser.add_argument(
+        "--details",
+        type=int,
+        default=0,
+        help="хостов в info событий приложения (>0 - SHORT_LOGS = False)",
+    )
+    parser.add_argument(
+        "--max-message-size",
+        type=int,
+        help="SYSLOG_MAX_MESSAGE_SIZE - деление details на части, байт",
+    )
+    parser.add_argument(
+        "--realms",
+        type=int,
+        default=1,
+        help="realms Keycloak (события каждого загружаются одновременно)",
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=0.0, help="задержка ответа Keycloak"
+    )
+    parser.add_argument("--transport", choices=("tcp", "tls", "udp"), default="tcp")
+    parser.add_argument("--async", dest="use_async", action="store_true")
+    parser.add_argument(
+        "--stages",
+        default=",".join(STAGES),
+        help=f"стадии через запятую (по умолчанию все: {','.join(STAGES)})",
+    )
+    parser.add_argument("--json", help="сохранить результаты в JSON файл")
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"неизвестные стадии: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        certfile = keyfile = None
+        if args.transport == "tls":
+            certfile, keyfile = fake_services.make_certificate(workdir)
+        window_hours = 1.0
+        sources = fake_services.start_sources(
+            args.events,
+            window_hours,
+            args.details,
+            args.realms,
+            args.latency_ms / 1000,
+        )
+        sink = fake_services.start_sink(args.transport, 0, certfile, keyfile)
+        settings = {
+            "workdir": workdir,
+            "events": args.events,
+            "details": args.details,
+            "realms": args.realms,
+            "max_message_size": args.max_message_size,
+            "window_hours": window_hours,
+            "sources_port": sources.port,
+            "sink_port": sink.port,
+            "transport": args.transport,
+            "certfile": certfile,
+            "use_async": args.use_async,
+        }
+        print(
+            f"{args.events:,} событий на источник, транспорт {args.transport}, "
+            f"{'async' if args.use_async else 'sync'}"
+        )
+
+        results: Dict[str, Any] = {"settings": settings}
+        try:
+            for stage in stages:
+                before = sink.stats()
+                result = _run_stage(stage, settings)
+                if stage in ("send", "pipeline"):
+                    after = sink.wait_idle(before["messages"] + result["events"])
+                    result["sink"] = {
+                        key: after[key] - before[key]
+                        for key in ("messages", "valid", "invalid", "bytes")
+                    }
+                    for key in ("connections", "tls_resumed"):
+                        result["sink"][key] = after[key] - before[key]
+                results[stage] = result
+                _print_result(stage, result)
+        finally:
+            sources.stop()
+            sink.stop()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    # Сообщения, не прошедшие проверку коллектора, - ошибка формата или
+    # фрейминга: результат замера не годится
+    invalid = sum(
+        result["sink"]["invalid"]
+        for result in results.values()
+        if isinstance(result, dict) and "sink" in result
+    )
+    if invalid:
+        print(f"ОШИБКА: коллектор получил некорректных RFC5424 сообщений: {invalid:,}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,612 @@
+#!/usr/bin/env python3
+"""
+Локальные заменители Keycloak, Scanfactory и syslog коллектора для бенчмарков.
+
+- FakeSources - HTTP сервер с API Keycloak (токен, список realms, /events,
+  /admin-events с dateFrom/dateTo/first/max) и Scanfactory (/api/history/
+  с $gt-at/$lt-at). События каждого источника (и каждого из realms)
+  равномерно распределены по последним window_hours часам, содержимое
+  похоже на реальное (details, representation, список хостов в info
+  размера details_size). latency - задержка ответа Keycloak, сек.
+- SyslogSink - коллектор TCP (оба фрейминга RFC6587), TLS или UDP: считает
+  сообщения, байты и соединения, проверяет заголовок RFC5424.
+
+Серверы запускаются в отдельных процессах (start_sources, start_sink),
+чтобы не делить ядро и GIL с измеряемым экспортером.
+
+Запуск вручную (для main.py с настройками, которые будут выведены):
+    python3 benchmarks/fake_services.py --events 100000 [--transport tls]
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import re
+import socket
+import ssl
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+from multiprocessing.connection import Connection
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from urllib.parse import parse_qsl, urlparse
+
+REALM = "master"
+USERS = 500
+PROJECTS = 50
+
+USER_EVENT_TYPES = ("LOGIN", "CODE_TO_TOKEN", "REFRESH_TOKEN", "LOGOUT", "LOGIN_ERROR")
+ADMIN_OPERATIONS = ("UPDATE", "CREATE", "UPDATE", "DELETE", "ACTION")
+APP_EVENT_TYPES = (
+    "proj-upd",
+    "proj-upd",
+    "project-upd-floodwatch",
+    "proj-new",
+    "user-updated",
+    "email-tmpl-new",
+    "kube-release-rollout",
+    "proj-del",
+)
+
+# <PRI>1 TIMESTAMP HOSTNAME APP-NAME PROCID MSGID STRUCTURED-DATA [MSG];
+# TIMESTAMP - NILVALUE или FULL-DATE "T" FULL-TIME (RFC5424, раздел 6.2.3)
+_RFC5424_TIMESTAMP = (
+    rb"(?:-|\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d{1,6})?(?:Z|[+-]\d{2}:\d{2}))"
+)
+_RFC5424 = re.compile(
+    rb"<(\d{1,3})>1 " + _RFC5424_TIMESTAMP + rb" \S+ \S+ \S+ \S+ (?:-|\[.*?\])(?: |$)",
+    re.S,
+)
+
+
+def _uuid(a: int, b: int) -> str:
+    return f"{a & 0xFFFFFFFF:08x}-0000-4000-8000-{b & 0xFFFFFFFFFFFF:012x}"
+
+
+def _ip(i: int) -> str:
+    return f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+
+
+def realm_name(index: int) -> str:
+    return REALM if index == 0 else f"realm-{index}"
+
+
+def keycloak_user_event(i: int, time_ms: int, realm: int = 0) -> Dict[str, Any]:
+    user = i % USERS
+    r = realm << 4  # UUID пользователей и сессий у каждого realm свои
+    return {
+        "id": _uuid(i, 1 + r),
+        "time": time_ms,
+        "type": USER_EVENT_TYPES[i % len(USER_EVENT_TYPES)],
+        "realmId": realm_name(realm),
+        "clientId": "scanfactory-web",
+        "userId": _uuid(user, 2 + r),
+        "sessionId": _uuid(i // 3, 3 + r),
+        "ipAddress": _ip(i),
+        "details": {
+            "auth_method": "openid-connect",
+            "auth_type": "code",
+            "redirect_uri": "https://sf.app.url/projects",
+            "code_id": _uuid(i // 3, 4 + r),
+            "username": f"user{user}",
+        },
+    }
+
+
+def keycloak_admin_event(i: int, time_ms: int, realm: int = 0) -> Dict[str, Any]:
+    user = i % USERS
+    r = realm << 4
+    representation = {
+        "id": _uuid(user, 2 + r),
+        "username": f"user{user}",
+        "enabled": True,
+        "emailVerified": i % 2 == 0,
+        "firstName": "Иван",
+        "lastName": f"Пользователь {user}",
+        "email": f"user{user}@example.com",
+        "attributes": {"department": [f"Отдел {user % 10}"]},
+    }
+    return {
+        "time": time_ms,
+        "realmId": realm_name(realm),
+        "authDetails": {
+            "realmId": REALM,
+            "clientId": "admin-cli",
+            "userId": _uuid(i % 5, 5),
+            "ipAddress": _ip(i % 256),
+        },
+        "operationType": ADMIN_OPERATIONS[i % len(ADMIN_OPERATIONS)],
+        "resourceType": "USER",
+        "resourcePath": f"users/{_uuid(user, 2 + r)}/{i}",
+        "representation": json.dumps(representation, ensure_ascii=False),
+    }
+
+
+def app_event(i: int, time_us: int, details_size: int = 0) -> Dict[str, Any]:
+    project = i % PROJECTS
+    info: Dict[str, Any] = {"name": f"Проект {project}", "scope": "default"}
+    if details_size:
+        info["hosts"] = [_ip(i * details_size + j) for j in range(details_size)]
+    at = datetime.fromtimestamp(time_us / 1_000_000, tz=timezone.utc)
+    return {
+        "project": {"id": _uuid(project, 6), "name": f"Проект {project}"},
+        "by": f"user{i % USERS}",
+        "at": at.isoformat(),
+        "type": APP_EVENT_TYPES[i % len(APP_EVENT_TYPES)],
+        "info": info,
+    }
+
+
+class Timeline:
+    """
+    Времена count событий от новых к старым с равным шагом до end.
+
+    Событие i произошло в end - (i + 1) * step (в единицах end/step).
+    """
+
+    def __init__(self, end: int, window: int, count: int) -> None:
+        self.end = end
+        self.count = count
+        self.step = max(1, window // max(1, count))
+
+    def time(self, i: int) -> int:
+        return self.end - (i + 1) * self.step
+
+    def index_range(self, lower: float, upper: float) -> Tuple[int, int]:
+        """Индексы [start, stop) событий со временем в [lower, upper)."""
+        start = max(0, math.floor((self.end - upper) / self.step))
+        stop = min(self.count, math.floor((self.end - lower) / self.step))
+        return start, max(start, stop)
+
+
+class FakeSources:
+    """Генератор событий Keycloak и Scanfactory (см. описание модуля)."""
+
+    def __init__(
+        self,
+        events: int,
+        window_hours: float = 1.0,
+        details_size: int = 0,
+        realms: int = 1,
+        latency: float = 0.0,
+    ) -> None:
+        now = time.time()
+        window = window_hours * 3600
+        self.user = Timeline(int(now * 1000), int(window * 1000), events)
+        self.admin = Timeline(int(now * 1000), int(window * 1000), events)
+        self.app = Timeline(int(now * 1_000_000), int(window * 1_000_000), events)
+        self.details_size = details_size
+        self.realms = [realm_name(index) for index in range(realms)]
+        self.latency = latency
+
+    def keycloak_page(
+        self,
+        event_type: str,
+        date_from: str,
+        date_to: str,
+        first: int,
+        size: int,
+        realm: int = 0,
+        types: Sequence[str] = (),
+    ) -> List[Dict[str, Any]]:
+        timeline, build, names = (
+            (self.admin, keycloak_admin_event, ADMIN_OPERATIONS)
+            if event_type == "admin-events"
+            else (self.user, keycloak_user_event, USER_EVENT_TYPES)
+        )
+        # dateFrom/dateTo - дни включительно
+        lower = _day_start(date_from) * 1000 if date_from else -math.inf
+        upper = (_day_start(date_to) + 86400) * 1000 if date_to else math.inf
+        start, stop = timeline.index_range(lower, upper)
+        indexes: Iterable[int] = range(start, stop)
+        if types:
+            # type / operationTypes: тип события - names[i % len(names)]
+            indexes = (i for i in indexes if names[i % len(names)] in types)
+        return [
+            build(i, timeline.time(i), realm)
+            for i in islice(indexes, first, first + size)
+        ]
+
+    def app_events(self, since: float, until: float) -> Iterator[Dict[str, Any]]:
+        # $gt-at строгое сравнение, $lt-at - тоже
+        start, stop = self.app.index_range(since * 1_000_000 + 1, until * 1_000_000)
+        for i in range(stop - 1, start - 1, -1):
+            yield app_event(i, self.app.time(i), self.details_size)
+
+
+def _day_start(day: str) -> float:
+    return datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()
+
+
+class _SourcesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Заголовки и тело пишутся отдельно: без TCP_NODELAY каждый ответ ждал
+    # бы delayed ACK клиента (~40 мс)
+    disable_nagle_algorithm = True
+    sources: FakeSources
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.endswith("/protocol/openid-connect/token"):
+            self.send_error(404)
+            return
+        self._send_json(
+            {
+                "access_token": "fake-token",
+                "expires_in": 300,
+                "refresh_token": "fake-refresh",
+                "refresh_expires_in": 1800,
+                "token_type": "Bearer",
+            }
+        )
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = dict(parse_qsl(url.query))
+        types = [
+            value
+            for key, value in parse_qsl(url.query)
+            if key in ("type", "operationTypes")
+        ]
+        if url.path.startswith("/admin/realms"):
+            time.sleep(self.sources.latency)
+            parts = url.path.strip("/").split("/")
+            if len(parts) == 2:
+                self._send_json(
+                    [{"id": name, "realm": name} for name in self.sources.realms]
+                )
+                return
+            if (
+                len(parts) != 4
+                or parts[2] not in self.sources.realms
+                or parts[3] not in ("events", "admin-events")
+            ):
+                self.send_error(404)
+                return
+            self._send_json(
+                self.sources.keycloak_page(
+                    parts[3],
+                    query.get("dateFrom", ""),
+                    query.get("dateTo", ""),
+                    int(query.get("first", 0)),
+                    int(query.get("max", 100)),
+                    self.sources.realms.index(parts[2]),
+                    types,
+                )
+            )
+        elif url.path == "/api/history/":
+            self._send_history(
+                float(query.get("$gt-at", 0)), float(query.get("$lt-at", time.time()))
+            )
+        else:
+            self.send_error(404)
+
+    def _send_json(self, obj: Any) -> None:
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_history(self, since: float, until: float) -> None:
+        """Отдает историю частями (chunked), не собирая ответ в памяти."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        count = 0
+        parts = [b'{"items": [']
+        size = len(parts[0])
+        for event in self.sources.app_events(since, until):
+            part = json.dumps(event, ensure_ascii=False).encode("utf-8")
+            parts.append(b", " + part if count else part)
+            size += len(parts[-1])
+            count += 1
+            if size >= 64 * 1024:
+                self._write_chunk(b"".join(parts))
+                parts, size = [], 0
+        parts.append(b'], "count": %d}' % count)
+        self._write_chunk(b"".join(parts))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(b"%x\r\n%b\r\n" % (len(data), data))
+
+
+class SyslogSink:
+    """Syslog коллектор: считает и проверяет сообщения RFC5424."""
+
+    def __init__(
+        self,
+        transport: str = "tcp",
+        host: str = "127.0.0.1",
+        port: int = 0,
+        certfile: Optional[str] = None,
+        keyfile: Optional[str] = None,
+    ) -> None:
+        self.transport = transport
+        self._lock = threading.Lock()
+        self._stats = {
+            "messages": 0,
+            "valid": 0,
+            "invalid": 0,
+            "bytes": 0,
+            "connections": 0,
+            "tls_resumed": 0,
+        }
+        self._first_at: Optional[float] = None
+        self._last_at: Optional[float] = None
+        self._ssl_context: Optional[ssl.SSLContext] = None
+        if transport == "tls":
+            self._ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self._ssl_context.load_cert_chain(certfile, keyfile)
+
+        kind = socket.SOCK_DGRAM if transport == "udp" else socket.SOCK_STREAM
+        self._sock = socket.socket(socket.AF_INET, kind)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if transport == "udp":
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 2**20)
+        self._sock.bind((host, port))
+        self.port = self._sock.getsockname()[1]
+
+    def start(self) -> None:
+        if self.transport == "udp":
+            target: Callable[[], None] = self._serve_udp
+        else:
+            self._sock.listen(64)
+            target = self._serve_tcp
+        threading.Thread(target=target, daemon=True).start()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["first_at"] = self._first_at
+            stats["last_at"] = self._last_at
+        return stats
+
+    def _count(self, frames: List[bytes]) -> None:
+        valid = 0
+        size = 0
+        for frame in frames:
+            size += len(frame)
+            match = _RFC5424.match(frame)
+            if match is not None and int(match.group(1)) <= 191:
+                valid += 1
+        now = time.time()
+        with self._lock:
+            self._stats["messages"] += len(frames)
+            self._stats["valid"] += valid
+            self._stats["invalid"] += len(frames) - valid
+            self._stats["bytes"] += size
+            if self._first_at is None:
+                self._first_at = now
+            self._last_at = now
+
+    def _serve_udp(self) -> None:
+        while True:
+            data = self._sock.recv(65536)
+            self._count([data])
+
+    def _serve_tcp(self) -> None:
+        while True:
+            conn, _ = self._sock.accept()
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn: socket.socket) -> None:
+        try:
+            if self._ssl_context is not None:
+                conn = self._ssl_context.wrap_socket(conn, server_side=True)
+            with self._lock:
+                self._stats["connections"] += 1
+                if isinstance(conn, ssl.SSLSocket) and conn.session_reused:
+                    self._stats["tls_resumed"] += 1
+            buffer = b""
+            while True:
+                data = conn.recv(256 * 1024)
+                if not data:
+                    break
+                buffer += data
+                frames, buffer = _split_frames(buffer)
+                if frames:
+                    self._count(frames)
+        except (OSError, ValueError):
+            pass
+        finally:
+            conn.close()
+
+
+def _split_frames(buffer: bytes) -> Tuple[List[bytes], bytes]:
+    """Разбирает фреймы RFC6587 (octet-counting или через LF) из буфера."""
+    frames = []
+    pos = 0
+    while pos < len(buffer):
+        if buffer[pos : pos + 1].isdigit():
+            space = buffer.find(b" ", pos)
+            if space < 0:
+                break
+            end = space + 1 + int(buffer[pos:space])
+            if end > len(buffer):
+                break
+            frames.append(buffer[space + 1 : end])
+        else:
+            end = buffer.find(b"\n", pos)
+            if end < 0:
+                break
+            frames.append(buffer[pos:end])
+            end += 1
+        pos = end
+    return frames, buffer[pos:]
+
+
+def make_certificate(directory: str) -> Tuple[str, str]:
+    """Создает самоподписанный сертификат для 127.0.0.1 (нужен openssl)."""
+    certfile = os.path.join(directory, "sink.crt")
+    keyfile = os.path.join(directory, "sink.key")
+    command = (
+        "openssl req -x509 -newkey rsa:2048 -nodes -days 1 -subj /CN=127.0.0.1 "
+        "-addext subjectAltName=IP:127.0.0.1"
+    ).split()
+    subprocess.run(
+        command + ["-keyout", keyfile, "-out", certfile],
+        check=True,
+        capture_output=True,
+    )
+    return certfile, keyfile
+
+
+def _run_sources(
+    conn: Connection,
+    events: int,
+    window_hours: float,
+    details: int,
+    realms: int,
+    latency: float,
+) -> None:
+    handler = type(
+        "Handler",
+        (_SourcesHandler,),
+        {"sources": FakeSources(events, window_hours, details, realms, latency)},
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    conn.send(server.server_port)
+    server.serve_forever()
+
+
+def _run_sink(
+    conn: Connection,
+    transport: str,
+    port: int,
+    certfile: Optional[str],
+    keyfile: Optional[str],
+) -> None:
+    sink = SyslogSink(transport, port=port, certfile=certfile, keyfile=keyfile)
+    sink.start()
+    conn.send(sink.port)
+    while True:
+        command = conn.recv()
+        if command == "stop":
+            break
+        conn.send(sink.stats())
+
+
+class ServiceProcess:
+    """Сервер в отдельном процессе; stats() - запрос счетчиков (для коллектора)."""
+
+    def __init__(self, target: Callable[..., None], *args: Any) -> None:
+        context = multiprocessing.get_context("spawn")
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=target, args=(child_conn, *args), daemon=True
+        )
+        self._process.start()
+        self.port: int = self._conn.recv()
+
+    def stats(self) -> Dict[str, Any]:
+        self._conn.send("stats")
+        return self._conn.recv()
+
+    def wait_idle(self, expected: int, timeout: float = 30.0) -> Dict[str, Any]:
+        """Ждет expected сообщений или паузы 1 сек без новых; возвращает счетчики."""
+        deadline = time.monotonic() + timeout
+        stats = self.stats()
+        while stats["messages"] < expected and time.monotonic() < deadline:
+            time.sleep(0.2)
+            previous, stats = stats, self.stats()
+            if stats["messages"] == previous["messages"]:
+                time.sleep(0.8)
+                stats = self.stats()
+                if stats["messages"] == previous["messages"]:
+                    break
+        return stats
+
+    def stop(self) -> None:
+        self._process.terminate()
+        self._process.join()
+
+
+def start_sources(
+    events: int,
+    window_hours: float = 1.0,
+    details_size: int = 0,
+    realms: int = 1,
+    latency: float = 0.0,
+) -> ServiceProcess:
+    """Запускает FakeSources: events событий на каждый источник (и realm)."""
+    return ServiceProcess(
+        _run_sources, events, window_hours, details_size, realms, latency
+    )
+
+
+def start_sink(
+    transport: str = "tcp",
+    port: int = 0,
+    certfile: Optional[str] = None,
+    keyfile: Optional[str] = None,
+) -> ServiceProcess:
+    return ServiceProcess(_run_sink, transport, port, certfile, keyfile)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument("--window-hours", type=float, default=1.0)
+    parser.add_argument("--details", type=int, default=0, help="хостов в info")
+    parser.add_argument("--realms", type=int, default=1, help="realms Keycloak")
+    parser.add_argument(
+        "--latency-ms", type=float, default=0.0, help="задержка ответа Keycloak"
+    )
+    parser.add_argument("--transport", choices=("tcp", "tls", "udp"), default="tcp")
+    parser.add_argument("--sink-port", type=int, default=0)
+    args = parser.parse_args()
+
+    certfile = keyfile = None
+    if args.transport == "tls":
+        certfile, keyfile = make_certificate(os.getcwd())
+    sources = start_sources(
+        args.events,
+        args.window_hours,
+        args.details,
+        args.realms,
+        args.latency_ms / 1000,
+    )
+    sink = start_sink(args.transport, args.sink_port, certfile, keyfile)
+    print(f'KEYCLOAK_URL = "http://127.0.0.1:{sources.port}"')
+    if args.realms > 1:
+        print('KEYCLOAK_REALMS = "*"')
+    print(f'APP_API_URL = "http://127.0.0.1:{sources.port}/api"')
+    print('SYSLOG_HOST = "127.0.0.1"')
+    print(f"SYSLOG_PORT = {sink.port}")
+    if certfile:
+        print(f"SSL_CERT_FILE={certfile} (TLS включается портом 6514)")
+    try:
+        while True:
+            time.sleep(5)
+            print(sink.stats())
+    except KeyboardInterrupt:
+        sources.stop()
+        sink.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Фильтр Блума в файле, отображаемом в память (mmap).
+
+Используется хранилищем событий как быстрый предфильтр: ответ "события нет"
+точный и не требует обращения к SQLite, ответ "возможно есть" проверяется
+точным запросом в БД.
+"""
+
+import math
+import mmap
+import os
+import struct
+import time
+from typing import Iterable, List, Tuple
+
+_MAGIC = b"SFBLOOM1"
+# magic, число бит, число хеш-функций, число добавленных элементов, время создания
+_HEADER = struct.Struct("<8sQIQd")
+_HEADER_SIZE = 64
+
+
+def optimal_params(capacity: int, fp_rate: float) -> Tuple[int, int]:
+    """Возвращает (число бит, число хеш-функций) для capacity элементов."""
+    num_bits = math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2))
+    num_bits = max(64, (num_bits + 7) // 8 * 8)
+    num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+    return num_bits, num_hashes
+
+
+class BloomFilter:
+    """
+    Фильтр Блума над 16-байтными ID событий.
+
+    ID событий уже являются криптографическим хешем, поэтому позиции бит
+    вычисляются двойным хешированием из двух половин ID без дополнительного
+    хеширования: pos_i = (h1 + i * h2) mod m.
+    """
+
+    def __init__(self, path: str, capacity: int, fp_rate: float) -> None:
+        self.path = path
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.num_bits, self.num_hashes = optimal_params(capacity, fp_rate)
+
+        # True, если файл создан заново и фильтр нужно заполнить из БД
+        self.is_new = not self._is_compatible()
+        if self.is_new:
+            self._create(path)
+        self._open()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, digest: bytes) -> bool:
+        bits = self._bits
+        for pos in self._positions(digest):
+            if not bits[_HEADER_SIZE + (pos >> 3)] & (1 << (pos & 7)):
+                return False
+        return True
+
+    @property
+    def size_bytes(self) -> int:
+        return _HEADER_SIZE + self.num_bits // 8
+
+    @property
+    def age_seconds(self) -> float:
+        return time.time() - self.created
+
+    @property
+    def saturated(self) -> bool:
+        """Добавлено больше элементов, чем рассчитан фильтр."""
+        return self.count > self.capacity
+
+    def add(self, digest: bytes) -> None:
+        bits = self._bits
+        for pos in self._positions(digest):
+            bits[_HEADER_SIZE + (pos >> 3)] |= 1 << (pos & 7)
+        self.count += 1
+
+    def add_many(self, digests: Iterable[bytes]) -> None:
+        for digest in digests:
+            self.add(digest)
+
+    def rebuild(self, digests: Iterable[bytes]) -> None:
+        """Пересоздает фильтр из переданных ID и атомарно подменяет файл."""
+        tmp_path = self.path + ".tmp"
+        self.close()
+        self._create(tmp_path)
+        os.replace(tmp_path, self.path)
+        self._open()
+        self.add_many(digests)
+        self.flush()
+
+    def flush(self) -> None:
+        """Записывает заголовок и сбрасывает страницы на диск."""
+        self._bits[:_HEADER.size] = _HEADER.pack(
+            _MAGIC, self.num_bits, self.num_hashes, self.count, self.created
+        )
+        self._bits.flush()
+
+    def close(self) -> None:
+        if getattr(self, "_bits", None) is not None:
+            self.flush()
+            self._bits.close()
+            self._file.close()
+            self._bits = None
+
+    def _positions(self, digest: bytes) -> List[int]:
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        m = self.num_bits
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    def _is_compatible(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "rb") as f:
+            header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return False
+        magic, num_bits, num_hashes, _, _ = _HEADER.unpack(header)
+        return (
+            magic == _MAGIC
+            and num_bits == self.num_bits
+            and num_hashes == self.num_hashes
+            and os.path.getsize(self.path) == self.size_bytes
+        )
+
+    def _create(self, path: str) -> None:
+        with open(path, "wb") as f:
+            f.write(
+                _HEADER.pack(_MAGIC, self.num_bits, self.num_hashes, 0, time.time())
+            )
+            f.truncate(self.size_bytes)
+
+    def _open(self) -> None:
+        self._file = open(self.path, "r+b")
+        self._bits = mmap.mmap(self._file.fileno(), self.size_bytes)
+        _, _, _, self.count, self.created = _HEADER.unpack(self._bits[: _HEADER.size])
@@ -8,18 +8,175 @@ KEYCLOAK_CLIENT_ID = "admin-cli"
 KEYCLOAK_USERNAME = "your_admin_user"  # os.getenv("KEYCLOAK_USERNAME", None)
 KEYCLOAK_PASSWORD = "your_admin_password"  # os.getenv("KEYCLOAK_PASSWORD", None)
 
+# Realms, события которых собираются (user и admin events): список имен
+# или "*" - все realms Keycloak (список запрашивается в каждом цикле).
+# Пустой список - только KEYCLOAK_ADMIN_REALM
+KEYCLOAK_REALMS = []
+# Realms, загружаемых одновременно (для user и admin events отдельно).
+# HTTP_POOL_SIZE должен быть не меньше 2 * KEYCLOAK_REALM_WORKERS + 1
+KEYCLOAK_REALM_WORKERS = 4
+
+KEYCLOAK_PAGE_SIZE = 100  # событий на страницу (параметры first/max)
+# Токен обновляется за N секунд до истечения
+KEYCLOAK_TOKEN_REFRESH_MARGIN = 10
+
 APP_API_URL = "https://sf.app.url/api"
 APP_API_TOKEN = "eyJhbGc..."
 
+# HTTP клиент (общий пул keep-alive соединений к Keycloak и Scanfactory)
+HTTP_CONNECT_TIMEOUT = 5  # сек
+HTTP_READ_TIMEOUT = 30  # сек
+HTTP_POOL_SIZE = 10  # соединений на хост
+
 SYSLOG_HOST = "localhost"
 SYSLOG_PORT = 514  # или 6514 с ssl context
+SYSLOG_TIMEOUT = 10  # таймаут подключения/отправки, сек
+# Возобновление TLS сессии (session ticket / session ID) при переподключении
+# к тому же серверу - без полного handshake с проверкой цепочки сертификатов.
+# Сессия хранится в памяти процесса: в режиме службы она переживает
+# переподключения, новый запуск начинает с полного handshake
+SYSLOG_TLS_SESSION_RESUMPTION = True
+# Ожидание session ticket TLS 1.3 после первой записи в соединение и перед
+# закрытием, сек (сервер присылает его после handshake)
+SYSLOG_TLS_TICKET_WAIT = 0.2
+
+# Фрейминг по RFC6587: "octet-counting" (длина перед сообщением)
+# или "non-transparent" (сообщения разделяются переводом строки)
+SYSLOG_FRAMING = "octet-counting"
+SYSLOG_BATCH_MAX_BYTES = 256 * 1024  # размер буфера отправки
+SYSLOG_BATCH_MAX_MESSAGES = 500  # макс. сообщений в одной пачке
+
+# Транспорт: "tcp" (TLS на порту 6514), "udp" (RFC5426, без подтверждений)
+# или "relp" (подтверждение каждого сообщения сервером)
+SYSLOG_TRANSPORT = "tcp"
+# Транспорт для отдельных классов событий, ключ - facility или
+# (facility, severity), например {4: "udp", 13: "relp"}; остальные
+# события отправляются через SYSLOG_TRANSPORT
+SYSLOG_TRANSPORT_BY_FACILITY = {}
+# Порты транспортов, не указанных здесь - SYSLOG_PORT
+SYSLOG_TRANSPORT_PORTS = {"udp": 514, "relp": 2514}
+SYSLOG_UDP_MAX_MESSAGE_SIZE = 2048  # длиннее - обрезается (RFC5426)
+SYSLOG_RELP_WINDOW = 128  # макс. неподтвержденных сообщений RELP
+
+# Несколько получателей: события загружаются один раз и отправляются всем,
+# у каждого свое соединение, позиция в outbox и пауза после ошибки.
+# Параметры, не указанные для получателя, берутся из SYSLOG_* выше:
+# SYSLOG_DESTINATIONS = [
+#     {"name": "siem", "host": "siem.domain", "port": 6514},
+#     {"name": "backup", "host": "backup.domain", "transport": "udp"},
+# ]
+# Пустой список - один получатель SYSLOG_HOST:SYSLOG_PORT
+SYSLOG_DESTINATIONS = []
+# После ошибки отправка получателю приостанавливается (circuit breaker),
+# сообщения ждут в outbox. Пауза, сек: SYSLOG_RETRY_INTERVAL после первой
+# ошибки, удваивается с каждой следующей подряд до SYSLOG_RETRY_MAX_INTERVAL
+SYSLOG_RETRY_INTERVAL = 30
+SYSLOG_RETRY_MAX_INTERVAL = 600
+
+# Ограничение скорости отправки на соединение (token bucket), сообщений/сек;
+# None - без ограничения. Скорость подстраивается под коллектор (AIMD):
+# после быстро записанной пачки растет на SYSLOG_RATE_INCREASE (до
+# SYSLOG_RATE_LIMIT), после обрыва соединения или пачки, записанной дольше
+# SYSLOG_RATE_LATENCY_TARGET, умножается на SYSLOG_RATE_DECREASE
+SYSLOG_RATE_LIMIT = None
+SYSLOG_RATE_BURST = 1000  # сообщений, отправляемых подряд без ожидания
+SYSLOG_RATE_MIN = 50  # нижняя граница скорости, сообщений/сек
+SYSLOG_RATE_INCREASE = 50  # сообщений/сек
+SYSLOG_RATE_DECREASE = 0.5
+SYSLOG_RATE_LATENCY_TARGET = 1.0  # сек на пачку
+# Повторы отправки после обрыва соединения или отказа в подключении:
+# пауза перед n-й попыткой - от половины до SYSLOG_RECONNECT_BACKOFF * 2^(n-1)
+# сек, не больше SYSLOG_RECONNECT_BACKOFF_MAX
+SYSLOG_RECONNECT_ATTEMPTS = 3
+SYSLOG_RECONNECT_BACKOFF = 0.5
+SYSLOG_RECONNECT_BACKOFF_MAX = 10
+
+# Первый запуск (или источник без сохраненной отметки) получает события
+# за последние N часов, дальше - только новые с момента последнего события
+FETCH_WINDOW_HOURS = 1
 
 # --------------------------------------------------
 SHORT_LOGS = True  # Если True, из события приложения убирает детали (поле details)
 # Например, убирает список добавленных 20000 хостов или 
 # информацию о 20 новых шаблонах
 
+# Макс. размер syslog сообщения, байт (None - без ограничения). Сообщение
+# длиннее делится на несколько: details раскладываются по частям, у каждой
+# части тот же id события и поля part (номер) и parts (число частей).
+# Полезно при SHORT_LOGS = False - details не теряются и не обрезаются
+# коллектором
+SYSLOG_MAX_MESSAGE_SIZE = None
+# Лимиты по типам событий (event_type), например {"proj-upd": 64 * 1024};
+# остальные - SYSLOG_MAX_MESSAGE_SIZE
+SYSLOG_MAX_MESSAGE_SIZE_BY_TYPE = {}
+
+# Правила обработки событий до нормализации и записи в БД (event_rules.py).
+# Для события действует первое правило, подходящее по source ("keycloak_user",
+# "keycloak_admin", "app"; не указан - любой) и event_type (тип или список;
+# не указан - любой). Действия:
+#   "keep" - обработать как обычно (исключение для правил ниже)
+#   "drop" - отбросить
+#   "sample" - оставить каждое n-е событие ("n")
+#   "rate_cap" - не больше "limit" событий пользователя за "per" сек
+#                (по времени события, по умолчанию 3600)
+#   "route" - отправить с другим "facility" и/или только получателю
+#             "destination" (имя из SYSLOG_DESTINATIONS)
+# EVENT_RULES = [
+#     {"source": "keycloak_user", "event_type": "CODE_TO_TOKEN", "action": "drop"},
+#     {"event_type": ["LOGIN_ERROR"], "action": "rate_cap", "limit": 10},
+#     {"source": "app", "event_type": "proj-upd", "action": "sample", "n": 10},
+#     {"source": "keycloak_admin", "action": "route", "destination": "siem"},
+# ]
+# Если для источника Keycloak правила с типами событий заканчиваются "drop"
+# без event_type, остальные типы не загружаются из Keycloak вообще
+# (фильтр type / operationTypes в запросе)
+EVENT_RULES = []
+
 EVENT_ID_FILE = "storage/events.db"
+# Окно дедупликации: в память загружаются только ID, сохраненные за это время.
+# Должно быть больше периода, за который запрашиваются события (1 час)
+DEDUP_WINDOW_HOURS = 3
+# Алгоритм ID события: "sha256", "blake2b" или "xxhash" (pip3 install xxhash,
+# самый быстрый). При смене алгоритма в течение DEDUP_WINDOW_HOURS события
+# проверяются и по ID прежнего алгоритма, повторной отправки не будет
+EVENT_ID_HASH = "sha256"
+# Фильтр Блума рядом с БД (storage/events.bloom): проверка "событие новое"
+# без обращения к SQLite и без загрузки ID в память. Вместо окна
+# дедупликации используется точная проверка по всей БД
+DEDUP_BLOOM_FILTER = False
+BLOOM_FILTER_CAPACITY = 5_000_000  # расчетное число ID в БД
+BLOOM_FILTER_FP_RATE = 0.001  # доля ложных срабатываний
+BLOOM_FILTER_REBUILD_HOURS = 24  # пересоздавать после очистки не чаще раза в N ч
+# Срок хранения ID событий в БД, очистка выполняется при каждом запуске
+RETENTION_DAYS = 30
+# Outbox: события ставятся в очередь в БД и удаляются после доставки;
+# после недоступности syslog сервера очередь дочитывается пачками по N
+OUTBOX_BATCH_SIZE = 5000
+
+# Асинхронный конвейер (python3 main.py --async): источники опрашиваются
+# параллельно, события отправляются по мере получения
+ASYNC_PIPELINE = False
+PIPELINE_QUEUE_SIZE = 1000  # макс. событий в очереди между стадиями
+PIPELINE_CHUNK_SIZE = 100  # событий в одном куске от загрузчика
+
+# Режим службы (python3 main.py daemon)
+DAEMON_POLL_INTERVAL = 60  # интервал опроса источника по умолчанию, сек
+DAEMON_POLL_INTERVALS = {  # интервалы опроса по источникам, сек
+    "keycloak_user": 30,
+    "keycloak_admin": 60,
+    "app": 60,
+}
+DAEMON_MAINTENANCE_INTERVAL = 3600  # очистка БД и перезагрузка кеша, сек
+# Метрики Prometheus по HTTP в режиме службы (http://host:port/metrics),
+# None - не запускать
+METRICS_PORT = None  # например 9464
+METRICS_HOST = "127.0.0.1"  # "0.0.0.0" - доступ с других хостов
+# JSON сводка каждого запуска: счетчики и время по стадиям, None - не писать
+METRICS_SUMMARY_FILE = "storage/metrics.json"
+
+# Догоняющая загрузка за период (python3 main.py backfill --from ... --to ...)
+BACKFILL_SHARD_HOURS = 24  # длина отрезка периода на один процесс, ч
+BACKFILL_WORKERS = None  # число процессов, None - по числу ядер
 
 # RFC5424 Facility codes:
 # 4/10 - security/authorization messages
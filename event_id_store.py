@@ -1,84 +1,772 @@
 import sqlite3
 import os
-from typing import Set, Dict, Any, Optional
-from datetime import datetime, timezone
-from config import EVENT_ID_FILE
-
-
-def _get_db_connection() -> sqlite3.Connection:
-    """Создает подключение к БД и инициализирует таблицу если нужно."""
-
-    db_dir = os.path.dirname(EVENT_ID_FILE)
-    if db_dir and not os.path.exists(db_dir):
-        os.makedirs(db_dir)
-
-    conn = sqlite3.connect(EVENT_ID_FILE)
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS events (
-            id TEXT PRIMARY KEY,
-            timestamp TEXT NOT NULL,
-            event_type TEXT,
-            source TEXT,
-            user TEXT,
-            priority INTEGER,
-            facility INTEGER,
-            created_at TEXT NOT NULL
+import time
+from typing import Set, Dict, Any, Iterable, List, Optional, Sequence, Tuple, Union
+from datetime import datetime, timedelta, timezone
+from bloom_filter import BloomFilter
+import metrics
+from config import (
+    EVENT_ID_FILE,
+    DEDUP_WINDOW_HOURS,
+    DEDUP_BLOOM_FILTER,
+    BLOOM_FILTER_CAPACITY,
+    BLOOM_FILTER_FP_RATE,
+    BLOOM_FILTER_REBUILD_HOURS,
+)
+
+
+# WAL позволяет читать во время записи и не делать fsync на каждый коммит
+# (при synchronous=NORMAL fsync выполняется только на checkpoint)
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",  # 16 МБ
+    # ожидание блокировки записи (backfill пишет из нескольких процессов)
+    "PRAGMA busy_timeout=30000",
+)
+
+DEFAULT_DESTINATION = "default"
+
+_EVENT_COLUMNS = (
+    "id, timestamp, event_type, source, user, priority, facility, created_at"
+)
+
+# Пачка событий сначала пишется во временную таблицу batch_events: после
+# удаления уже сохраненных ID в ней остаются ровно те события, которые
+# добавляются в events, и по ним же считаются event_rollups
+_BATCH_INSERT_SQL = f"""
+    INSERT OR IGNORE INTO temp.batch_events ({_EVENT_COLUMNS})
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Строки event_rollups по событиям: начало часа события (epoch, сек) -
+# timestamp Keycloak в миллисекундах epoch, приложения - ISO 8601; если
+# время не разобрано - час записи в БД. {table} - events или batch_events
+_ROLLUP_SELECT_SQL = """
+    SELECT
+        COALESCE(
+            CASE
+                WHEN timestamp <> '' AND timestamp NOT GLOB '*[^0-9]*'
+                THEN CAST(timestamp AS INTEGER) / 1000
+                ELSE CAST(strftime('%s', timestamp) AS INTEGER)
+            END,
+            CAST(strftime('%s', created_at) AS INTEGER)
+        ) / 3600 * 3600,
+        COALESCE(source, ''),
+        COALESCE(event_type, ''),
+        COALESCE(facility, 0),
+        COUNT(*)
+    FROM {table}
+"""
+_ROLLUP_UPSERT_SQL = f"""
+    INSERT INTO event_rollups (hour, source, event_type, facility, count)
+    {_ROLLUP_SELECT_SQL.format(table="temp.batch_events")} WHERE true
+    GROUP BY 1, 2, 3, 4
+    ON CONFLICT (hour, source, event_type, facility)
+    DO UPDATE SET count = count + excluded.count
+"""
+
+# Источник события в отчете по event_rollups - в именах источников
+# конвейера (pipeline.SOURCES). В БД у событий Keycloak source "keycloak",
+# административные события отличаются типом - OperationType Keycloak
+ROLLUP_SOURCES = ("keycloak_user", "keycloak_admin", "app")
+_ROLLUP_SOURCE_SQL = """
+    CASE
+        WHEN source <> 'keycloak' THEN source
+        WHEN event_type IN ('CREATE', 'UPDATE', 'DELETE', 'ACTION')
+        THEN 'keycloak_admin'
+        ELSE 'keycloak_user'
+    END
+"""
+
+# Группировки отчета по event_rollups (EventStore.event_counts)
+ROLLUP_GROUPS = {
+    "hour": "hour",
+    "day": "hour / 86400 * 86400",
+    "source": _ROLLUP_SOURCE_SQL,
+    "event_type": "event_type",
+    "facility": "facility",
+}
+
+
+class EventIdCache:
+    """
+    Компактное множество ID событий для дедупликации в памяти.
+
+    ID (32 hex-символа) хранятся как 16-байтные bytes, а не str: это почти
+    вдвое меньше памяти на элемент при том же времени поиска.
+    """
+
+    def __init__(self, event_ids: Iterable[str] = ()) -> None:
+        self._ids: Set[bytes] = {bytes.fromhex(event_id) for event_id in event_ids}
+
+    def __contains__(self, event_id: str) -> bool:
+        return bytes.fromhex(event_id) in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, event_id: str) -> None:
+        self._ids.add(bytes.fromhex(event_id))
+
+
+class FilteredEventIds:
+    """
+    Дедупликация через фильтр Блума хранилища без загрузки ID в память.
+
+    Отрицательный ответ фильтра окончательный ("событие новое"), и только
+    при срабатывании фильтра выполняется точная проверка event_exists().
+    ID, добавленные в текущем запуске и еще не сохраненные, держатся
+    в отдельном множестве.
+    """
+
+    def __init__(self, store: "EventStore") -> None:
+        self._store = store
+        self._pending: Set[bytes] = set()
+        self.filter_hits = 0
+
+    def __contains__(self, event_id: str) -> bool:
+        digest = bytes.fromhex(event_id)
+        if digest in self._pending:
+            return True
+        if digest not in self._store.bloom:
+            return False
+        self.filter_hits += 1
+        return self._store.event_exists(event_id)
+
+    def __len__(self) -> int:
+        return len(self._store.bloom) + len(self._pending)
+
+    def add(self, event_id: str) -> None:
+        self._pending.add(bytes.fromhex(event_id))
+
+
+DedupCache = Union[EventIdCache, FilteredEventIds]
+
+
+class EventStore:
+    """
+    Хранилище ID обработанных событий на одном долгоживущем подключении.
+
+    Схема создается один раз при открытии, вставки выполняются пачками
+    через executemany в одной транзакции.
+
+    При DEDUP_BLOOM_FILTER рядом с БД ведется фильтр Блума (events.bloom),
+    который пополняется при каждой вставке и пересоздается после очистки
+    старых записей.
+
+    Число событий по часам, источникам, типам и facility ведется в таблице
+    event_rollups: она обновляется в той же транзакции, что и вставка
+    пачки (только по действительно вставленным ID), очистка старых событий
+    ее не затрагивает. Отчеты (get_stats, event_counts) читают только ее.
+
+    Использование:
+        with EventStore() as store:
+            ids = store.load_event_ids()
+            store.store_many(metadata_list)
+    """
+
+    def __init__(
+        self, path: str = EVENT_ID_FILE, use_bloom: Optional[bool] = None
+    ) -> None:
+        """
+        Args:
+            use_bloom: Вести фильтр Блума (по умолчанию DEDUP_BLOOM_FILTER).
+                False - работать без фильтра, не трогая его файл (процессы
+                backfill; после них фильтр пересоздается rebuild_bloom())
+        """
+        self.path = path
+
+        db_dir = os.path.dirname(path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        self._conn = sqlite3.connect(path)
+        for pragma in _PRAGMAS:
+            self._conn.execute(pragma)
+        self._init_schema()
+        # Пачка вставляемых событий (см. _insert_events), у соединения своя
+        self._conn.execute(
+            "CREATE TEMP TABLE batch_events "
+            "(id TEXT PRIMARY KEY, timestamp TEXT, event_type TEXT, source TEXT, "
+            "user TEXT, priority INTEGER, facility INTEGER, created_at TEXT)"
+        )
+
+        self.bloom: Optional[BloomFilter] = None
+        bloom_path = os.path.splitext(path)[0] + ".bloom"
+        if use_bloom is None:
+            use_bloom = DEDUP_BLOOM_FILTER
+            if not use_bloom and os.path.exists(bloom_path):
+                # Фильтр не обновлялся бы при вставках - удаляем, чтобы
+                # при повторном включении он был построен заново
+                os.remove(bloom_path)
+        if use_bloom:
+            self.bloom = BloomFilter(
+                bloom_path, BLOOM_FILTER_CAPACITY, BLOOM_FILTER_FP_RATE
+            )
+            if self.bloom.is_new:
+                self.rebuild_bloom()
+
+    def __enter__(self) -> "EventStore":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def _init_schema(self) -> None:
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS events (
+                    id TEXT PRIMARY KEY,
+                    timestamp TEXT NOT NULL,
+                    event_type TEXT,
+                    source TEXT,
+                    user TEXT,
+                    priority INTEGER,
+                    facility INTEGER,
+                    created_at TEXT NOT NULL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_timestamp ON events(timestamp)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_source ON events(source)")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_created_at ON events(created_at)"
+            )
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    source TEXT PRIMARY KEY,
+                    last_time REAL NOT NULL,
+                    last_id TEXT,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+            # Очередь готовых RFC5424 сообщений на отправку (append-only) и
+            # позиция доставки для каждого получателя; destination - имя
+            # единственного получателя сообщения (NULL - все)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    event_id TEXT NOT NULL,
+                    message BLOB NOT NULL,
+                    created_at TEXT NOT NULL,
+                    destination TEXT
+                )
+            """)
+            columns = {
+                row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")
+            }
+            if "destination" not in columns:
+                # БД, созданная до появления правил route
+                self._conn.execute("ALTER TABLE outbox ADD COLUMN destination TEXT")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox_cursors (
+                    destination TEXT PRIMARY KEY,
+                    last_seq INTEGER NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            """)
+            self._init_rollups()
+
+    def _init_rollups(self) -> None:
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master "
+            "WHERE type = 'table' AND name = 'event_rollups'"
+        ).fetchone()
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS event_rollups (
+                hour INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                event_type TEXT NOT NULL,
+                facility INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (hour, source, event_type, facility)
+            ) WITHOUT ROWID
+        """)
+        if not exists:
+            # БД, созданная до появления event_rollups: счетчики по
+            # сохраненным событиям (OR IGNORE - если другой процесс уже
+            # заполнил таблицу)
+            self._conn.execute(
+                "INSERT OR IGNORE INTO event_rollups "
+                f"{_ROLLUP_SELECT_SQL.format(table='events')} GROUP BY 1, 2, 3, 4"
+            )
+
+    def _insert_events(self, rows: List[Tuple[Any, ...]]) -> None:
+        """
+        Вставляет строки событий и добавляет их в event_rollups.
+
+        Вызывается внутри транзакции. Пачка проходит через batch_events:
+        в events и в счетчики попадают только ID, которых еще нет в БД
+        (и повторы внутри пачки - один раз), независимо от того, что
+        другие процессы записывают в то же время.
+        """
+        if not self._conn.in_transaction:
+            # Блокировка записи берется сразу - иначе между проверкой ID и
+            # вставкой другой процесс (backfill) может изменить events
+            self._conn.execute("BEGIN IMMEDIATE")
+        self._conn.execute("DELETE FROM temp.batch_events")
+        self._conn.executemany(_BATCH_INSERT_SQL, rows)
+        # EXISTS - поиск по первичному ключу events для каждой строки пачки
+        # (IN (SELECT id FROM events) читал бы всю таблицу)
+        self._conn.execute(
+            "DELETE FROM temp.batch_events WHERE EXISTS "
+            "(SELECT 1 FROM main.events e WHERE e.id = batch_events.id)"
+        )
+        self._conn.execute(
+            f"INSERT INTO main.events ({_EVENT_COLUMNS}) "
+            f"SELECT {_EVENT_COLUMNS} FROM temp.batch_events"
+        )
+        self._conn.execute(_ROLLUP_UPSERT_SQL)
+
+    def close(self) -> None:
+        if self.bloom is not None:
+            self.bloom.close()
+        self._conn.close()
+
+    def dedup_cache(self, hours: float = DEDUP_WINDOW_HOURS) -> DedupCache:
+        """
+        Возвращает объект для проверки "событие уже обработано".
+
+        С фильтром Блума - FilteredEventIds, иначе ID за окно дедупликации
+        (EventIdCache). Оба поддерживают `in`, add() и len().
+        """
+        if self.bloom is not None:
+            return FilteredEventIds(self)
+        return self.load_recent_ids(hours)
+
+    def load_event_ids(self) -> Set[str]:
+        """Загружает множество ID обработанных событий из БД."""
+        return {row[0] for row in self._conn.execute("SELECT id FROM events")}
+
+    def load_recent_ids(self, hours: float = DEDUP_WINDOW_HOURS) -> EventIdCache:
+        """
+        Загружает ID событий, сохраненных за последние hours часов.
+
+        Для дедупликации достаточно окна, которое покрывает период выборки
+        событий из источников: событие, полученное повторно, было сохранено
+        не раньше своего времени, а значит попадает в окно по created_at.
+        Объем загрузки не зависит от общего размера БД.
+        """
+        since = (datetime.now(timezone.utc) - timedelta(hours=hours)).isoformat()
+        cursor = self._conn.execute(
+            "SELECT id FROM events WHERE created_at >= ?", (since,)
         )
-    """)
+        return EventIdCache(row[0] for row in cursor)
+
+    def existing_ids(self, event_ids: Iterable[str]) -> Set[str]:
+        """Возвращает ID из переданных, уже сохраненные в БД."""
+        event_ids = list(event_ids)
+        found: Set[str] = set()
+        # Ограничение числа параметров запроса в старых версиях SQLite - 999
+        for i in range(0, len(event_ids), 900):
+            chunk = event_ids[i : i + 900]
+            cursor = self._conn.execute(
+                "SELECT id FROM events WHERE id IN (%s)" % ",".join("?" * len(chunk)),
+                chunk,
+            )
+            found.update(row[0] for row in cursor)
+        return found
+
+    def event_exists(self, event_id: str) -> bool:
+        """Проверяет существование события по ID."""
+        cursor = self._conn.execute(
+            "SELECT 1 FROM events WHERE id = ? LIMIT 1", (event_id,)
+        )
+        return cursor.fetchone() is not None
+
+    def store(self, event_id: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+        """Сохраняет ID одного события (отдельной транзакцией)."""
+        self.store_many([dict(metadata or {}, id=event_id)])
+
+    def store_many(self, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        Сохраняет пачку событий в одной транзакции.
+
+        Args:
+            records: Метаданные событий, ID берется из поля "id"
+
+        Returns:
+            Количество переданных записей
+        """
+        rows = self._event_rows(records)
+        if rows:
+            with metrics.timer("store_write", op="store"), self._conn:
+                self._insert_events(rows)
+                self._add_to_bloom(rows)
+        return len(rows)
+
+    def spool_many(
+        self, records: Iterable[Tuple[Dict[str, Any], Union[bytes, Sequence[bytes]]]]
+    ) -> int:
+        """
+        Ставит события в outbox и отмечает их обработанными одной транзакцией.
+
+        После этого событие не будет потеряно: оно остается в outbox, пока
+        все получатели не подтвердят доставку (ack_outbox).
+
+        Args:
+            records: Пары (событие - dict или NormalizedEvent, готовое RFC5424
+                сообщение или список сообщений - частей события); событие с
+                полем destination доставляется только этому получателю
+
+        Returns:
+            Количество поставленных в очередь событий
+        """
+        created_at = datetime.now(timezone.utc).isoformat()
+        records = list(records)
+        rows = self._event_rows((metadata for metadata, _ in records), created_at)
+        if rows:
+            with metrics.timer("store_write", op="spool"), self._conn:
+                self._conn.executemany(
+                    "INSERT INTO outbox (event_id, message, created_at, destination) "
+                    "VALUES (?, ?, ?, ?)",
+                    (
+                        (
+                            metadata["id"],
+                            message,
+                            created_at,
+                            metadata.get("destination"),
+                        )
+                        for metadata, messages in records
+                        for message in (
+                            (messages,) if isinstance(messages, bytes) else messages
+                        )
+                    ),
+                )
+                self._insert_events(rows)
+                self._add_to_bloom(rows)
+        return len(rows)
+
+    def set_outbox_destinations(self, destinations: Iterable[str]) -> None:
+        """
+        Задает список получателей outbox.
+
+        Новый получатель начинает с позиции самого отстающего из текущих
+        (получает все, что еще не удалено из outbox), позиции получателей,
+        которых больше нет в списке, удаляются и не задерживают очистку.
+        """
+        destinations = list(destinations)
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM outbox_cursors WHERE destination NOT IN (%s)"
+                % ",".join("?" * len(destinations)),
+                destinations,
+            )
+            start = self._conn.execute(
+                "SELECT COALESCE(MIN(last_seq), 0) FROM outbox_cursors"
+            ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO outbox_cursors (destination, last_seq) "
+                "VALUES (?, ?)",
+                ((destination, start) for destination in destinations),
+            )
+
+    def outbox_batch(
+        self, limit: int, destination: str = DEFAULT_DESTINATION
+    ) -> List[Tuple[int, bytes]]:
+        """Возвращает следующие limit сообщений (seq, message) для получателя."""
+        with metrics.timer("outbox_read", destination=destination):
+            return self._conn.execute(
+                "SELECT seq, message FROM outbox WHERE seq > ? "
+                "AND (destination IS NULL OR destination = ?) ORDER BY seq LIMIT ?",
+                (self._outbox_cursor(destination), destination, limit),
+            ).fetchall()
+
+    def ack_outbox(self, seq: int, destination: str = DEFAULT_DESTINATION) -> None:
+        """
+        Подтверждает доставку получателю всех сообщений до seq включительно.
+
+        Сообщения, доставленные всем получателям, удаляются из outbox.
+        """
+        with metrics.timer("store_write", op="ack"), self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO outbox_cursors (destination, last_seq) VALUES (?, ?)
+                ON CONFLICT(destination) DO UPDATE SET last_seq = excluded.last_seq
+                """,
+                (destination, seq),
+            )
+            self._conn.execute(
+                "DELETE FROM outbox WHERE seq <= "
+                "(SELECT MIN(last_seq) FROM outbox_cursors)"
+            )
+
+    def skip_outbox(self, destination: str = DEFAULT_DESTINATION) -> None:
+        """
+        Сдвигает позицию получателя в конец outbox.
+
+        Вызывается, когда для получателя сообщений больше нет (outbox_batch
+        пуст): оставшиеся сообщения адресованы другим получателям и не
+        должны задерживать очистку outbox.
+        """
+        last_seq = self._conn.execute(
+            "SELECT MAX(seq) FROM outbox WHERE seq > ?",
+            (self._outbox_cursor(destination),),
+        ).fetchone()[0]
+        if last_seq is not None:
+            self.ack_outbox(last_seq, destination)
+
+    def outbox_size(self, destination: str = DEFAULT_DESTINATION) -> int:
+        """Количество сообщений, ожидающих доставки получателю."""
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM outbox WHERE seq > ? "
+            "AND (destination IS NULL OR destination = ?)",
+            (self._outbox_cursor(destination), destination),
+        ).fetchone()[0]
+
+    def _outbox_cursor(self, destination: str) -> int:
+        row = self._conn.execute(
+            "SELECT last_seq FROM outbox_cursors WHERE destination = ?",
+            (destination,),
+        ).fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _event_rows(
+        records: Iterable[Dict[str, Any]], created_at: Optional[str] = None
+    ) -> List[Tuple[Any, ...]]:
+        if created_at is None:
+            created_at = datetime.now(timezone.utc).isoformat()
+        return [
+            (
+                r["id"],
+                r.get("timestamp", ""),
+                r.get("event_type", ""),
+                r.get("source", ""),
+                r.get("user", ""),
+                r.get("priority", 0),
+                r.get("facility", 0),
+                created_at,
+            )
+            for r in records
+        ]
+
+    def _add_to_bloom(self, rows: List[Tuple[Any, ...]]) -> None:
+        """
+        Добавляет ID пачки в фильтр Блума и сбрасывает его на диск.
+
+        Вызывается до фиксации транзакции: после сбоя фильтр может
+        содержать лишние ID (они проверяются точным запросом в БД), но не
+        отстает от БД - иначе сохраненное событие считалось бы новым и
+        отправлялось повторно.
+        """
+        if self.bloom is not None:
+            self.bloom.add_many(bytes.fromhex(row[0]) for row in rows)
+            self.bloom.flush()
 
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON events(timestamp)")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_source ON events(source)")
-    conn.execute("CREATE INDEX IF NOT EXISTS idx_created_at ON events(created_at)")
-    conn.commit()
-    return conn
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value),
+            )
+
+    def check_id_hash(self, algorithm: str) -> Optional[str]:
+        """
+        Запоминает алгоритм ID событий, при его смене начинает миграцию.
+
+        ID, уже сохраненные в БД, пересчитать нельзя (исходные события не
+        хранятся), поэтому после смены алгоритма в течение окна
+        дедупликации события проверяются и по ID прежнего алгоритма
+        (см. legacy_id_hash). БД без записанного алгоритма, в которой уже
+        есть события, считается заполненной по sha256.
+
+        Returns:
+            Прежний алгоритм, если миграция только что началась
+        """
+        stored = self.get_meta("event_id_hash")
+        if stored is None:
+            has_events = self._conn.execute("SELECT 1 FROM events LIMIT 1").fetchone()
+            stored = "sha256" if has_events else algorithm
+            self.set_meta("event_id_hash", stored)
+        if stored == algorithm:
+            return None
+
+        self.set_meta("event_id_hash", algorithm)
+        self.set_meta("event_id_hash_previous", stored)
+        self.set_meta("event_id_hash_changed_at", str(time.time()))
+        return stored
+
+    def legacy_id_hash(self, hours: int = DEDUP_WINDOW_HOURS) -> Optional[str]:
+        """Прежний алгоритм ID, если он сменился менее hours часов назад."""
+        previous = self.get_meta("event_id_hash_previous")
+        changed_at = self.get_meta("event_id_hash_changed_at")
+        if previous is None or changed_at is None:
+            return None
+        if previous == self.get_meta("event_id_hash"):
+            return None
+        if time.time() - float(changed_at) >= hours * 3600:
+            return None
+        return previous
+
+    def get_watermark(self, source: str) -> Optional[Tuple[float, str]]:
+        """Возвращает (время epoch, ID) последнего обработанного события источника."""
+        row = self._conn.execute(
+            "SELECT last_time, last_id FROM watermarks WHERE source = ?", (source,)
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set_watermark(self, source: str, last_time: float, last_id: str) -> None:
+        """Сохраняет отметку последнего обработанного события источника."""
+        with self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO watermarks (source, last_time, last_id, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(source) DO UPDATE SET
+                    last_time = excluded.last_time,
+                    last_id = excluded.last_id,
+                    updated_at = excluded.updated_at
+                """,
+                (source, last_time, last_id, datetime.now(timezone.utc).isoformat()),
+            )
+
+    def cleanup_old_events(self, days: int = 30) -> int:
+        """
+        Удаляет события старше указанного количества дней.
+
+        Returns:
+            Количество удаленных записей
+        """
+        cutoff_date = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+        with self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM events WHERE created_at < ?", (cutoff_date,)
+            )
+        deleted = cursor.rowcount
+
+        if self.bloom is not None and (
+            self.bloom.saturated
+            or (deleted and self.bloom.age_seconds > BLOOM_FILTER_REBUILD_HOURS * 3600)
+        ):
+            self.rebuild_bloom()
+        return deleted
+
+    def rebuild_bloom(self) -> None:
+        """Заполняет фильтр Блума заново из текущего содержимого БД."""
+        if self.bloom is None:
+            return
+        cursor = self._conn.execute("SELECT id FROM events")
+        self.bloom.rebuild(bytes.fromhex(row[0]) for row in cursor)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику по хранилищу событий.
+
+        Считается по event_rollups, поэтому учитывает и события, удаленные
+        очисткой по сроку хранения.
+        """
+        by_source = {
+            row["source"] or "unknown": row["count"]
+            for row in self.event_counts(group_by=("source",))
+        }
+        return {
+            "total_events": sum(by_source.values()),
+            "by_source": by_source
+        }
+
+    def event_counts(
+        self,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        sources: Optional[Sequence[str]] = None,
+        event_types: Optional[Sequence[str]] = None,
+        group_by: Sequence[str] = ("hour",),
+    ) -> List[Dict[str, Any]]:
+        """
+        Возвращает число событий из event_rollups с группировкой.
+
+        Args:
+            since: Начало периода (epoch, сек)
+            until: Конец периода, не включительно; учитываются все часы,
+                пересекающиеся с периодом
+            sources: Только эти источники из ROLLUP_SOURCES
+            event_types: Только эти типы событий
+            group_by: Поля группировки из ROLLUP_GROUPS ("hour", "day" -
+                начало часа / суток UTC в epoch, сек)
+
+        Returns:
+            Строки {поле группировки: значение, ..., "count": число},
+            по порядку полей группировки
+        """
+        unknown = set(group_by) - set(ROLLUP_GROUPS)
+        if unknown:
+            raise ValueError(f"Неизвестная группировка: {', '.join(sorted(unknown))}")
+        unknown = set(sources or ()) - set(ROLLUP_SOURCES)
+        if unknown:
+            raise ValueError(f"Неизвестный источник: {', '.join(sorted(unknown))}")
+
+        conditions: List[str] = []
+        params: List[Any] = []
+        if since is not None:
+            conditions.append("hour >= ?")
+            params.append(int(since) // 3600 * 3600)
+        if until is not None:
+            conditions.append("hour < ?")
+            params.append(until)
+        for column, values in (
+            (_ROLLUP_SOURCE_SQL, sources),
+            ("event_type", event_types),
+        ):
+            if values:
+                conditions.append(f"{column} IN ({','.join('?' * len(values))})")
+                params.extend(values)
+
+        columns = [f"{ROLLUP_GROUPS[name]} AS {name}" for name in group_by]
+        query = f"SELECT {', '.join(columns + ['SUM(count)'])} FROM event_rollups"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        if group_by:
+            numbers = ", ".join(str(i + 1) for i in range(len(group_by)))
+            query += f" GROUP BY {numbers} ORDER BY {numbers}"
+
+        with metrics.timer("store_read", op="event_counts"):
+            rows = self._conn.execute(query, params).fetchall()
+        return [
+            dict(zip(group_by, row[:-1]), count=row[-1] or 0) for row in rows
+        ]
 
 
 def load_event_ids() -> Set[str]:
     """Загружает множество ID обработанных событий из БД."""
-    conn = _get_db_connection()
-    cursor = conn.execute("SELECT id FROM events")
-    ids = {row[0] for row in cursor.fetchall()}
-    conn.close()
-    return ids
+    with EventStore() as store:
+        return store.load_event_ids()
 
 
 def event_exists(event_id: str) -> bool:
     """Проверяет существование события по ID."""
-    conn = _get_db_connection()
-    cursor = conn.execute("SELECT 1 FROM events WHERE id = ? LIMIT 1", (event_id,))
-    exists = cursor.fetchone() is not None
-    conn.close()
-    return exists
+    with EventStore() as store:
+        return store.event_exists(event_id)
 
 
 def store_event_id(event_id: str, metadata: Optional[Dict[str, Any]] = None) -> None:
     """
     Сохраняет ID обработанного события в БД с метаданными.
 
+    Открывает отдельное подключение на каждый вызов; для сохранения
+    множества событий используйте EventStore.store_many().
+
     Args:
         event_id: Уникальный ID события
         metadata: Метаданные события (без полей info/details)
     """
-    if metadata is None:
-        metadata = {}
-
-    conn = _get_db_connection()
-    conn.execute("""
-        INSERT OR IGNORE INTO events
-        (id, timestamp, event_type, source, user, priority, facility, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        event_id,
-        metadata.get("timestamp", ""),
-        metadata.get("event_type", ""),
-        metadata.get("source", ""),
-        metadata.get("user", ""),
-        metadata.get("priority", 0),
-        metadata.get("facility", 0),
-        datetime.now(timezone.utc).isoformat()
-    ))
-    conn.commit()
-    conn.close()
+    with EventStore() as store:
+        store.store(event_id, metadata)
 
 
 def cleanup_old_events(days: int = 30) -> int:
@@ -91,31 +779,11 @@ def cleanup_old_events(days: int = 30) -> int:
     Returns:
         Количество удаленных записей
     """
-    from datetime import timedelta
-    cutoff_date = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
-
-    conn = _get_db_connection()
-    cursor = conn.execute("DELETE FROM events WHERE created_at < ?", (cutoff_date,))
-    deleted_count = cursor.rowcount
-    conn.commit()
-    conn.close()
-    return deleted_count
+    with EventStore() as store:
+        return store.cleanup_old_events(days)
 
 
 def get_stats() -> Dict[str, Any]:
     """Возвращает статистику по хранилищу событий."""
-    conn = _get_db_connection()
-
-    total = conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
-
-    by_source = {}
-    cursor = conn.execute("SELECT source, COUNT(*) FROM events GROUP BY source")
-    for row in cursor.fetchall():
-        by_source[row[0] or "unknown"] = row[1]
-
-    conn.close()
-
-    return {
-        "total_events": total,
-        "by_source": by_source
-    }
+    with EventStore() as store:
+        return store.get_stats()
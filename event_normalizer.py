@@ -1,54 +1,131 @@
 import hashlib
+from dataclasses import dataclass
+from functools import partial
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+try:
+    import xxhash
+except ImportError:  # необязательная зависимость, нужна для EVENT_ID_HASH = "xxhash"
+    xxhash = None
+
 from config import (
     USER_EVENT_PRIORITIES,
     ADMIN_EVENT_PRIORITIES,
     APP_EVENT_PRIORITIES,
     SHORT_LOGS,
+    EVENT_ID_HASH,
 )
 
+# Функции ID события: ключ события (bytes) -> 32 hex символа (16 байт).
+# Длина одинакова для всех алгоритмов, формат хранилища не меняется
+ID_HASHES: Dict[str, Callable[[bytes], str]] = {
+    "sha256": lambda key: hashlib.sha256(key).hexdigest()[:32],
+    "blake2b": lambda key: hashlib.blake2b(key, digest_size=16).hexdigest(),
+}
+if xxhash is not None:
+    ID_HASHES["xxhash"] = xxhash.xxh3_128_hexdigest
 
-def normalize_keycloak_event(
-    event: Dict[str, Any], is_admin: bool = False
-) -> Dict[str, Any]:
-    event_type = event.get("type") or event.get("operationType") or "unknown"
-    timestamp = event.get("time") or event.get("timestamp")
-    user_id = event.get("userId")
-    realm_id = event.get("realmId")
-
-    if is_admin:
-        resource_path = event.get("resourcePath", "")
-        event_id = _generate_event_id(
-            str(event_type or ""), timestamp, str(user_id or ""), resource_path
-        )
-    else:
+# Ошибки нормализации пачки: (индекс события в пачке, исключение)
+BatchErrors = List[Tuple[int, Exception]]
 
-        session_id = event.get("sessionId", "")
-        event_id = _generate_event_id(
-            str(event_type or ""), timestamp, str(user_id or ""), session_id
-        )
 
-    base = {
-        "id": event_id,
-        "timestamp": timestamp,
-        "user": user_id,
-        "realm": realm_id,
-        "event_type": event_type,
-        "details": event.get("details"),
-        "source": "keycloak",
-    }
+def get_id_hash(name: str) -> Callable[[bytes], str]:
+    """Возвращает функцию ID события по имени алгоритма."""
+    try:
+        return ID_HASHES[name]
+    except KeyError:
+        if name == "xxhash":
+            raise ValueError(
+                "EVENT_ID_HASH = \"xxhash\" требует пакет xxhash (pip3 install xxhash)"
+            ) from None
+        raise ValueError(f"Неизвестный алгоритм ID события: {name}") from None
 
-    priority_map = ADMIN_EVENT_PRIORITIES if is_admin else USER_EVENT_PRIORITIES
-    priority_facility = priority_map.get(
-        event_type, (14, 16)
-    )  # default: (Informational, local0)
-    base["priority"] = priority_facility[0]
-    base["facility"] = priority_facility[1]
-    return base
 
+@dataclass(slots=True)
+class NormalizedEvent:
+    """
+    Нормализованное событие.
+
+    Хранится в слотах, а не в словаре: в несколько раз меньше памяти на
+    событие и нет копирования при передаче в хранилище и отправку.
+    details хранится ссылкой на исходные данные события, сериализуется
+    только при формировании сообщения (to_dict / SyslogFormatter).
 
-def normalize_app_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    Поддерживает чтение как словарь (event["id"], event.get("user")),
+    поэтому принимается везде, где раньше ожидался dict события.
+    """
+
+    id: str
+    timestamp: Any
+    user: Any
+    event_type: Any
+    source: str
+    priority: int
+    facility: int
+    details: Any = None
+    realm: Any = None
+    project_id: Optional[str] = None
+    project_name: Any = None
+    # ID по прежнему алгоритму хеширования на время миграции (см. EVENT_ID_HASH),
+    # в сообщение не попадает
+    legacy_id: Optional[str] = None
+    # Единственный получатель события (правило route, см. EVENT_RULES);
+    # None - все получатели
+    destination: Optional[str] = None
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Представление события для MSG (JSON), порядок полей как раньше."""
+        if self.source == "keycloak":
+            return {
+                "id": self.id,
+                "timestamp": self.timestamp,
+                "user": self.user,
+                "realm": self.realm,
+                "event_type": self.event_type,
+                "details": self.details,
+                "source": self.source,
+                "priority": self.priority,
+                "facility": self.facility,
+            }
+        return {
+            "id": self.id,
+            "timestamp": self.timestamp,
+            "user": self.user,
+            "project_id": self.project_id,
+            "project_name": self.project_name,
+            "event_type": self.event_type,
+            "details": self.details,
+            "priority": self.priority,
+            "facility": self.facility,
+            "source": self.source,
+        }
+
+
+def normalize_keycloak_event(
+    event: Dict[str, Any],
+    is_admin: bool = False,
+    id_hash: str = EVENT_ID_HASH,
+    legacy_hash: Optional[str] = None,
+) -> NormalizedEvent:
+    """Нормализует одно событие Keycloak (см. normalize_keycloak_batch)."""
+    return _normalize_keycloak_page([event], is_admin, id_hash, legacy_hash)[0]
+
+
+def normalize_app_event(
+    event: Dict[str, Any],
+    id_hash: str = EVENT_ID_HASH,
+    legacy_hash: Optional[str] = None,
+) -> NormalizedEvent:
     """
     Нормализует события приложения к RFC5424-совместимому формату.
 
@@ -61,7 +138,7 @@ def normalize_app_event(event: Dict[str, Any]) -> Dict[str, Any]:
         "info": dict
     }
 
-    Выходной формат:
+    Выходной формат (NormalizedEvent, поля to_dict()):
     {
         "id": str,  # уникальный идентификатор события
         "timestamp": str,  # ISO8601 timestamp
@@ -74,41 +151,156 @@ def normalize_app_event(event: Dict[str, Any]) -> Dict[str, Any]:
         "source": "app"  # источник события
     }
     """
-    event_type = event.get("type", "unknown")
-    project = event.get("project", {})
-    timestamp = event.get("at")
-    user = event.get("by", "system")
+    return _normalize_app_page([event], id_hash, legacy_hash)[0]
+
+
+def normalize_keycloak_batch(
+    events: Sequence[Dict[str, Any]],
+    is_admin: bool = False,
+    id_hash: str = EVENT_ID_HASH,
+    legacy_hash: Optional[str] = None,
+) -> Tuple[List[Optional[NormalizedEvent]], BatchErrors]:
+    """
+    Нормализует страницу событий Keycloak.
 
-    event_id = _generate_event_id(event_type, timestamp, user, project.get("id"))
+    Args:
+        legacy_hash: Прежний алгоритм ID - если задан, для событий
+            вычисляется и legacy_id (миграция, см. EventStore.check_id_hash)
 
-    if timestamp:
-        if isinstance(timestamp, str):
-            normalized_timestamp = timestamp
+    Returns:
+        (события в порядке входных, None на месте ошибочных; ошибки)
+    """
+    return _normalize_batch(
+        events,
+        partial(
+            _normalize_keycloak_page,
+            is_admin=is_admin,
+            id_hash=id_hash,
+            legacy_hash=legacy_hash,
+        ),
+    )
+
+
+def normalize_app_batch(
+    events: Sequence[Dict[str, Any]],
+    id_hash: str = EVENT_ID_HASH,
+    legacy_hash: Optional[str] = None,
+) -> Tuple[List[Optional[NormalizedEvent]], BatchErrors]:
+    """Нормализует страницу событий приложения (см. normalize_keycloak_batch)."""
+    return _normalize_batch(
+        events, partial(_normalize_app_page, id_hash=id_hash, legacy_hash=legacy_hash)
+    )
+
+
+def _normalize_batch(
+    events: Sequence[Dict[str, Any]],
+    normalize_page: Callable[[Sequence[Dict[str, Any]]], List[NormalizedEvent]],
+) -> Tuple[List[Optional[NormalizedEvent]], BatchErrors]:
+    # Обычно страница нормализуется целиком за один проход; только если
+    # в ней есть некорректное событие, страница обрабатывается повторно
+    # по одному, чтобы отделить ошибочные события от остальных
+    try:
+        return list(normalize_page(events)), []
+    except Exception:
+        pass
+
+    normalized: List[Optional[NormalizedEvent]] = []
+    errors: BatchErrors = []
+    for index, event in enumerate(events):
+        try:
+            normalized.append(normalize_page([event])[0])
+        except Exception as ex:
+            normalized.append(None)
+            errors.append((index, ex))
+    return normalized, errors
+
+
+def _normalize_keycloak_page(
+    events: Sequence[Dict[str, Any]],
+    is_admin: bool,
+    id_hash: str,
+    legacy_hash: Optional[str],
+) -> List[NormalizedEvent]:
+    make_id = get_id_hash(id_hash)
+    make_legacy_id = get_id_hash(legacy_hash) if legacy_hash else None
+    priorities = (ADMIN_EVENT_PRIORITIES if is_admin else USER_EVENT_PRIORITIES).get
+    # Ключ ID: ресурс для административных событий, сессия для остальных
+    key_field = "resourcePath" if is_admin else "sessionId"
+
+    normalized = []
+    for event in events:
+        get = event.get
+        event_type = get("type") or get("operationType") or "unknown"
+        timestamp = get("time") or get("timestamp")
+        user_id = get("userId")
+
+        key = f"{event_type}|{timestamp}|{user_id or ''}|{get(key_field) or ''}"
+        key_bytes = key.encode("utf-8")
+        # default: (Informational, local0)
+        priority, facility = priorities(event_type, (14, 16))
+
+        normalized.append(
+            NormalizedEvent(
+                id=make_id(key_bytes),
+                timestamp=timestamp,
+                user=user_id,
+                realm=get("realmId"),
+                event_type=event_type,
+                details=get("details"),
+                source="keycloak",
+                priority=priority,
+                facility=facility,
+                legacy_id=make_legacy_id(key_bytes) if make_legacy_id else None,
+            )
+        )
+    return normalized
+
+
+def _normalize_app_page(
+    events: Sequence[Dict[str, Any]],
+    id_hash: str,
+    legacy_hash: Optional[str],
+) -> List[NormalizedEvent]:
+    make_id = get_id_hash(id_hash)
+    make_legacy_id = get_id_hash(legacy_hash) if legacy_hash else None
+    priorities = APP_EVENT_PRIORITIES.get
+
+    normalized = []
+    for event in events:
+        get = event.get
+        event_type = get("type", "unknown")
+        project = get("project", {})
+        timestamp = get("at")
+        user = get("by", "system")
+        project_id = project.get("id")
+
+        key = f"{event_type}|{timestamp}|{user}|{project_id or ''}"
+        key_bytes = key.encode("utf-8")
+
+        if timestamp:
+            if not isinstance(timestamp, str):
+                timestamp = timestamp.isoformat()
         else:
-            normalized_timestamp = timestamp.isoformat()
-    else:
-        normalized_timestamp = datetime.now(timezone.utc).isoformat()
-
-    priority_facility = APP_EVENT_PRIORITIES.get(
-        event_type, (14, 16)
-    )  # default: (Informational, local0)
-
-    normalized = {
-        "id": event_id,
-        "timestamp": normalized_timestamp,
-        "user": user,
-        "project_id": str(project.get("id", "")),
-        "project_name": project.get("name", ""),
-        "event_type": event_type,
-        "details": {},
-        "priority": priority_facility[0],
-        "facility": priority_facility[1],
-        "source": "app",
-    }
+            timestamp = datetime.now(timezone.utc).isoformat()
 
-    if not SHORT_LOGS:
-        normalized["details"] = event.get("info", {})
+        # default: (Informational, local0)
+        priority, facility = priorities(event_type, (14, 16))
 
+        normalized.append(
+            NormalizedEvent(
+                id=make_id(key_bytes),
+                timestamp=timestamp,
+                user=user,
+                project_id=str(project.get("id", "")),
+                project_name=project.get("name", ""),
+                event_type=event_type,
+                details={} if SHORT_LOGS else get("info", {}),
+                priority=priority,
+                facility=facility,
+                source="app",
+                legacy_id=make_legacy_id(key_bytes) if make_legacy_id else None,
+            )
+        )
     return normalized
 
 
@@ -117,6 +309,7 @@ def _generate_event_id(
     timestamp: Optional[Union[str, datetime]],
     user: str,
     project_id: Optional[Any],
+    id_hash: str = EVENT_ID_HASH,
 ) -> str:
     """
     Генерирует уникальный ID для события.
@@ -130,5 +323,4 @@ def _generate_event_id(
     ]
     key_string = "|".join(key_parts)
 
-    hash_obj = hashlib.sha256(key_string.encode("utf-8"))
-    return hash_obj.hexdigest()[:32]
+    return get_id_hash(id_hash)(key_string.encode("utf-8"))
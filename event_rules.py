@@ -0,0 +1,248 @@
+"""
+Правила обработки событий до нормализации (EVENT_RULES в config.py).
+
+Правила применяются к исходным событиям источника сразу после загрузки:
+отброшенные события не нормализуются, не хешируются и не попадают в
+хранилище. Для каждого события действует первое подходящее правило
+(условия - source и event_type), события без подходящего правила
+обрабатываются как обычно.
+
+Правила компилируются один раз (EventRules) в таблицы по источникам:
+тип события -> правило и правило по умолчанию, поэтому выбор правила -
+один поиск в словаре независимо от числа правил.
+
+Если для источника Keycloak за правилами с явными типами событий следует
+"drop" без event_type, загружать нужно только эти типы - они передаются
+в запрос к Keycloak (type / operationTypes, см. fetch_filter), остальные
+события не загружаются вообще.
+"""
+
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import keycloak_client
+import sf_client
+from config import EVENT_RULES
+from event_normalizer import NormalizedEvent
+
+ACTIONS = ("keep", "drop", "sample", "rate_cap", "route")
+
+# Тип события и пользователь в исходном событии источника - так же, как их
+# определяет event_normalizer
+EVENT_TYPE_GETTERS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "keycloak_user": lambda e: e.get("type") or "unknown",
+    "keycloak_admin": lambda e: e.get("type") or e.get("operationType") or "unknown",
+    "app": lambda e: e.get("type", "unknown"),
+}
+USER_GETTERS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "keycloak_user": lambda e: e.get("userId"),
+    "keycloak_admin": lambda e: (
+        e.get("userId") or (e.get("authDetails") or {}).get("userId")
+    ),
+    "app": lambda e: e.get("by", "system"),
+}
+# Время исходного события источника (epoch, сек) - для окон rate_cap и
+# отметок источников (pipeline)
+TIMESTAMP_PARSERS: Dict[str, Callable[[Dict[str, Any]], Optional[float]]] = {
+    "keycloak_user": keycloak_client.event_timestamp,
+    "keycloak_admin": keycloak_client.event_timestamp,
+    "app": sf_client.event_timestamp,
+}
+# Источники, для которых список загружаемых типов передается в запрос
+SERVER_FILTERED = ("keycloak_user", "keycloak_admin")
+
+
+class Rule:
+    """Скомпилированное правило EVENT_RULES с состоянием sample / rate_cap."""
+
+    __slots__ = (
+        "index",
+        "action",
+        "sources",
+        "event_types",
+        "n",
+        "limit",
+        "per",
+        "facility",
+        "destination",
+        "seen",
+        "windows",
+        "latest_window",
+    )
+
+    def __init__(self, index: int, spec: Dict[str, Any]) -> None:
+        self.index = index
+        self.action = spec.get("action")
+        if self.action not in ACTIONS:
+            self._error(f"action должен быть одним из {', '.join(ACTIONS)}")
+
+        source = spec.get("source")
+        self.sources = tuple(EVENT_TYPE_GETTERS) if source is None else (source,)
+        if source is not None and source not in EVENT_TYPE_GETTERS:
+            self._error(f"неизвестный source {source!r}")
+
+        event_type = spec.get("event_type")
+        if isinstance(event_type, str):
+            event_type = [event_type]
+        self.event_types: Optional[Tuple[str, ...]] = (
+            None if event_type is None else tuple(event_type)
+        )
+
+        self.n = self._positive(spec, "n") if self.action == "sample" else 1
+        self.limit = self._positive(spec, "limit") if self.action == "rate_cap" else 0
+        self.per = float(spec.get("per", 3600))
+        self.facility: Optional[int] = spec.get("facility")
+        self.destination: Optional[str] = spec.get("destination")
+        if self.action == "route" and self.facility is None and not self.destination:
+            self._error("для route нужен facility и/или destination")
+
+        self.seen = 0
+        # пользователь -> (номер окна per, событий в окне); хранятся только
+        # текущее и предыдущее окна, иначе в режиме службы словарь рос бы
+        # на каждого пользователя за все время работы
+        self.windows: Dict[Any, Tuple[int, int]] = {}
+        self.latest_window = 0
+
+    def _positive(self, spec: Dict[str, Any], key: str) -> int:
+        value = spec.get(key)
+        if not isinstance(value, int) or value < 1:
+            self._error(f"для {self.action} нужно целое {key} >= 1")
+        return value
+
+    def _error(self, message: str) -> None:
+        raise ValueError(f"EVENT_RULES[{self.index}]: {message}")
+
+    def admit(self, kind: str, event: Dict[str, Any]) -> bool:
+        """Решает, пропустить ли событие дальше (для sample/rate_cap - со счетом)."""
+        action = self.action
+        if action == "drop":
+            return False
+        if action == "sample":
+            self.seen += 1
+            return (self.seen - 1) % self.n == 0
+        if action == "rate_cap":
+            timestamp = TIMESTAMP_PARSERS[kind](event) or time.time()
+            window = int(timestamp // self.per)
+            if window > self.latest_window:
+                self._prune_windows(window)
+            user = USER_GETTERS[kind](event)
+            current, count = self.windows.get(user, (window, 0))
+            if current != window:
+                count = 0
+            if count >= self.limit:
+                return False
+            self.windows[user] = (window, count + 1)
+        return True
+
+    def _prune_windows(self, window: int) -> None:
+        # Предыдущее окно остается для событий, пришедших не по порядку
+        self.latest_window = window
+        self.windows = {
+            user: state
+            for user, state in self.windows.items()
+            if state[0] >= window - 1
+        }
+
+
+class EventRules:
+    """
+    Правила EVENT_RULES, скомпилированные в таблицы по источникам.
+
+    Создается один раз при запуске: счетчики sample и окна rate_cap
+    сохраняются между циклами службы.
+    """
+
+    def __init__(self, rules: Sequence[Dict[str, Any]] = EVENT_RULES) -> None:
+        self.rules = [Rule(index, spec) for index, spec in enumerate(rules)]
+        # источник -> (тип события -> правило, правило для остальных типов)
+        self._tables: Dict[str, Tuple[Dict[str, Rule], Optional[Rule]]] = {}
+        for kind in EVENT_TYPE_GETTERS:
+            by_type: Dict[str, Rule] = {}
+            default = None
+            for rule in self.rules:
+                if kind not in rule.sources:
+                    continue
+                if rule.event_types is None:
+                    default = rule
+                    break  # правила после него для источника не действуют
+                for event_type in rule.event_types:
+                    by_type.setdefault(event_type, rule)
+            self._tables[kind] = (by_type, default)
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    def select(
+        self, kind: str, events: Sequence[Dict[str, Any]]
+    ) -> Tuple[List[Dict[str, Any]], List[Optional[Rule]], List[Dict[str, Any]]]:
+        """
+        Применяет правила к странице исходных событий источника.
+
+        Returns:
+            (пропущенные события, правило route для каждого из них или None,
+            отброшенные события)
+        """
+        by_type, default = self._tables[kind]
+        if not by_type and default is None:
+            return list(events), [None] * len(events), []
+
+        get_type = EVENT_TYPE_GETTERS[kind]
+        kept: List[Dict[str, Any]] = []
+        routes: List[Optional[Rule]] = []
+        dropped: List[Dict[str, Any]] = []
+        for event in events:
+            rule = by_type.get(get_type(event), default)
+            if rule is None:
+                kept.append(event)
+                routes.append(None)
+            elif rule.admit(kind, event):
+                kept.append(event)
+                routes.append(rule if rule.action == "route" else None)
+            else:
+                dropped.append(event)
+        return kept, routes, dropped
+
+    def server_types(self, kind: str) -> Optional[List[str]]:
+        """
+        Типы событий, которые нужно загружать (None - все).
+
+        Определены, если все остальные типы источника отбрасываются
+        правилом "drop" без event_type.
+        """
+        by_type, default = self._tables[kind]
+        if default is None or default.action != "drop":
+            return None
+        return sorted(t for t, rule in by_type.items() if rule.action != "drop")
+
+    def fetch_filter(self, kind: str) -> Dict[str, List[str]]:
+        """Аргументы загрузчика источника (types=) с фильтром типов на сервере."""
+        types = self.server_types(kind) if kind in SERVER_FILTERED else None
+        return {} if types is None else {"types": types}
+
+    def check_destinations(self, names: Sequence[str]) -> None:
+        """Проверяет, что получатели правил route есть в SYSLOG_DESTINATIONS."""
+        for rule in self.rules:
+            if rule.destination and rule.destination not in names:
+                rule._error(
+                    f"получатель {rule.destination!r} не найден "
+                    f"(есть: {', '.join(names)})"
+                )
+
+
+def apply_routes(
+    normalized: Sequence[Optional[NormalizedEvent]],
+    routes: Sequence[Optional[Rule]],
+) -> None:
+    """
+    Применяет правила route к нормализованным событиям страницы.
+
+    Args:
+        normalized: События в порядке select (None - ошибка нормализации)
+        routes: Правила route из select для каждого события
+    """
+    for event, rule in zip(normalized, routes):
+        if event is None or rule is None:
+            continue
+        if rule.facility is not None:
+            event.facility = rule.facility
+        event.destination = rule.destination
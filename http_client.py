@@ -0,0 +1,58 @@
+"""
+Общий HTTP клиент для Keycloak и Scanfactory API.
+
+Все запросы идут через одну requests.Session с пулом keep-alive соединений,
+поэтому DNS, TCP и TLS установка выполняются один раз на хост, а не на
+каждый запрос. Таймауты подключения/чтения задаются в config.py.
+"""
+
+import threading
+from typing import Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_POOL_SIZE
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Возвращает общую сессию, создавая ее при первом обращении."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers["Accept-Encoding"] = "gzip, deflate"
+                _session = session
+    return _session
+
+
+def close_session() -> None:
+    """Закрывает общую сессию и ее соединения."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def request(method: str, url: str, **kwargs: Any) -> requests.Response:
+    """Выполняет запрос через общую сессию с таймаутами по умолчанию."""
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs: Any) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs: Any) -> requests.Response:
+    return request("POST", url, **kwargs)
@@ -1,31 +1,97 @@
 import requests
 import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import UTC, datetime, timedelta
-from typing import Any, Dict, List
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+import http_client
+import metrics
 from config import (
     KEYCLOAK_URL,
     KEYCLOAK_ADMIN_REALM,
+    KEYCLOAK_REALMS,
+    KEYCLOAK_REALM_WORKERS,
     KEYCLOAK_CLIENT_ID,
     KEYCLOAK_USERNAME,
     KEYCLOAK_PASSWORD,
+    KEYCLOAK_PAGE_SIZE,
+    KEYCLOAK_TOKEN_REFRESH_MARGIN,
+    FETCH_WINDOW_HOURS,
 )
 
 logger = logging.getLogger(__name__)
 
+# Кеш токена администратора: access_token переиспользуется до истечения
+# (с запасом KEYCLOAK_TOKEN_REFRESH_MARGIN), затем обновляется через
+# refresh_token и только при его отсутствии/истечении - по паролю
+_token_lock = threading.Lock()
+_token_cache: Dict[str, Any] = {}
+
 
 def get_admin_token() -> str:
+    """Возвращает действующий токен администратора Keycloak."""
+    with _token_lock:
+        now = time.monotonic()
+        if now < _token_cache.get("expires_at", 0):
+            return _token_cache["access_token"]
+
+        if now < _token_cache.get("refresh_expires_at", 0):
+            try:
+                return _request_token(
+                    {
+                        "client_id": KEYCLOAK_CLIENT_ID,
+                        "grant_type": "refresh_token",
+                        "refresh_token": _token_cache["refresh_token"],
+                    }
+                )
+            except (requests.exceptions.RequestException, KeyError):
+                logger.warning("Не удалось обновить токен Keycloak, вход по паролю")
+
+        return _request_token(
+            {
+                "client_id": KEYCLOAK_CLIENT_ID,
+                "username": KEYCLOAK_USERNAME,
+                "password": KEYCLOAK_PASSWORD,
+                "grant_type": "password",
+            }
+        )
+
+
+def _request_token(data: Dict[str, str]) -> str:
     url = f"{KEYCLOAK_URL}/realms/{KEYCLOAK_ADMIN_REALM}/protocol/openid-connect/token"
-    data = {
-        "client_id": KEYCLOAK_CLIENT_ID,
-        "username": KEYCLOAK_USERNAME,
-        "password": KEYCLOAK_PASSWORD,
-        "grant_type": "password",
-    }
 
     try:
-        response = requests.post(url, data=data, timeout=10)
-        response.raise_for_status()
-        return response.json()["access_token"]
+        requested_at = time.monotonic()
+        with metrics.timer("keycloak_token"):
+            response = http_client.post(url, data=data)
+            response.raise_for_status()
+            token = response.json()
+
+        _token_cache.clear()
+        _token_cache["access_token"] = token["access_token"]
+        _token_cache["expires_at"] = (
+            requested_at + token.get("expires_in", 0) - KEYCLOAK_TOKEN_REFRESH_MARGIN
+        )
+        if token.get("refresh_token"):
+            _token_cache["refresh_token"] = token["refresh_token"]
+            _token_cache["refresh_expires_at"] = (
+                requested_at
+                + token.get("refresh_expires_in", 0)
+                - KEYCLOAK_TOKEN_REFRESH_MARGIN
+            )
+        return token["access_token"]
     except requests.exceptions.RequestException as e:
         logger.error(f"Ошибка получения токена Keycloak: {e}")
         if hasattr(e, "response") and e.response is not None:
@@ -36,58 +102,267 @@ def get_admin_token() -> str:
         raise
 
 
+def event_timestamp(event: Dict[str, Any]) -> Optional[float]:
+    """Возвращает время события Keycloak в секундах epoch (None если нет)."""
+    event_time = event.get("time") or event.get("timestamp")
+    if not event_time:
+        return None
+    if isinstance(event_time, (int, float)):
+        return event_time / 1000
+    try:
+        return datetime.fromisoformat(event_time.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
 def fetch_keycloak_events(
-    event_type: str, access_token: str, hours: int = 1
+    event_type: str,
+    access_token: Optional[str] = None,
+    since: Optional[float] = None,
+    hours: int = FETCH_WINDOW_HOURS,
+    until: Optional[float] = None,
+    realm: str = KEYCLOAK_ADMIN_REALM,
+    types: Optional[Sequence[str]] = None,
 ) -> List[Dict[str, Any]]:
+    """Получает события Keycloak списком (см. iter_keycloak_events)."""
+    return list(
+        iter_keycloak_events(
+            event_type, access_token, since, hours, until, realm, types
+        )
+    )
+
+
+def iter_keycloak_events(
+    event_type: str,
+    access_token: Optional[str] = None,
+    since: Optional[float] = None,
+    hours: int = FETCH_WINDOW_HOURS,
+    until: Optional[float] = None,
+    realm: str = KEYCLOAK_ADMIN_REALM,
+    types: Optional[Sequence[str]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Отдает события realm Keycloak, произошедшие не раньше since, по одному.
+
+    Keycloak отдает события от новых к старым, поэтому страницы (first/max)
+    запрашиваются до первого события старше since - объем загрузки зависит
+    от числа новых событий, а не от размера окна. Следующая страница
+    запрашивается только когда обработана предыдущая, поэтому в памяти
+    находится не больше KEYCLOAK_PAGE_SIZE событий.
+
+    Args:
+        event_type: "events" или "admin-events"
+        access_token: Токен администратора; если не задан, берется из кеша
+            get_admin_token() перед каждой страницей (не истечет при
+            долгой загрузке)
+        since: Время (epoch, сек), начиная с которого нужны события
+            (включительно); если не задано - последние hours часов. События
+            с временем отметки realm загружаются повторно, уже обработанные
+            из них отсеивает pipeline (Watermarks.processed)
+        until: Время (epoch, сек), до которого нужны события (не
+            включительно); если не задано - до текущего момента
+        realm: Realm, события которого запрашиваются
+        types: Загружать только эти типы событий (type для events,
+            operationTypes для admin-events); None - все, пустой - ни одного
+    """
+    if types is not None and not types:
+        return
+
     now = datetime.now(tz=UTC)
-    since = now - timedelta(hours=hours)
+    if since is None:
+        since = (now - timedelta(hours=hours)).timestamp()
 
     # по формату киклок поддерживает дни при запросе ивентов
-    yesterday = since - timedelta(days=1)
-    date_from = yesterday.strftime("%Y-%m-%d")
-    date_to = now.strftime("%Y-%m-%d")
+    day_before = datetime.fromtimestamp(since, tz=UTC) - timedelta(days=1)
+    date_from = day_before.strftime("%Y-%m-%d")
+    if until is None:
+        date_to = now.strftime("%Y-%m-%d")
+    else:
+        day_after = datetime.fromtimestamp(until, tz=UTC) + timedelta(days=1)
+        date_to = day_after.strftime("%Y-%m-%d")
 
-    url = f"{KEYCLOAK_URL}/admin/realms/{KEYCLOAK_ADMIN_REALM}/{event_type}"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    params = {
-        "dateFrom": date_from,
-        "dateTo": date_to,
-    }
+    url = f"{KEYCLOAK_URL}/admin/realms/{realm}/{event_type}"
+    type_param = "operationTypes" if event_type == "admin-events" else "type"
 
     try:
-        response = requests.get(url, headers=headers, params=params, timeout=30)
-        response.raise_for_status()
-        events = response.json()
-
-        filtered_events = []
-        since_timestamp = since.timestamp()
-        for event in events:
-
-            event_time = event.get("time") or event.get("timestamp")
-            if event_time:
-                if isinstance(event_time, int):
-                    event_timestamp = event_time / 1000
-                else:
-                    try:
-                        event_dt = datetime.fromisoformat(
-                            event_time.replace("Z", "+00:00")
-                        )
-                        event_timestamp = event_dt.timestamp()
-                    except:
-                        filtered_events.append(event)
-                        continue
-
-                if event_timestamp >= since_timestamp:
-                    filtered_events.append(event)
-            else:
-                filtered_events.append(event)
+        count = 0
+        total = 0
+        first = 0
+        while True:
+            params: Dict[str, Any] = {
+                "dateFrom": date_from,
+                "dateTo": date_to,
+                "first": first,
+                "max": KEYCLOAK_PAGE_SIZE,
+            }
+            if types is not None:
+                params[type_param] = list(types)
+            token = access_token or get_admin_token()
+            headers = {"Authorization": f"Bearer {token}"}
+            with metrics.timer(
+                "keycloak_request", event_type=event_type, realm=realm
+            ):
+                response = http_client.get(url, headers=headers, params=params)
+                response.raise_for_status()
+                page = response.json()
+            total += len(page)
+
+            reached_since = False
+            for event in page:
+                event_ts = event_timestamp(event)
+                if event_ts is not None and event_ts < since:
+                    reached_since = True
+                    break
+                if until is not None and event_ts is not None and event_ts >= until:
+                    continue
+                count += 1
+                yield event
+
+            if reached_since or len(page) < KEYCLOAK_PAGE_SIZE:
+                break
+            first += KEYCLOAK_PAGE_SIZE
 
         logger.info(
-            f"Получено {len(filtered_events)}/{len(events)} событий типа {event_type} за последний {hours} час(а)"
+            f"Получено {count}/{total} событий типа {event_type} "
+            f"realm {realm} начиная с {datetime.fromtimestamp(since, tz=UTC).isoformat()}"
         )
-        return filtered_events
     except requests.exceptions.RequestException as e:
-        logger.error(f"Ошибка получения событий Keycloak ({event_type}): {e}")
+        logger.error(
+            f"Ошибка получения событий Keycloak ({event_type}, realm {realm}): {e}"
+        )
         if hasattr(e, "response") and e.response is not None:
             logger.error(f"Статус: {e.response.status_code}, Ответ: {e.response.text}")
         raise
+
+
+def get_realms() -> List[str]:
+    """
+    Возвращает realms, события которых собираются (KEYCLOAK_REALMS).
+
+    Для "*" список realms запрашивается у Keycloak.
+    """
+    if KEYCLOAK_REALMS != "*":
+        return list(KEYCLOAK_REALMS) or [KEYCLOAK_ADMIN_REALM]
+
+    url = f"{KEYCLOAK_URL}/admin/realms"
+    headers = {"Authorization": f"Bearer {get_admin_token()}"}
+    try:
+        with metrics.timer("keycloak_realms"):
+            response = http_client.get(
+                url, headers=headers, params={"briefRepresentation": "true"}
+            )
+            response.raise_for_status()
+            realms = [realm["realm"] for realm in response.json()]
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Ошибка получения списка realms Keycloak: {e}")
+        raise
+    logger.debug(f"Realms Keycloak: {', '.join(realms)}")
+    return realms
+
+
+def iter_realm_pages(
+    event_type: str,
+    realms: Dict[str, Optional[float]],
+    hours: int = FETCH_WINDOW_HOURS,
+    until: Optional[float] = None,
+    workers: int = KEYCLOAK_REALM_WORKERS,
+    on_error: Optional[Callable[[str, Exception], None]] = None,
+    types: Optional[Sequence[str]] = None,
+) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    Загружает события нескольких realms одновременно, отдает (realm, страница).
+
+    Каждый realm загружается в своем потоке пула из workers потоков (см.
+    iter_keycloak_events), токен и пул HTTP соединений общие. Страницы
+    отдаются по мере получения; пока вызывающий их не забрал, загрузка
+    ждет (не больше 2 * workers страниц в памяти).
+
+    Args:
+        realms: Realm -> время (epoch, сек), начиная с которого нужны
+            события; None - последние hours часов
+        on_error: Вызывается для realm, загрузка которого прервалась
+            ошибкой, остальные realms загружаются дальше; если не задан,
+            ошибка передается вызывающему
+        types: Фильтр типов событий (см. iter_keycloak_events)
+    """
+    if not realms:
+        return
+    pages: "queue.Queue[Tuple[str, Union[List[Dict[str, Any]], Exception, None]]]"
+    pages = queue.Queue(maxsize=2 * workers)
+    stop = threading.Event()
+
+    def put(item: Tuple[str, Any]) -> bool:
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch(realm: str, since: Optional[float]) -> None:
+        try:
+            page: List[Dict[str, Any]] = []
+            for event in iter_keycloak_events(
+                event_type,
+                since=since,
+                hours=hours,
+                until=until,
+                realm=realm,
+                types=types,
+            ):
+                page.append(event)
+                if len(page) >= KEYCLOAK_PAGE_SIZE:
+                    if not put((realm, page)):
+                        return
+                    page = []
+            if page and not put((realm, page)):
+                return
+            put((realm, None))
+        except Exception as ex:
+            put((realm, ex))
+
+    executor = ThreadPoolExecutor(
+        max_workers=min(workers, len(realms)), thread_name_prefix=event_type
+    )
+    try:
+        for realm, since in realms.items():
+            executor.submit(fetch, realm, since)
+        remaining = len(realms)
+        while remaining:
+            realm, item = pages.get()
+            if isinstance(item, list):
+                yield realm, item
+                continue
+            remaining -= 1
+            if isinstance(item, Exception):
+                if on_error is None:
+                    raise item
+                on_error(realm, item)
+    finally:
+        # Остановить загрузку остальных realms, если вызывающий прервал
+        # чтение или пришла ошибка
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_realms_events(
+    event_type: str,
+    since: Optional[float] = None,
+    hours: int = FETCH_WINDOW_HOURS,
+    until: Optional[float] = None,
+    realms: Optional[List[str]] = None,
+    types: Optional[Sequence[str]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Отдает события всех realms (по умолчанию get_realms()) по одному.
+
+    Realms загружаются одновременно (iter_realm_pages), ошибка любого
+    прерывает загрузку.
+    """
+    if realms is None:
+        realms = get_realms()
+    for _, page in iter_realm_pages(
+        event_type, dict.fromkeys(realms, since), hours, until, types=types
+    ):
+        yield from page
@@ -4,19 +4,49 @@
 
 Собирает события из нескольких источников, нормализует их к RFC5424 формату
 и отправляет на удаленный syslog сервер через TLS.
+
+Запуск:
+    python3 main.py [run]   - один цикл экспорта (например, из cron)
+    python3 main.py daemon  - служба с периодическим опросом источников
+    python3 main.py backfill --from 2024-01-01 --to 2024-02-01
+                            - догоняющая загрузка за период в пуле процессов
+    python3 main.py stats --event-type LOGIN_ERROR --by hour
+                            - число обработанных событий за период
 """
 
+import argparse
 import json
+import signal
 import sys
 import logging
-from datetime import datetime
-from typing import Any, Dict
+import threading
+import time
+from contextlib import ExitStack
+from datetime import UTC, datetime
+from typing import Any, Dict, List, Optional
 
-from keycloak_client import get_admin_token, fetch_keycloak_events
-from sf_client import fetch_app_events
-from event_normalizer import normalize_keycloak_event, normalize_app_event
-from event_id_store import load_event_ids, store_event_id
-from syslog_sender import send_syslog_event
+from backfill import run_backfill
+from config import (
+    ASYNC_PIPELINE,
+    BACKFILL_SHARD_HOURS,
+    BACKFILL_WORKERS,
+    DEDUP_WINDOW_HOURS,
+    RETENTION_DAYS,
+    DAEMON_POLL_INTERVAL,
+    DAEMON_POLL_INTERVALS,
+    DAEMON_MAINTENANCE_INTERVAL,
+    EVENT_ID_HASH,
+    METRICS_HOST,
+    METRICS_PORT,
+    METRICS_SUMMARY_FILE,
+)
+import metrics
+from event_id_store import ROLLUP_GROUPS, DedupCache, EventStore
+from event_normalizer import get_id_hash
+from event_rules import EventRules
+from http_client import close_session
+from pipeline import SOURCES, new_stats, run_cycle
+from syslog_sender import Destination, create_destinations
 
 logging.basicConfig(
     level=logging.INFO,
@@ -25,143 +55,409 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+STATS_DEFAULT_DAYS = 7  # период отчета stats без --from
 
-def _extract_metadata(event: Dict[str, Any]) -> Dict[str, Any]:
-    """Извлекает только ключевые метаданные для хранения в БД."""
-    return {
-        "id": event.get("id", ""),
-        "timestamp": event.get("timestamp", ""),
-        "user": event.get("user", ""),
-        "event_type": event.get("event_type", ""),
-        "source": event.get("source", ""),
-        "priority": event.get("priority", 0),
-        "facility": event.get("facility", 0),
-    }
 
+def _parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        default=ASYNC_PIPELINE,
+        help="параллельный конвейер: источники опрашиваются одновременно",
+    )
+    mode.add_argument(
+        "--sync",
+        dest="use_async",
+        action="store_false",
+        help="последовательный режим",
+    )
+
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("run", help="один цикл экспорта (по умолчанию)")
+    commands.add_parser("daemon", help="служба с периодическим опросом источников")
+    backfill = commands.add_parser(
+        "backfill", help="догоняющая загрузка за период в пуле процессов"
+    )
+    backfill.add_argument(
+        "--from",
+        dest="since",
+        type=_parse_time,
+        required=True,
+        help="начало периода, ISO 8601 (по умолчанию UTC)",
+    )
+    backfill.add_argument(
+        "--to",
+        dest="until",
+        type=_parse_time,
+        default=None,
+        help="конец периода, не включительно (по умолчанию - сейчас)",
+    )
+    backfill.add_argument(
+        "--workers",
+        type=int,
+        default=BACKFILL_WORKERS,
+        help="число процессов (по умолчанию - по числу ядер)",
+    )
+    backfill.add_argument(
+        "--shard-hours",
+        type=float,
+        default=BACKFILL_SHARD_HOURS,
+        help="длина отрезка периода на один процесс, ч",
+    )
+    backfill.add_argument(
+        "--source",
+        dest="sources",
+        action="append",
+        choices=SOURCES,
+        help="источник (можно несколько; по умолчанию все)",
+    )
+
+    stats = commands.add_parser(
+        "stats", help="число обработанных событий по часам, источникам и типам"
+    )
+    stats.add_argument(
+        "--from",
+        dest="since",
+        type=_parse_time,
+        default=None,
+        help=f"начало периода, ISO 8601 (по умолчанию {STATS_DEFAULT_DAYS} сут. назад)",
+    )
+    stats.add_argument(
+        "--to",
+        dest="until",
+        type=_parse_time,
+        default=None,
+        help="конец периода, не включительно (по умолчанию - сейчас)",
+    )
+    stats.add_argument(
+        "--source",
+        dest="sources",
+        action="append",
+        choices=SOURCES,
+        help="источник (можно несколько; по умолчанию все)",
+    )
+    stats.add_argument(
+        "--event-type",
+        dest="event_types",
+        action="append",
+        help="тип события, например LOGIN_ERROR (можно несколько)",
+    )
+    stats.add_argument(
+        "--by",
+        dest="group_by",
+        action="append",
+        choices=ROLLUP_GROUPS,
+        help="группировка (можно несколько; по умолчанию hour)",
+    )
+    stats.add_argument("--json", action="store_true", help="вывод в JSON")
+    return parser.parse_args(argv)
 
-def main() -> int:
-    start_time = datetime.now()
-    logger.info("=" * 60)
-    logger.info("Запуск экспорта событий на syslog")
-    logger.info("=" * 60)
 
+def _parse_time(value: str) -> float:
+    """Разбирает время ISO 8601 в epoch, без часового пояса - UTC."""
     try:
-        event_ids = load_event_ids()
-        logger.info(f"Загружено {len(event_ids)} обработанных событий из кеша")
-
-        normalized_events = []
-        stats = {
-            "keycloak_user": 0,
-            "keycloak_admin": 0,
-            "app": 0,
-            "sent": 0,
-            "errors": 0,
-            "duplicates_keycloak_user": 0,
-            "duplicates_keycloak_admin": 0,
-            "duplicates_app": 0,
-        }
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"неверное время: {value}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=UTC)
+    return parsed.timestamp()
+
+
+def _prepare_store(store: EventStore) -> DedupCache:
+    """Удаляет устаревшие события и загружает кеш дедупликации."""
+    get_id_hash(EVENT_ID_HASH)  # ошибка настройки - до загрузки событий
+    previous = store.check_id_hash(EVENT_ID_HASH)
+    if previous:
+        logger.warning(
+            f"Алгоритм ID событий изменен: {previous} -> {EVENT_ID_HASH}, "
+            f"{DEDUP_WINDOW_HOURS} ч события проверяются по обоим ID"
+        )
+
+    deleted = store.cleanup_old_events(RETENTION_DAYS)
+    if deleted:
+        logger.info(f"Удалено {deleted} событий старше {RETENTION_DAYS} дней")
+
+    event_ids = store.dedup_cache(DEDUP_WINDOW_HOURS)
+    if store.bloom is not None:
+        logger.info(
+            f"Фильтр Блума: {len(store.bloom)} событий, "
+            f"{store.bloom.size_bytes / 1024 / 1024:.1f} МБ"
+        )
+    else:
+        logger.info(
+            f"Загружено {len(event_ids)} обработанных событий из кеша "
+            f"(за последние {DEDUP_WINDOW_HOURS} ч)"
+        )
+    return event_ids
 
-        logger.info("Получение событий из Keycloak...")
-        try:
-            token = get_admin_token()
-            kc_user_events = fetch_keycloak_events("events", token)
-            kc_admin_events = fetch_keycloak_events("admin-events", token)
-
-            for e in kc_user_events:
-                try:
-                    ne = normalize_keycloak_event(e, is_admin=False)
-                    if ne["id"] not in event_ids:
-                        normalized_events.append(ne)
-                        store_event_id(ne["id"], _extract_metadata(ne))
-                        stats["keycloak_user"] += 1
-                    else:
-                        stats["duplicates_keycloak_user"] += 1
-                except Exception as ex:
-                    logger.error(f"Ошибка нормализации Keycloak user event: {ex}")
-                    stats["errors"] += 1
-
-            for e in kc_admin_events:
-                try:
-                    ne = normalize_keycloak_event(e, is_admin=True)
-                    if ne["id"] not in event_ids:
-                        normalized_events.append(ne)
-                        store_event_id(ne["id"], _extract_metadata(ne))
-                        stats["keycloak_admin"] += 1
-                    else:
-                        stats["duplicates_keycloak_admin"] += 1
-                except Exception as ex:
-                    logger.error(f"Ошибка нормализации Keycloak admin event: {ex}")
-                    stats["errors"] += 1
 
+def _log_summary(stats: Dict[str, int], elapsed_time: float) -> None:
+    total_duplicates = (
+        stats["duplicates_keycloak_user"]
+        + stats["duplicates_keycloak_admin"]
+        + stats["duplicates_app"]
+    )
+    logger.info("=" * 60)
+    logger.info("Экспорт завершен")
+    logger.info(f"Время выполнения: {elapsed_time:.2f} сек")
+    logger.info(f"Статистика:")
+    logger.info(f"  - Keycloak user events: {stats['keycloak_user']}")
+    logger.info(f"  - Keycloak admin events: {stats['keycloak_admin']}")
+    logger.info(f"  - App events: {stats['app']}")
+    filtered = {kind: stats.get(f"filtered_{kind}", 0) for kind in SOURCES}
+    if any(filtered.values()):
+        logger.info(
+            f"  - Отброшено правилами EVENT_RULES: {sum(filtered.values())} "
+            f"(KC user: {filtered['keycloak_user']}, "
+            f"KC admin: {filtered['keycloak_admin']}, App: {filtered['app']})"
+        )
+    realms = sorted(
+        {
+            key.split(":", 1)[1]
+            for key in stats
+            if key.startswith("keycloak_") and ":" in key
+        }
+    )
+    if len(realms) > 1:
+        for realm in realms:
             logger.info(
-                f"Получено новых событий Keycloak: user={stats['keycloak_user']}, admin={stats['keycloak_admin']}"
+                f"    - realm {realm}: user {stats.get(f'keycloak_user:{realm}', 0)}, "
+                f"admin {stats.get(f'keycloak_admin:{realm}', 0)}"
             )
+    logger.info(f"  - Поставлено в outbox: {stats['spooled']}")
+    logger.info(f"  - Всего отправлено: {stats['sent']}")
+    destinations = [key for key in stats if key.startswith("sent_")]
+    if len(destinations) > 1:
+        for key in destinations:
+            logger.info(f"    - {key[len('sent_'):]}: {stats[key]}")
+    logger.info(
+        f"  - Отфильтровано дубликатов: {total_duplicates} (KC user: {stats['duplicates_keycloak_user']}, KC admin: {stats['duplicates_keycloak_admin']}, App: {stats['duplicates_app']})"
+    )
+    logger.info(f"  - Ошибок: {stats['errors']}")
+    logger.info("=" * 60)
+
+
+def _write_metrics_summary(stats: Dict[str, int], elapsed_time: float) -> None:
+    if not METRICS_SUMMARY_FILE:
+        return
+    try:
+        metrics.write_summary(METRICS_SUMMARY_FILE, stats, elapsed_time)
+    except OSError as ex:
+        logger.warning(f"Не удалось записать сводку метрик: {ex}")
+
+
+def _open_destinations(stack: ExitStack) -> List[Destination]:
+    destinations = [stack.enter_context(d) for d in create_destinations()]
+    if len(destinations) > 1:
+        logger.info(f"Получатели: {', '.join(d.name for d in destinations)}")
+    return destinations
+
+
+def _load_rules(destinations: List[Destination]) -> EventRules:
+    rules = EventRules()
+    rules.check_destinations([d.name for d in destinations])
+    if rules:
+        logger.info(f"Правил обработки событий (EVENT_RULES): {len(rules.rules)}")
+    return rules
+
+
+def _run_once(use_async: bool) -> int:
+    start_time = datetime.now()
+    if use_async:
+        logger.info("Асинхронный режим: источники опрашиваются параллельно")
+
+    with EventStore() as store:
+        event_ids = _prepare_store(store)
+        with ExitStack() as stack:
+            destinations = _open_destinations(stack)
+            rules = _load_rules(destinations)
+            stats = run_cycle(store, event_ids, destinations, use_async, rules=rules)
+
+    elapsed_time = (datetime.now() - start_time).total_seconds()
+    _log_summary(stats, elapsed_time)
+    _write_metrics_summary(stats, elapsed_time)
+    return 1 if stats["errors"] > 0 else 0
 
-        except Exception as ex:
-            logger.error(f"Ошибка при получении событий Keycloak: {ex}")
-            stats["errors"] += 1
-
-        logger.info("Получение событий из Scanfactory...")
-        try:
-            app_events = fetch_app_events()
-
-            for e in app_events:
-                try:
-                    ne = normalize_app_event(e)
-                    if ne["id"] not in event_ids:
-                        normalized_events.append(ne)
-                        store_event_id(ne["id"], _extract_metadata(ne))
-                        stats["app"] += 1
-                    else:
-                        stats["duplicates_app"] += 1
-                except Exception as ex:
-                    logger.error(f"Ошибка нормализации app event: {ex}")
-                    stats["errors"] += 1
-
-            logger.info(f"Получено новых событий из приложения: {stats['app']}")
-
-        except Exception as ex:
-            logger.error(f"Ошибка при получении событий приложения: {ex}")
-            stats["errors"] += 1
-
-        total_events = len(normalized_events)
-        logger.info(f"Начинаем отправку {total_events} событий на syslog сервер...")
-
-        for i, event in enumerate(normalized_events, 1):
+
+def _run_daemon(use_async: bool) -> int:
+    """
+    Работает как служба: опрашивает источники по их расписанию.
+
+    Хранилище, кеш дедупликации, соединения с получателями, HTTP сессия
+    и токен Keycloak сохраняются между циклами. По SIGTERM/SIGINT текущий
+    цикл доводится до конца, буфер отправки сбрасывается на сервер.
+    """
+    stop = threading.Event()
+
+    def handle_signal(signum: int, frame: object) -> None:
+        logger.info(f"Получен сигнал {signal.Signals(signum).name}, завершение...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    intervals = {
+        kind: DAEMON_POLL_INTERVALS.get(kind, DAEMON_POLL_INTERVAL) for kind in SOURCES
+    }
+    logger.info(
+        "Режим службы, интервалы опроса (сек): "
+        + ", ".join(f"{kind}={interval}" for kind, interval in intervals.items())
+    )
+
+    metrics_server = None
+    if METRICS_PORT is not None:
+        metrics_server = metrics.serve(METRICS_HOST, METRICS_PORT)
+
+    start_time = datetime.now()
+    totals = new_stats()
+    next_poll = {kind: time.monotonic() for kind in SOURCES}
+    next_maintenance = 0.0
+    # После ошибки обслуживания БД (например, "database is locked") повтор
+    # не раньше чем через интервал опроса
+    maintenance_retry = min(intervals.values())
+    event_ids: Optional[DedupCache] = None
+
+    with EventStore() as store, ExitStack() as stack:
+        destinations = _open_destinations(stack)
+        rules = _load_rules(destinations)
+        while not stop.is_set():
+            now = time.monotonic()
             try:
-                send_syslog_event(event, event["priority"], event.get("facility"))
-                stats["sent"] += 1
+                if now >= next_maintenance:
+                    next_maintenance = now + maintenance_retry
+                    event_ids = _prepare_store(store)
+                    next_maintenance = now + DAEMON_MAINTENANCE_INTERVAL
+
+                # Пока кеш дедупликации не загружен, источники не опрашиваются
+                due = [
+                    kind
+                    for kind in SOURCES
+                    if event_ids is not None and next_poll[kind] <= now
+                ]
+                for kind in due:
+                    # расписание считается от предыдущего срока, а не от now,
+                    # чтобы источники с кратными интервалами опрашивались вместе
+                    next_poll[kind] += intervals[kind]
+                    if next_poll[kind] <= now:
+                        next_poll[kind] = now + intervals[kind]
 
-                if i % 10 == 0:
-                    logger.info(f"Отправлено {i}/{total_events} событий...")
+                if due:
+                    cycle_start = time.monotonic()
+                    stats = run_cycle(
+                        store, event_ids, destinations, use_async, due, rules
+                    )
+                    for key, value in stats.items():
+                        totals[key] = totals.get(key, 0) + value
 
+                    new_events = sum(stats[kind] for kind in SOURCES)
+                    if new_events or stats["errors"]:
+                        logger.info(
+                            f"Цикл ({', '.join(due)}): новых={new_events}, "
+                            f"отправлено={stats['sent']}, ошибок={stats['errors']}, "
+                            f"{time.monotonic() - cycle_start:.2f} сек"
+                        )
             except Exception as ex:
-                logger.error(
-                    f"Ошибка отправки события {event.get('id', 'unknown')}: {ex}"
-                )
-                stats["errors"] += 1
-
-        elapsed_time = (datetime.now() - start_time).total_seconds()
-        total_duplicates = (
-            stats["duplicates_keycloak_user"]
-            + stats["duplicates_keycloak_admin"]
-            + stats["duplicates_app"]
-        )
-        logger.info("=" * 60)
-        logger.info("Экспорт завершен")
-        logger.info(f"Время выполнения: {elapsed_time:.2f} сек")
-        logger.info(f"Статистика:")
-        logger.info(f"  - Keycloak user events: {stats['keycloak_user']}")
-        logger.info(f"  - Keycloak admin events: {stats['keycloak_admin']}")
-        logger.info(f"  - App events: {stats['app']}")
-        logger.info(f"  - Всего отправлено: {stats['sent']}")
-        logger.info(
-            f"  - Отфильтровано дубликатов: {total_duplicates} (KC user: {stats['duplicates_keycloak_user']}, KC admin: {stats['duplicates_keycloak_admin']}, App: {stats['duplicates_app']})"
+                logger.critical(f"Ошибка цикла экспорта: {ex}", exc_info=True)
+                totals["errors"] += 1
+
+            wake_at = next_maintenance
+            if event_ids is not None:
+                wake_at = min(min(next_poll.values()), wake_at)
+            stop.wait(max(0.0, wake_at - time.monotonic()))
+
+    close_session()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+        metrics_server.server_close()
+    elapsed_time = (datetime.now() - start_time).total_seconds()
+    _log_summary(totals, elapsed_time)
+    _write_metrics_summary(totals, elapsed_time)
+    return 0
+
+
+def _run_backfill(args: argparse.Namespace) -> int:
+    start_time = datetime.now()
+    until = args.until if args.until is not None else time.time()
+    if args.since >= until:
+        logger.error("Начало периода backfill должно быть раньше конца")
+        return 1
+    logger.info(
+        f"Backfill с {datetime.fromtimestamp(args.since, tz=UTC).isoformat()} "
+        f"по {datetime.fromtimestamp(until, tz=UTC).isoformat()}"
+    )
+
+    with EventStore() as store:
+        _prepare_store(store)
+    stats = run_backfill(
+        args.since,
+        until,
+        args.sources or SOURCES,
+        args.workers,
+        args.shard_hours,
+    )
+
+    elapsed_time = (datetime.now() - start_time).total_seconds()
+    _log_summary(stats, elapsed_time)
+    _write_metrics_summary(stats, elapsed_time)
+    return 1 if stats["errors"] > 0 else 0
+
+
+def _format_group(name: str, value: Any) -> Any:
+    if name == "hour":
+        return datetime.fromtimestamp(value, tz=UTC).strftime("%Y-%m-%dT%H:00Z")
+    if name == "day":
+        return datetime.fromtimestamp(value, tz=UTC).strftime("%Y-%m-%d")
+    return value
+
+
+def _run_stats(args: argparse.Namespace) -> int:
+    """Выводит отчет по счетчикам событий (event_rollups), без чтения событий."""
+    until = args.until if args.until is not None else time.time()
+    since = args.since if args.since is not None else until - STATS_DEFAULT_DAYS * 86400
+    group_by = list(dict.fromkeys(args.group_by or ["hour"]))
+
+    # Без фильтра Блума: отчет не должен создавать или удалять его файл
+    with EventStore(use_bloom=False) as store:
+        rows = store.event_counts(
+            since, until, args.sources, args.event_types, group_by
         )
-        logger.info(f"  - Ошибок: {stats['errors']}")
-        logger.info("=" * 60)
+    for row in rows:
+        for name in group_by:
+            row[name] = _format_group(name, row[name])
+
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return 0
 
-        return 1 if stats["errors"] > 0 else 0
+    header = group_by + ["count"]
+    table = [header] + [[str(row[name]) for name in header] for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(header))]
+    for line in table:
+        cells = [value.ljust(width) for value, width in zip(line[:-1], widths)]
+        print("  ".join(cells + [line[-1].rjust(widths[-1])]))
+    print(f"Всего: {sum(row['count'] for row in rows)}")
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _parse_args(argv)
+    if args.command == "stats":
+        return _run_stats(args)
+
+    logger.info("=" * 60)
+    logger.info("Запуск экспорта событий на syslog")
+    logger.info("=" * 60)
+
+    try:
+        if args.command == "daemon":
+            return _run_daemon(args.use_async)
+        if args.command == "backfill":
+            return _run_backfill(args)
+        return _run_once(args.use_async)
 
     except Exception as ex:
         logger.critical(f"Критическая ошибка: {ex}", exc_info=True)
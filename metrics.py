@@ -0,0 +1,343 @@
+"""
+Метрики экспортера: счетчики, значения и гистограммы длительности стадий.
+
+Метрики копятся в процессе в общем реестре (REGISTRY) и доступны:
+
+- в режиме службы - по HTTP в текстовом формате Prometheus (serve(),
+  порт METRICS_PORT), значения накапливаются с запуска службы;
+- после запуска - в JSON файле METRICS_SUMMARY_FILE (write_summary()):
+  счетчики цикла и по каждой стадии число вызовов, суммарное, среднее,
+  p95 и максимальное время - видно, какая стадия ограничивает скорость.
+
+Стадии замеряются через timer():
+
+    with metrics.timer("normalize", source=kind):
+        normalized, errors = normalize(page)
+
+Исключение внутри блока учитывается в exporter_stage_errors_total.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм, сек: от быстрых операций с БД до запросов API
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+STAGE_SECONDS = "exporter_stage_seconds"
+STAGE_ERRORS = "exporter_stage_errors_total"
+
+HELP = {
+    STAGE_SECONDS: "Длительность стадии экспорта, сек",
+    STAGE_ERRORS: "Стадии, завершившиеся исключением",
+    "exporter_events_total": "События источников по результату обработки",
+    "exporter_realm_events_total": "События Keycloak по realm и результату",
+    "exporter_sent_total": "Сообщения, доставленные получателю",
+    "exporter_spooled_total": "События, поставленные в outbox",
+    "exporter_errors_total": "Ошибки циклов экспорта",
+    "exporter_cycles_total": "Выполненные циклы экспорта",
+    "exporter_syslog_reconnects_total": "Переподключения к получателю",
+    "exporter_tls_handshakes_total": (
+        "TLS handshake с получателем по результату (missed - сессия не сохранена)"
+    ),
+    "exporter_queue_depth": "Элементов в очереди асинхронного конвейера",
+    "exporter_outbox_pending": "Сообщений в outbox, ожидающих отправки получателю",
+    "exporter_destination_open": "Отправка получателю приостановлена после ошибок",
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Histogram:
+    """Гистограмма наблюдений с фиксированными корзинами."""
+
+    __slots__ = ("buckets", "counts", "sum", "count", "max")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина - +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля сверху - граница корзины, в которую он попал."""
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Registry:
+    """Потокобезопасный реестр метрик (загрузчики работают в потоках)."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        """Увеличивает счетчик."""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: Any) -> None:
+        """Устанавливает текущее значение (gauge)."""
+        key = _label_key(labels)
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        """Добавляет наблюдение в гистограмму."""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, stage: str, **labels: Any) -> Iterator[None]:
+        """Замеряет длительность блока как стадию stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc(STAGE_ERRORS, stage=stage, **labels)
+            raise
+        finally:
+            self.observe(
+                STAGE_SECONDS, time.perf_counter() - start, stage=stage, **labels
+            )
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        """Возвращает метрики в текстовом формате Prometheus 0.0.4."""
+        lines: List[str] = []
+        with self._lock:
+            for kind, metrics in (
+                ("counter", self._counters),
+                ("gauge", self._gauges),
+            ):
+                for name, series in sorted(metrics.items()):
+                    self._render_header(lines, name, kind)
+                    for key, value in sorted(series.items()):
+                        lines.append(
+                            f"{name}{_format_labels(key)} {_format_value(value)}"
+                        )
+            for name, series in sorted(self._histograms.items()):
+                self._render_header(lines, name, "histogram")
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        labels = _format_labels(key, ("le", repr(bound)))
+                        lines.append(f"{name}_bucket{labels} {cumulative}")
+                    labels = _format_labels(key, ("le", "+Inf"))
+                    lines.append(f"{name}_bucket{labels} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum!r}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_header(lines: List[str], name: str, kind: str) -> None:
+        if name in HELP:
+            lines.append(f"# HELP {name} {HELP[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    def summary(self) -> Dict[str, Any]:
+        """Возвращает метрики для JSON сводки (стадии - по убыванию времени)."""
+        with self._lock:
+            stages = []
+            for key, histogram in self._histograms.get(STAGE_SECONDS, {}).items():
+                labels = dict(key)
+                errors = self._counters.get(STAGE_ERRORS, {}).get(key, 0)
+                stages.append(
+                    dict(
+                        labels,
+                        count=histogram.count,
+                        errors=int(errors),
+                        total_seconds=round(histogram.sum, 6),
+                        avg_seconds=round(histogram.sum / histogram.count, 6),
+                        p95_seconds=round(histogram.quantile(0.95), 6),
+                        max_seconds=round(histogram.max, 6),
+                    )
+                )
+            stages.sort(key=lambda s: s["total_seconds"], reverse=True)
+            return {
+                "stages": stages,
+                "counters": self._flatten(self._counters, skip=STAGE_ERRORS),
+                "gauges": self._flatten(self._gauges),
+            }
+
+    @staticmethod
+    def _flatten(
+        metrics: Dict[str, Dict[LabelKey, float]], skip: Optional[str] = None
+    ) -> Dict[str, float]:
+        return {
+            f"{name}{_format_labels(key)}": value
+            for name, series in sorted(metrics.items())
+            if name != skip
+            for key, value in sorted(series.items())
+        }
+
+
+REGISTRY = Registry()
+
+inc = REGISTRY.inc
+set_gauge = REGISTRY.set
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+
+
+def record_stats(stats: Dict[str, int], sources: Tuple[str, ...]) -> None:
+    """Добавляет счетчики цикла экспорта (см. pipeline.new_stats) в реестр."""
+    inc("exporter_cycles_total")
+    for kind in sources:
+        inc("exporter_events_total", stats.get(kind, 0), source=kind, result="new")
+        inc(
+            "exporter_events_total",
+            stats.get(f"duplicates_{kind}", 0),
+            source=kind,
+            result="duplicate",
+        )
+        inc(
+            "exporter_events_total",
+            stats.get(f"filtered_{kind}", 0),
+            source=kind,
+            result="filtered",
+        )
+    for key, value in stats.items():
+        if key.startswith("sent_"):
+            inc("exporter_sent_total", value, destination=key[len("sent_") :])
+        elif ":" in key:
+            # <kind>:<realm> и duplicates_<kind>:<realm> (pipeline.normalize_events)
+            kind, realm = key.split(":", 1)
+            result = "duplicate" if kind.startswith("duplicates_") else "new"
+            kind = kind[len("duplicates_") :] if result == "duplicate" else kind
+            inc(
+                "exporter_realm_events_total",
+                value,
+                source=kind,
+                realm=realm,
+                result=result,
+            )
+    inc("exporter_spooled_total", stats.get("spooled", 0))
+    inc("exporter_errors_total", stats.get("errors", 0))
+
+
+def write_summary(
+    path: str, stats: Dict[str, int], elapsed: float, registry: Registry = REGISTRY
+) -> None:
+    """Записывает JSON сводку запуска (атомарно, через временный файл)."""
+    summary = {
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "elapsed_seconds": round(elapsed, 3),
+        "stats": stats,
+        **registry.summary(),
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def serve(host: str, port: int) -> ThreadingHTTPServer:
+    """
+    Запускает HTTP endpoint /metrics в фоновом потоке.
+
+    Returns:
+        Сервер; остановка - shutdown() и server_close()
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(
+        target=server.serve_forever, name="metrics", daemon=True
+    )
+    thread.start()
+    logger.info(f"Метрики Prometheus: http://{host}:{server.server_port}/metrics")
+    return server
@@ -0,0 +1,832 @@
+"""
+Цикл экспорта: получение, нормализация и отправка событий.
+
+Цикл выполняется последовательно (run_sync) или асинхронным конвейером
+(run_pipeline), в котором стадии работают параллельно и связаны
+ограниченными очередями:
+
+    fetch (потоки, по одному на источник и realm Keycloak)
+        -> raw queue -> normalize (нормализация, дедупликация)
+        -> send queue -> spool (запись пачки в outbox)
+        -> deliver (отправка из outbox, по задаче на каждого получателя)
+
+Правила EVENT_RULES (event_rules.py) применяются к загруженным событиям
+до нормализации: отброшенные события не нормализуются и не попадают в
+хранилище, типы событий Keycloak по возможности отбираются в запросе.
+
+Если одна из стадий не успевает, очередь заполняется и предыдущая стадия
+ждет (backpressure), поэтому в памяти одновременно находится не больше
+PIPELINE_QUEUE_SIZE событий на очередь.
+
+Между нормализацией и отправкой события проходят через outbox в БД (см.
+Outbox): событие считается обработанным, как только попало в outbox, а
+удаляется оттуда только после доставки всем получателям. Недоставленное
+будет отправлено в следующем цикле.
+"""
+
+import asyncio
+import logging
+from functools import partial
+from itertools import islice
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from config import (
+    KEYCLOAK_ADMIN_REALM,
+    PIPELINE_QUEUE_SIZE,
+    PIPELINE_CHUNK_SIZE,
+    OUTBOX_BATCH_SIZE,
+)
+import metrics
+from keycloak_client import (
+    get_admin_token,
+    get_realms,
+    iter_realm_pages,
+    iter_realms_events,
+)
+from sf_client import iter_app_events
+from event_normalizer import (
+    BatchErrors,
+    NormalizedEvent,
+    normalize_keycloak_batch,
+    normalize_app_batch,
+)
+from event_id_store import DedupCache, EventStore
+from event_rules import TIMESTAMP_PARSERS, EventRules, Rule, apply_routes
+from syslog_sender import Destination, format_syslog_messages
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ("keycloak_user", "keycloak_admin", "app")
+KEYCLOAK_SOURCES = ("keycloak_user", "keycloak_admin")
+
+KEYCLOAK_EVENT_TYPES = {"keycloak_user": "events", "keycloak_admin": "admin-events"}
+
+# Загрузчики источников, принимают since= (epoch, сек); события Keycloak -
+# всех realms (KEYCLOAK_REALMS)
+FETCHERS: Dict[str, Callable[..., Iterator[Dict[str, Any]]]] = {
+    "keycloak_user": partial(iter_realms_events, "events"),
+    "keycloak_admin": partial(iter_realms_events, "admin-events"),
+    "app": iter_app_events,
+}
+
+# Нормализация страницами: (события, legacy_hash=) -> (события или None, ошибки)
+NORMALIZERS: Dict[
+    str, Callable[..., Tuple[List[Optional[NormalizedEvent]], BatchErrors]]
+] = {
+    "keycloak_user": partial(normalize_keycloak_batch, is_admin=False),
+    "keycloak_admin": partial(normalize_keycloak_batch, is_admin=True),
+    "app": normalize_app_batch,
+}
+
+SOURCE_LABELS = {
+    "keycloak_user": "Keycloak user event",
+    "keycloak_admin": "Keycloak admin event",
+    "app": "app event",
+}
+
+
+def realm_key(kind: str, realm: Optional[str] = None) -> str:
+    """
+    Ключ отметки источника: для событий Keycloak - отдельно по realm.
+
+    У KEYCLOAK_ADMIN_REALM ключ - имя источника, как до сбора нескольких
+    realms, чтобы сохраненные отметки продолжали действовать.
+    """
+    if realm is None or realm == KEYCLOAK_ADMIN_REALM:
+        return kind
+    return f"{kind}:{realm}"
+
+
+class Watermarks:
+    """
+    Отметки последнего обработанного события по источникам (см. realm_key).
+
+    Во время запуска запоминается самое новое полученное событие каждого
+    источника. Сохраняются отметки через commit() только если все новые
+    события поставлены в outbox, иначе следующий запуск повторит выборку
+    с прежней отметки (уже обработанные события отсеет дедупликация).
+    Источник, загрузка которого прервалась с ошибкой, отметку не сдвигает.
+
+    Выборка начинается включительно с времени отметки, поэтому события с
+    временем не позже отметки загружаются повторно при каждом запуске.
+    Они проверяются по ID последнего события отметки и по БД (processed),
+    а не по кешу дедупликации: у источника без новых событий дольше
+    DEDUP_WINDOW_HOURS последнее событие выходит из окна кеша.
+    """
+
+    def __init__(self, store: EventStore) -> None:
+        self._store = store
+        self._seen: Dict[str, Tuple[float, str]] = {}
+        self._failed: Set[str] = set()
+
+    def since(self, kind: str) -> Optional[float]:
+        mark = self._store.get_watermark(kind)
+        return mark[0] if mark else None
+
+    def mark(self, kind: str) -> Optional[Tuple[float, str]]:
+        """Возвращает сохраненную отметку (время, ID последнего события)."""
+        return self._store.get_watermark(kind)
+
+    def processed(self, mark: Tuple[float, str], event: NormalizedEvent) -> bool:
+        """Событие на границе отметки уже обработано (ID отметки или есть в БД)."""
+        if event.id == mark[1] or (event.legacy_id and event.legacy_id == mark[1]):
+            return True
+        return self._store.event_exists(event.id) or bool(
+            event.legacy_id and self._store.event_exists(event.legacy_id)
+        )
+
+    def observe(self, kind: str, timestamp: Optional[float], event_id: str) -> None:
+        if timestamp is None:
+            return
+        seen = self._seen.get(kind)
+        if seen is None or timestamp > seen[0]:
+            self._seen[kind] = (timestamp, event_id)
+
+    def fail(self, kind: str) -> None:
+        self._failed.add(kind)
+
+    def commit(self) -> None:
+        for kind, (timestamp, event_id) in self._seen.items():
+            if kind not in self._failed:
+                self._store.set_watermark(kind, timestamp, event_id)
+
+
+def new_stats() -> Dict[str, int]:
+    """Возвращает пустые счетчики цикла экспорта."""
+    stats = {"sent": 0, "errors": 0, "spooled": 0, "format_errors": 0}
+    for kind in SOURCES:
+        stats[kind] = 0
+        stats[f"duplicates_{kind}"] = 0
+        stats[f"filtered_{kind}"] = 0
+    return stats
+
+
+def normalize_events(
+    events: Iterable[Dict[str, Any]],
+    kind: str,
+    event_ids: DedupCache,
+    stats: Dict[str, int],
+    watermarks: Optional[Watermarks] = None,
+    legacy_hash: Optional[str] = None,
+    realm: Optional[str] = None,
+    rules: Optional[EventRules] = None,
+) -> Iterator[NormalizedEvent]:
+    """
+    Нормализует события источника и отбрасывает уже обработанные.
+
+    События нормализуются страницами по PIPELINE_CHUNK_SIZE. Новые события
+    добавляются в event_ids и отдаются вызывающему, счетчики kind /
+    duplicates_<kind> / errors в stats обновляются. В хранилище ID
+    события попадают при постановке в outbox (Outbox.spool).
+
+    Args:
+        legacy_hash: Прежний алгоритм ID на время миграции - событие
+            считается обработанным, если в event_ids есть любой из его ID
+        realm: Realm событий Keycloak - для отметки realm и счетчиков
+            <kind>:<realm> / duplicates_<kind>:<realm>
+        rules: Правила EVENT_RULES - применяются к странице до нормализации,
+            отброшенные события учитываются в filtered_<kind> и сдвигают
+            отметку источника. Уже обработанные события на границе отметки
+            отсеиваются до правил и счетчики sample / rate_cap не тратят
+    """
+    normalize = partial(NORMALIZERS[kind], legacy_hash=legacy_hash)
+    event_timestamp = TIMESTAMP_PARSERS[kind]
+    mark = realm_key(kind, realm)
+    new_key = kind if realm is None else f"{kind}:{realm}"
+    stats.setdefault(new_key, 0)
+    stats.setdefault(f"duplicates_{new_key}", 0)
+    boundary = watermarks.mark(mark) if watermarks is not None else None
+    iterator = iter(events)
+    while True:
+        page = list(islice(iterator, PIPELINE_CHUNK_SIZE))
+        if not page:
+            break
+
+        if boundary is not None:
+            processed = _boundary_processed(
+                page, event_timestamp, normalize, boundary, watermarks
+            )
+            if processed:
+                stats[f"duplicates_{kind}"] += len(processed)
+                if realm is not None:
+                    stats[f"duplicates_{new_key}"] += len(processed)
+                page = [e for i, e in enumerate(page) if i not in processed]
+                if not page:
+                    continue
+
+        routes: Sequence[Optional[Rule]] = ()
+        if rules:
+            with metrics.timer("rules", source=kind):
+                page, routes, dropped = rules.select(kind, page)
+            stats[f"filtered_{kind}"] += len(dropped)
+            if watermarks is not None:
+                for e in dropped:
+                    watermarks.observe(mark, event_timestamp(e), "")
+            if not page:
+                continue
+
+        with metrics.timer("normalize", source=kind):
+            normalized, errors = normalize(page)
+        for _, ex in errors:
+            logger.error(f"Ошибка нормализации {SOURCE_LABELS[kind]}: {ex}")
+        stats["errors"] += len(errors)
+
+        # Новые события страницы отдаются после проверки всей страницы,
+        # чтобы в замер dedup не попала обработка у вызывающего
+        new_events = []
+        with metrics.timer("dedup", source=kind):
+            for e, ne in zip(page, normalized):
+                if ne is None:
+                    continue
+                if watermarks is not None:
+                    watermarks.observe(mark, event_timestamp(e), ne.id)
+                if ne.id in event_ids or (
+                    ne.legacy_id is not None and ne.legacy_id in event_ids
+                ):
+                    stats[f"duplicates_{kind}"] += 1
+                    if realm is not None:
+                        stats[f"duplicates_{new_key}"] += 1
+                    continue
+                event_ids.add(ne.id)
+                stats[kind] += 1
+                if realm is not None:
+                    stats[new_key] += 1
+                new_events.append(ne)
+        if routes:
+            apply_routes(normalized, routes)
+        yield from new_events
+
+
+def _boundary_processed(
+    page: List[Dict[str, Any]],
+    event_timestamp: Callable[[Dict[str, Any]], Optional[float]],
+    normalize: Callable[..., Tuple[List[Optional[NormalizedEvent]], BatchErrors]],
+    boundary: Tuple[float, str],
+    watermarks: Watermarks,
+) -> Set[int]:
+    """Индексы уже обработанных событий страницы с временем не позже отметки."""
+    indexes = []
+    for index, event in enumerate(page):
+        timestamp = event_timestamp(event)
+        if timestamp is not None and timestamp <= boundary[0]:
+            indexes.append(index)
+    if not indexes:
+        return set()
+    # Ошибки нормализации здесь не учитываются - событие остается на
+    # странице и будет учтено при основной нормализации
+    normalized, _ = normalize([page[index] for index in indexes])
+    return {
+        index
+        for index, ne in zip(indexes, normalized)
+        if ne is not None and watermarks.processed(boundary, ne)
+    }
+
+
+class Outbox:
+    """
+    Доставка событий получателям через outbox в хранилище.
+
+    spool() форматирует события и одной транзакцией записывает сообщения
+    в outbox вместе с их ID (событие с большими details - несколькими
+    сообщениями, см. SYSLOG_MAX_MESSAGE_SIZE). Доставка идет параллельно
+    и независимо для каждого получателя: у каждого своя позиция в outbox,
+    медленный получатель отстает, не задерживая остальных. После ошибки
+    отправки получатель в текущем цикле пропускается (и еще
+    retry_interval после нее, см. Destination) - его очередь остается в
+    БД и будет дочитана позже пачками по OUTBOX_BATCH_SIZE, поэтому объем
+    памяти не зависит от размера очереди.
+    """
+
+    def __init__(
+        self,
+        store: EventStore,
+        destinations: Sequence[Destination],
+        batch_size: int = OUTBOX_BATCH_SIZE,
+    ) -> None:
+        self._store = store
+        self.destinations = list(destinations)
+        self.batch_size = batch_size
+        self.failed: Set[str] = set()
+        self._wakeup: Dict[str, asyncio.Event] = {}
+        self._spool_closed = False
+        store.set_outbox_destinations(d.name for d in self.destinations)
+
+    def spool(self, events: Iterable[NormalizedEvent], stats: Dict[str, int]) -> None:
+        """
+        Записывает события в outbox.
+
+        Событие с ошибкой формата пропускается и учитывается в errors и
+        format_errors - как ошибка нормализации, оно не задерживает отметку
+        источника (см. run_cycle).
+        """
+        records: List[Tuple[NormalizedEvent, List[bytes]]] = []
+        for event in events:
+            try:
+                messages = format_syslog_messages(
+                    event, event.priority, event.facility
+                )
+            except Exception as ex:
+                logger.error(f"Ошибка форматирования события {event.id}: {ex}")
+                stats["errors"] += 1
+                stats["format_errors"] += 1
+                continue
+            records.append((event, messages))
+        stats["spooled"] += self._store.spool_many(records)
+        for wakeup in self._wakeup.values():
+            wakeup.set()
+
+    def close_spool(self) -> None:
+        """Сообщает доставке в режиме follow, что новых событий не будет."""
+        self._spool_closed = True
+        for wakeup in self._wakeup.values():
+            wakeup.set()
+
+    def deliver(self, stats: Dict[str, int]) -> None:
+        """Отправляет очередь outbox всем получателям (синхронная обертка)."""
+        asyncio.run(self.deliver_async(stats))
+
+    async def deliver_async(self, stats: Dict[str, int], follow: bool = False) -> None:
+        """
+        Отправляет очередь outbox всем получателям параллельно.
+
+        Args:
+            follow: Не завершаться на пустой очереди, а ждать новых событий
+                от spool() до вызова close_spool()
+        """
+        if follow:
+            self._spool_closed = False
+            self._wakeup = {d.name: asyncio.Event() for d in self.destinations}
+        try:
+            await asyncio.gather(
+                *(self._deliver_to(d, stats, follow) for d in self.destinations)
+            )
+        finally:
+            self._wakeup = {}
+
+    async def _deliver_to(
+        self, destination: Destination, stats: Dict[str, int], follow: bool
+    ) -> None:
+        while destination.ready and destination.name not in self.failed:
+            batch = self._store.outbox_batch(self.batch_size, destination.name)
+            if batch:
+                delivered = await asyncio.to_thread(
+                    self._send, destination, [m for _, m in batch]
+                )
+                self._ack(destination, batch, delivered, stats)
+                continue
+            # Оставшиеся сообщения адресованы другим получателям (route)
+            self._store.skip_outbox(destination.name)
+
+            if not follow or self._spool_closed:
+                break
+            wakeup = self._wakeup[destination.name]
+            wakeup.clear()
+            await wakeup.wait()
+
+    @staticmethod
+    def _send(destination: Destination, messages: List[bytes]) -> int:
+        with metrics.timer("send", destination=destination.name):
+            return destination.sender.send_messages(messages)
+
+    def _ack(
+        self,
+        destination: Destination,
+        batch: List[Tuple[int, bytes]],
+        delivered: int,
+        stats: Dict[str, int],
+    ) -> None:
+        """Подтверждает первые delivered сообщений пачки для получателя."""
+        if delivered:
+            self._store.ack_outbox(batch[delivered - 1][0], destination.name)
+            stats["sent"] += delivered
+            stats[f"sent_{destination.name}"] += delivered
+        if delivered < len(batch):
+            stats["errors"] += 1
+            self.failed.add(destination.name)
+            pause = destination.failed()
+            logger.warning(
+                f"Получатель {destination.name}: отправка приостановлена на "
+                f"{pause:.0f} сек (ошибок подряд: {destination.failures})"
+            )
+        else:
+            destination.succeeded()
+
+    def pending(self, destination: str) -> int:
+        return self._store.outbox_size(destination)
+
+
+def spool_in_batches(
+    outbox: Outbox,
+    events: Iterable[NormalizedEvent],
+    stats: Dict[str, int],
+    batch_size: int,
+) -> None:
+    """Ставит поток событий в outbox и доставляет его пачками."""
+    batch: List[NormalizedEvent] = []
+    for event in events:
+        batch.append(event)
+        if len(batch) >= batch_size:
+            outbox.spool(batch, stats)
+            outbox.deliver(stats)
+            batch = []
+    if batch:
+        outbox.spool(batch, stats)
+        outbox.deliver(stats)
+
+
+def _feed(
+    loop: asyncio.AbstractEventLoop,
+    queue: "asyncio.Queue[Any]",
+    kind: str,
+    events: Iterable[Dict[str, Any]],
+) -> None:
+    """Перекладывает события из потока-загрузчика в очередь кусками."""
+    chunk: List[Dict[str, Any]] = []
+    for event in events:
+        chunk.append(event)
+        if len(chunk) >= PIPELINE_CHUNK_SIZE:
+            asyncio.run_coroutine_threadsafe(
+                queue.put((kind, None, chunk)), loop
+            ).result()
+            chunk = []
+    if chunk:
+        asyncio.run_coroutine_threadsafe(queue.put((kind, None, chunk)), loop).result()
+
+
+def _realms_since(
+    kind: str, realms: Sequence[str], watermarks: Watermarks
+) -> Dict[str, Optional[float]]:
+    return {realm: watermarks.since(realm_key(kind, realm)) for realm in realms}
+
+
+def _realm_failed(
+    kind: str,
+    realm: str,
+    ex: Exception,
+    stats: Dict[str, int],
+    watermarks: Watermarks,
+) -> None:
+    """Учитывает ошибку загрузки realm: отметки остальных realms сдвигаются."""
+    logger.error(
+        f"Ошибка при получении событий ({SOURCE_LABELS[kind]}, realm {realm}): {ex}"
+    )
+    stats["errors"] += 1
+    watermarks.fail(realm_key(kind, realm))
+
+
+async def _fetch_stage(
+    kind: str,
+    queue: "asyncio.Queue[Any]",
+    stats: Dict[str, int],
+    watermarks: Watermarks,
+    rules: EventRules,
+) -> None:
+    loop = asyncio.get_running_loop()
+    fetch = partial(
+        FETCHERS[kind], since=watermarks.since(kind), **rules.fetch_filter(kind)
+    )
+    try:
+        await asyncio.to_thread(lambda: _feed(loop, queue, kind, fetch()))
+    except Exception as ex:
+        logger.error(f"Ошибка при получении событий ({SOURCE_LABELS[kind]}): {ex}")
+        stats["errors"] += 1
+        watermarks.fail(kind)
+
+
+async def _realms_fetch_stage(
+    kind: str,
+    realms: Sequence[str],
+    queue: "asyncio.Queue[Any]",
+    stats: Dict[str, int],
+    watermarks: Watermarks,
+    rules: EventRules,
+) -> None:
+    """Загружает события realms одновременно (iter_realm_pages) в очередь."""
+    loop = asyncio.get_running_loop()
+    since = _realms_since(kind, realms, watermarks)
+    # Ошибки realms учитываются после загрузки, в потоке цикла событий
+    failed: List[Tuple[str, Exception]] = []
+
+    def feed() -> None:
+        pages = iter_realm_pages(
+            KEYCLOAK_EVENT_TYPES[kind],
+            since,
+            on_error=lambda realm, ex: failed.append((realm, ex)),
+            **rules.fetch_filter(kind),
+        )
+        for realm, page in pages:
+            asyncio.run_coroutine_threadsafe(
+                queue.put((kind, realm, page)), loop
+            ).result()
+
+    await asyncio.to_thread(feed)
+    for realm, ex in failed:
+        _realm_failed(kind, realm, ex, stats, watermarks)
+
+
+async def _keycloak_stage(
+    kinds: Sequence[str],
+    queue: "asyncio.Queue[Any]",
+    stats: Dict[str, int],
+    watermarks: Watermarks,
+    rules: EventRules,
+) -> None:
+    try:
+        await asyncio.to_thread(get_admin_token)
+        realms = await asyncio.to_thread(get_realms)
+    except Exception as ex:
+        logger.error(f"Ошибка при получении событий Keycloak: {ex}")
+        stats["errors"] += 1
+        return
+
+    await asyncio.gather(
+        *(
+            _realms_fetch_stage(kind, realms, queue, stats, watermarks, rules)
+            for kind in kinds
+        )
+    )
+
+
+async def _normalize_stage(
+    raw_queue: "asyncio.Queue[Any]",
+    send_queue: "asyncio.Queue[Any]",
+    event_ids: DedupCache,
+    stats: Dict[str, int],
+    watermarks: Watermarks,
+    legacy_hash: Optional[str],
+    rules: EventRules,
+) -> None:
+    while True:
+        item = await raw_queue.get()
+        if item is None:
+            break
+        kind, realm, events = item
+        metrics.set_gauge("exporter_queue_depth", raw_queue.qsize(), queue="raw")
+        for ne in normalize_events(
+            events, kind, event_ids, stats, watermarks, legacy_hash, realm, rules
+        ):
+            await send_queue.put(ne)
+    await send_queue.put(None)
+
+
+async def _send_stage(
+    send_queue: "asyncio.Queue[Any]",
+    outbox: Outbox,
+    stats: Dict[str, int],
+    batch_size: int,
+) -> None:
+    done = False
+    while not done:
+        batch = [await send_queue.get()]
+        while len(batch) < batch_size and not send_queue.empty():
+            batch.append(send_queue.get_nowait())
+        metrics.set_gauge("exporter_queue_depth", send_queue.qsize(), queue="send")
+        if batch[-1] is None:
+            batch.pop()
+            done = True
+        if batch:
+            outbox.spool(batch, stats)
+            # Дать доставке забрать записанное, пока копится следующая пачка
+            await asyncio.sleep(0)
+    outbox.close_spool()
+
+
+async def run_pipeline(
+    store: EventStore,
+    event_ids: DedupCache,
+    stats: Dict[str, int],
+    watermarks: Watermarks,
+    outbox: Outbox,
+    sources: Sequence[str] = SOURCES,
+    batch_size: int = PIPELINE_CHUNK_SIZE,
+    legacy_hash: Optional[str] = None,
+    rules: Optional[EventRules] = None,
+) -> None:
+    """
+    Выполняет один цикл экспорта в асинхронном режиме.
+
+    Все источники опрашиваются одновременно, события отправляются по мере
+    поступления, не дожидаясь окончания загрузки остальных источников.
+    Очередь outbox, оставшаяся с прошлых циклов, отправляется первой.
+    """
+    raw_queue: "asyncio.Queue[Any]" = asyncio.Queue(
+        maxsize=max(1, PIPELINE_QUEUE_SIZE // PIPELINE_CHUNK_SIZE)
+    )
+    send_queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    rules = rules if rules is not None else EventRules(())
+
+    keycloak_kinds = [kind for kind in sources if kind in KEYCLOAK_SOURCES]
+    other_kinds = [kind for kind in sources if kind not in KEYCLOAK_SOURCES]
+
+    async def fetch_all() -> None:
+        stages = [
+            _fetch_stage(kind, raw_queue, stats, watermarks, rules)
+            for kind in other_kinds
+        ]
+        if keycloak_kinds:
+            stages.append(
+                _keycloak_stage(keycloak_kinds, raw_queue, stats, watermarks, rules)
+            )
+        await asyncio.gather(*stages)
+        await raw_queue.put(None)
+
+    await asyncio.gather(
+        fetch_all(),
+        _normalize_stage(
+            raw_queue, send_queue, event_ids, stats, watermarks, legacy_hash, rules
+        ),
+        _send_stage(send_queue, outbox, stats, batch_size),
+        outbox.deliver_async(stats, follow=True),
+    )
+
+
+def run_sync(
+    store: EventStore,
+    event_ids: DedupCache,
+    stats: Dict[str, int],
+    watermarks: Watermarks,
+    outbox: Outbox,
+    sources: Sequence[str] = SOURCES,
+    batch_size: int = PIPELINE_CHUNK_SIZE,
+    legacy_hash: Optional[str] = None,
+    rules: Optional[EventRules] = None,
+) -> None:
+    """
+    Последовательно обрабатывает источники.
+
+    События каждого источника читаются постранично и отправляются пачками
+    по мере получения, поэтому объем памяти не зависит от их количества.
+    Realms Keycloak загружаются одновременно (iter_realm_pages).
+    """
+    # Очередь, оставшаяся с прошлых циклов, отправляется до новых событий
+    outbox.deliver(stats)
+    rules = rules if rules is not None else EventRules(())
+
+    kinds = list(sources)
+    realms: List[str] = []
+    if any(kind in KEYCLOAK_SOURCES for kind in kinds):
+        try:
+            get_admin_token()
+            realms = get_realms()
+        except Exception as ex:
+            logger.error(f"Ошибка при получении событий Keycloak: {ex}")
+            stats["errors"] += 1
+            kinds = [kind for kind in kinds if kind not in KEYCLOAK_SOURCES]
+
+    for kind in kinds:
+        logger.info(f"Получение событий ({SOURCE_LABELS[kind]})...")
+        try:
+            if kind in KEYCLOAK_SOURCES:
+                pages = iter_realm_pages(
+                    KEYCLOAK_EVENT_TYPES[kind],
+                    _realms_since(kind, realms, watermarks),
+                    on_error=partial(
+                        _realm_failed, kind, stats=stats, watermarks=watermarks
+                    ),
+                    **rules.fetch_filter(kind),
+                )
+                new_events: Iterable[NormalizedEvent] = (
+                    ne
+                    for realm, page in pages
+                    for ne in normalize_events(
+                        page,
+                        kind,
+                        event_ids,
+                        stats,
+                        watermarks,
+                        legacy_hash,
+                        realm,
+                        rules,
+                    )
+                )
+            else:
+                new_events = normalize_events(
+                    FETCHERS[kind](
+                        since=watermarks.since(kind), **rules.fetch_filter(kind)
+                    ),
+                    kind,
+                    event_ids,
+                    stats,
+                    watermarks,
+                    legacy_hash,
+                    rules=rules,
+                )
+            spool_in_batches(outbox, new_events, stats, batch_size)
+            logger.info(
+                f"Получено новых событий ({SOURCE_LABELS[kind]}): {stats[kind]}"
+            )
+        except Exception as ex:
+            logger.error(f"Ошибка при получении событий ({SOURCE_LABELS[kind]}): {ex}")
+            stats["errors"] += 1
+            watermarks.fail(kind)
+
+
+def run_cycle(
+    store: EventStore,
+    event_ids: DedupCache,
+    destinations: Sequence[Destination],
+    use_async: bool = False,
+    sources: Sequence[str] = SOURCES,
+    rules: Optional[EventRules] = None,
+) -> Dict[str, int]:
+    """
+    Выполняет один цикл экспорта по указанным источникам.
+
+    События загружаются один раз и отправляются всем получателям
+    (кроме событий, направленных правилом route одному получателю).
+    Отметки источников сохраняются, если все новые события цикла
+    поставлены в outbox. Недоставленные события остаются в outbox и
+    отправляются получателю в следующих циклах.
+
+    Args:
+        rules: Правила EVENT_RULES; создаются один раз при запуске, чтобы
+            счетчики sample и rate_cap сохранялись между циклами
+
+    Returns:
+        Счетчики цикла (см. new_stats)
+    """
+    stats = new_stats()
+    for destination in destinations:
+        stats[f"sent_{destination.name}"] = 0
+    watermarks = Watermarks(store)
+    outbox = Outbox(store, destinations)
+    reconnects = {d.name: d.sender.reconnects for d in destinations}
+    handshakes = {d.name: dict(d.sender.tls_handshakes) for d in destinations}
+    batch_size = destinations[0].sender.max_batch_messages
+    legacy_hash = store.legacy_id_hash()
+
+    with metrics.timer("cycle"):
+        if use_async:
+            asyncio.run(
+                run_pipeline(
+                    store,
+                    event_ids,
+                    stats,
+                    watermarks,
+                    outbox,
+                    sources,
+                    batch_size,
+                    legacy_hash,
+                    rules,
+                )
+            )
+        else:
+            run_sync(
+                store,
+                event_ids,
+                stats,
+                watermarks,
+                outbox,
+                sources,
+                batch_size,
+                legacy_hash,
+                rules,
+            )
+
+    # События с ошибкой формата не попадают в outbox - как и ошибки
+    # нормализации, они не должны останавливать отметки источников
+    new_events = sum(stats[kind] for kind in SOURCES) - stats["format_errors"]
+    if stats["spooled"] == new_events:
+        watermarks.commit()
+    else:
+        logger.warning(
+            "Не все события поставлены в outbox, отметки источников не сдвигаются"
+        )
+
+    for destination in destinations:
+        name = destination.name
+        pending = outbox.pending(name)
+        metrics.set_gauge("exporter_outbox_pending", pending, destination=name)
+        metrics.set_gauge(
+            "exporter_destination_open", int(destination.failures > 0), destination=name
+        )
+        if name in outbox.failed or not destination.ready:
+            logger.warning(
+                f"Получатель {name} недоступен, в outbox ожидают отправки: {pending}"
+            )
+        if destination.sender.reconnects > reconnects[name]:
+            count = destination.sender.reconnects - reconnects[name]
+            metrics.inc("exporter_syslog_reconnects_total", count, destination=name)
+            logger.info(f"Переподключений к получателю {name}: {count}")
+        for result, total in destination.sender.tls_handshakes.items():
+            count = total - handshakes[name][result]
+            if count:
+                metrics.inc(
+                    "exporter_tls_handshakes_total",
+                    count,
+                    destination=name,
+                    result=result,
+                )
+    metrics.record_stats(stats, SOURCES)
+    return stats
@@ -1,14 +1,57 @@
-import requests
+import codecs
+import json
+import re
+import http_client
+import metrics
 from datetime import UTC, datetime, timedelta
-from typing import Any, Dict, List
-from config import APP_API_URL, APP_API_TOKEN
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from config import APP_API_URL, APP_API_TOKEN, FETCH_WINDOW_HOURS
 
+_STREAM_CHUNK_SIZE = 64 * 1024
+_JSON_SEPARATORS = " \t\r\n,"
 
-def fetch_app_events(hours: int = 1) -> List[Dict[str, Any]]:
+
+def event_timestamp(event: Dict[str, Any]) -> Optional[float]:
+    """Возвращает время события приложения в секундах epoch (None если нет)."""
+    at = event.get("at")
+    if not at:
+        return None
+    if isinstance(at, datetime):
+        return at.timestamp()
+    try:
+        return datetime.fromisoformat(at.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def fetch_app_events(
+    since: Optional[float] = None,
+    hours: int = FETCH_WINDOW_HOURS,
+    until: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """Получает события приложения списком (см. iter_app_events)."""
+    return list(iter_app_events(since, hours, until))
+
+
+def iter_app_events(
+    since: Optional[float] = None,
+    hours: int = FETCH_WINDOW_HOURS,
+    until: Optional[float] = None,
+) -> Iterator[Dict[str, Any]]:
     """
-    Получает события приложения через API /history/
+    Отдает события приложения из API /history/ по одному.
+
+    Ответ читается потоком и разбирается по мере получения, поэтому
+    в памяти одновременно находится только одно событие, а не весь
+    JSON документ.
 
-    Возвращает список событий в формате:
+    Args:
+        since: Время (epoch, сек), начиная с которого нужны события;
+            если не задано - последние hours часов
+        until: Время (epoch, сек), до которого нужны события (не
+            включительно); если не задано - до текущего момента
+
+    Формат ответа API:
     {
         "count": int,
         "items": [
@@ -23,13 +66,84 @@ def fetch_app_events(hours: int = 1) -> List[Dict[str, Any]]:
     }
     """
     now = datetime.now(tz=UTC)
-    since = now - timedelta(hours=hours)
+    if since is None:
+        since = (now - timedelta(hours=hours)).timestamp()
     headers = {"Authorization": f"Bearer {APP_API_TOKEN}"}
 
-    params = {"$gt-at": since.timestamp(), "$lt-at": now.timestamp(), "all": True}
+    # $gt-at строгое сравнение - сдвигаем на 1 мс, чтобы не потерять события
+    # с тем же временем, что и последнее обработанное (дубликаты отсеются)
+    if until is None:
+        until = now.timestamp()
+    params = {"$gt-at": since - 0.001, "$lt-at": until, "all": True}
+
+    # Ответ читается потоком по мере обработки событий - замеряется время
+    # до получения заголовков ответа
+    with metrics.timer("app_request"):
+        response = http_client.get(
+            f"{APP_API_URL}/history/", headers=headers, params=params, stream=True
+        )
+    with response:
+        response.raise_for_status()
+        chunks = response.iter_content(chunk_size=_STREAM_CHUNK_SIZE)
+        yield from _iter_json_items(chunks, "items")
+
+
+def _iter_json_items(chunks: Iterable[bytes], key: str) -> Iterator[Any]:
+    """
+    Потоково разбирает массив `key` верхнего уровня JSON объекта.
+
+    Элементы декодируются по одному через JSONDecoder.raw_decode, уже
+    разобранная часть буфера отбрасывается.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buf = ""
+    pos = 0
+    at_eof = False
+
+    def read_more() -> bool:
+        nonlocal buf, at_eof
+        for chunk in chunks:
+            if chunk:
+                buf += utf8.decode(chunk)
+                return True
+        buf += utf8.decode(b"", final=True)
+        at_eof = True
+        return False
+
+    array_start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    while True:
+        match = array_start.search(buf)
+        if match:
+            pos = match.end()
+            break
+        if not read_more():
+            return
+
+    while True:
+        while pos < len(buf) and buf[pos] in _JSON_SEPARATORS:
+            pos += 1
+        if pos == len(buf):
+            if not read_more():
+                raise ValueError(f"Неожиданный конец JSON в массиве {key}")
+            continue
+        if buf[pos] == "]":
+            return
 
-    response = requests.get(f"{APP_API_URL}/history/", headers=headers, params=params)
-    response.raise_for_status()
+        try:
+            item, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if at_eof:
+                raise
+            # элемент получен не полностью - дочитываем, пока необработанная
+            # часть буфера не вырастет вдвое (без квадратичного повторного разбора)
+            target = len(buf) + max(len(buf) - pos, _STREAM_CHUNK_SIZE)
+            while len(buf) < target and read_more():
+                pass
+            continue
 
-    data = response.json()
-    return data.get("items", [])
+        yield item
+        if pos > _STREAM_CHUNK_SIZE:
+            buf = buf[pos:]
+            pos = 0
@@ -1,12 +1,83 @@
+import re
+import select
 import socket
 import ssl
 import json
+import time
+import logging
+import random
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional
-from config import SYSLOG_HOST, SYSLOG_PORT
+from functools import lru_cache
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+from config import (
+    SYSLOG_HOST,
+    SYSLOG_PORT,
+    SYSLOG_TIMEOUT,
+    SYSLOG_TLS_SESSION_RESUMPTION,
+    SYSLOG_TLS_TICKET_WAIT,
+    SYSLOG_FRAMING,
+    SYSLOG_BATCH_MAX_BYTES,
+    SYSLOG_BATCH_MAX_MESSAGES,
+    SYSLOG_TRANSPORT,
+    SYSLOG_TRANSPORT_BY_FACILITY,
+    SYSLOG_TRANSPORT_PORTS,
+    SYSLOG_UDP_MAX_MESSAGE_SIZE,
+    SYSLOG_RELP_WINDOW,
+    SYSLOG_DESTINATIONS,
+    SYSLOG_RETRY_INTERVAL,
+    SYSLOG_RETRY_MAX_INTERVAL,
+    SYSLOG_RATE_LIMIT,
+    SYSLOG_RATE_BURST,
+    SYSLOG_RATE_MIN,
+    SYSLOG_RATE_INCREASE,
+    SYSLOG_RATE_DECREASE,
+    SYSLOG_RATE_LATENCY_TARGET,
+    SYSLOG_RECONNECT_ATTEMPTS,
+    SYSLOG_RECONNECT_BACKOFF,
+    SYSLOG_RECONNECT_BACKOFF_MAX,
+    SYSLOG_MAX_MESSAGE_SIZE,
+    SYSLOG_MAX_MESSAGE_SIZE_BY_TYPE,
+)
+import metrics
 
+try:
+    import orjson
+except ImportError:  # необязательная зависимость, см. SyslogFormatter
+    orjson = None
+
+logger = logging.getLogger(__name__)
 
 # https://www.rfc-editor.org/rfc/rfc5424
+# https://www.rfc-editor.org/rfc/rfc6587
+
+# Ошибки, после которых имеет смысл переподключиться и повторить отправку
+_RECONNECT_ERRORS = (
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+    ConnectionRefusedError,
+    ssl.SSLError,
+)
+
+# Максимальное число буферов в одном sendmsg (IOV_MAX в Linux)
+_IOV_MAX = 1024
+
+# https://github.com/rsyslog/librelp/blob/master/doc/relp.html
+# Фрейм RELP: TXNR SP COMMAND SP DATALEN [SP DATA] LF
+_RELP_HEADER = re.compile(rb"(\d{1,9}) ([a-z]{1,32}) (\d{1,9})([ \n])")
+_RELP_OFFERS = b"relp_version=0\nrelp_software=export-to-syslog\ncommands=syslog"
+_RELP_MAX_TXNR = 999_999_999
 
 
 def send_syslog_event(
@@ -33,56 +104,1034 @@ def send_syslog_event(
     - 4/10: security/authorization messages
     - 13: log audit
     - 16: local use 0 (local0)
+
+    Открывает отдельное соединение на каждый вызов; для отправки
+    множества событий используйте create_sender().
+    """
+
+    with create_sender() as sender:
+        sender.send(event, priority, facility)
+
+
+def format_syslog_message(
+    event: Dict[str, Any], priority: int, facility: Optional[int] = None
+) -> bytes:
+    """Формирует RFC5424 сообщение для события (без фрейминга)."""
+    return _formatter.format(event, priority, facility)
+
+
+def format_syslog_messages(
+    event: Dict[str, Any], priority: int, facility: Optional[int] = None
+) -> List[bytes]:
+    """
+    Формирует сообщения события с учетом SYSLOG_MAX_MESSAGE_SIZE(_BY_TYPE).
+
+    Returns:
+        Одно сообщение или части события (см. SyslogFormatter.format_parts)
+    """
+    max_size = SYSLOG_MAX_MESSAGE_SIZE_BY_TYPE.get(
+        event.get("event_type"), SYSLOG_MAX_MESSAGE_SIZE
+    )
+    return _formatter.format_parts(event, priority, facility, max_size)
+
+
+class SyslogFormatter:
+    """
+    Формирование RFC5424 сообщений с кешем заголовков.
+
+    Части заголовка, зависящие только от класса события (PRI, HOSTNAME,
+    APP-NAME, MSGID), собираются в bytes один раз на сочетание
+    (source, event_type, facility, severity). На событие остается
+    сериализация JSON и одна склейка частей в итоговые bytes. Если
+    установлен orjson, JSON сериализуется им сразу в bytes (компактно,
+    без пробелов после разделителей).
+    """
+
+    HOSTNAME = "audit-client"
+    APP_NAMES = {"app": "scanfactory-app", "keycloak": "keycloak"}
+    # Ограничение кеша на случай непредусмотренного множества event_type
+    MAX_CACHED_HEADERS = 4096
+
+    def __init__(self, use_orjson: bool = orjson is not None) -> None:
+        self._headers: Dict[Tuple[Any, ...], Tuple[bytes, bytes]] = {}
+        if use_orjson:
+            self._dumps = orjson.dumps
+        else:
+            encode = json.JSONEncoder(ensure_ascii=False).encode
+            self._dumps = lambda event: encode(event).encode("utf-8")
+
+    def format(
+        self, event: Any, priority: int, facility: Optional[int] = None
+    ) -> bytes:
+        """Формирует сообщение для события (dict или NormalizedEvent)."""
+        if facility is None:
+            facility = event.get("facility", 16)  # default: local0
+        source = event.get("source", "unknown")
+        event_type = event.get("event_type", "-")
+
+        key = (source, event_type, facility, priority)
+        header = self._headers.get(key)
+        if header is None:
+            header = self._build_header(source, event_type, facility, priority)
+            if len(self._headers) >= self.MAX_CACHED_HEADERS:
+                self._headers.clear()
+            self._headers[key] = header
+
+        timestamp = event.get("timestamp")
+        if isinstance(timestamp, str) and timestamp.endswith("+00:00"):
+            timestamp_bytes = timestamp.encode("utf-8")
+        else:
+            timestamp_bytes = _normalize_timestamp(timestamp).encode("utf-8")
+
+        # NormalizedEvent сериализуется через to_dict() только здесь
+        payload = event if isinstance(event, dict) else event.to_dict()
+        return b"".join(
+            (header[0], timestamp_bytes, header[1], self._dumps(payload))
+        )
+
+    def format_parts(
+        self,
+        event: Any,
+        priority: int,
+        facility: Optional[int] = None,
+        max_size: Optional[int] = None,
+    ) -> List[bytes]:
+        """
+        Формирует сообщения события, деля details на части по max_size байт.
+
+        details сериализуются по элементам (значение словаря, элемент
+        списка), а не целиком, и раскладываются по частям. Каждая часть -
+        отдельное сообщение с тем же заголовком и полями события плюс
+        part (номер с 1) и parts (число частей), details - в конце JSON.
+        details события - объединение details частей: списки с одним
+        ключом продолжаются в следующей части, остальные значения
+        находятся целиком в одной части. Элемент, который сам длиннее
+        лимита, отправляется отдельной частью как есть.
+
+        Returns:
+            [сообщение], если оно укладывается в max_size или делить нечего
+        """
+        details = event.get("details")
+        if max_size is None or not isinstance(details, (dict, list)) or not details:
+            return [self.format(event, priority, facility)]
+
+        payload = dict(event if isinstance(event, dict) else event.to_dict())
+        del payload["details"]
+        head = self.format(payload, priority, facility)
+        # Поля части: ',"part":N,"parts":M,"details":' и закрывающая скобка
+        budget = max_size - len(head) - 40
+        if isinstance(details, dict):
+            chunks = self._split_dict(details, budget)
+        else:
+            chunks = [
+                b"[" + b",".join(group) + b"]"
+                for group in _pack(map(self._dumps, details), budget - 2)
+            ]
+        if len(chunks) == 1:
+            return [self.format(event, priority, facility)]
+
+        body = head[:-1]  # JSON события без закрывающей скобки
+        return [
+            b'%b,"part":%d,"parts":%d,"details":%b}' % (body, n, len(chunks), chunk)
+            for n, chunk in enumerate(chunks, 1)
+        ]
+
+    def _split_dict(self, details: Dict[Any, Any], budget: int) -> List[bytes]:
+        """Делит словарь details на JSON объекты не длиннее budget байт."""
+        dumps = self._dumps
+        chunks: List[bytes] = []
+        fields: List[bytes] = []  # готовые поля текущей части
+        free = budget - 2
+
+        def close() -> None:
+            nonlocal fields, free
+            chunks.append(b"{" + b",".join(fields) + b"}")
+            fields = []
+            free = budget - 2
+
+        for key, value in details.items():
+            name = dumps(str(key)) + b":"
+            if not isinstance(value, list) or not value:
+                field = name + dumps(value)
+                if len(field) + 1 > free and fields:
+                    close()
+                fields.append(field)
+                free -= len(field) + 1
+                continue
+
+            # Список продолжается в следующей части под тем же ключом
+            elements: List[bytes] = []
+            for data in map(dumps, value):
+                # имя, скобки и запятая - один раз на часть списка
+                need = len(data) + 1 + (0 if elements else len(name) + 2)
+                if need > free and (fields or elements):
+                    if elements:
+                        fields.append(name + b"[" + b",".join(elements) + b"]")
+                        elements = []
+                    close()
+                    need = len(data) + len(name) + 3
+                elements.append(data)
+                free -= need
+            fields.append(name + b"[" + b",".join(elements) + b"]")
+        if fields:
+            close()
+        return chunks
+
+    def _build_header(
+        self, source: Any, event_type: Any, facility: Any, priority: int
+    ) -> Tuple[bytes, bytes]:
+        """Возвращает части заголовка до и после TIMESTAMP."""
+        facility_int = facility if isinstance(facility, int) else 16
+        # PRI: Facility * 8 + Severity
+        severity = priority if priority <= 7 else 7  # Severity должен быть 0-7
+        pri = facility_int * 8 + severity
+
+        app_name = self.APP_NAMES.get(source, "unknown")
+        procid = "-"
+        structured_data = "-"
+        bom = "\ufeff"  # UTF-8 Byte Order Mark перед MSG
+        return (
+            f"<{pri}>1 ".encode("utf-8"),
+            f" {self.HOSTNAME} {app_name} {procid} {event_type} "
+            f"{structured_data} {bom}".encode("utf-8"),
+        )
+
+
+def _pack(items: Iterable[bytes], budget: int) -> Iterator[List[bytes]]:
+    """Группирует элементы JSON так, чтобы группа через запятую была <= budget."""
+    group: List[bytes] = []
+    size = 0
+    for item in items:
+        if group and size + len(item) + 1 > budget:
+            yield group
+            group, size = [], 0
+        group.append(item)
+        size += len(item) + 1
+    if group:
+        yield group
+
+
+_formatter = SyslogFormatter()
+
+
+def frame_message(message: bytes, framing: str = SYSLOG_FRAMING) -> bytes:
     """
+    Оборачивает сообщение во фрейм RFC6587 для передачи по TCP.
 
-    msg = json.dumps(event, ensure_ascii=False)
+    - "octet-counting": MSG-LEN SP SYSLOG-MSG (перевод строки внутри
+      сообщения не ломает разбор на стороне коллектора)
+    - "non-transparent": SYSLOG-MSG LF
+    """
+    if framing == "octet-counting":
+        return b"%d %b" % (len(message), message)
+    if framing == "non-transparent":
+        return message + b"\n"
+    raise ValueError(f"Неизвестный тип фрейминга: {framing}")
 
-    hostname = "audit-client"
 
-    source = event.get("source", "unknown")
-    if source == "app":
-        app_name = "scanfactory-app"
-    elif source == "keycloak":
-        app_name = "keycloak"
-    else:
-        app_name = "unknown"
+def backoff_delay(base: float, attempt: int, maximum: float) -> float:
+    """
+    Пауза перед повтором номер attempt (с 1): экспоненциальная с разбросом.
 
-    timestamp = _normalize_timestamp(event.get("timestamp"))
+    Случайная в пределах от половины до полного base * 2^(attempt - 1), но
+    не больше maximum - повторы нескольких процессов не совпадают по времени.
+    """
+    delay = min(maximum, base * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
 
-    if facility is None:
-        facility = event.get("facility", 16)  # default: local0
 
-    facility_int = facility if isinstance(facility, int) else 16
+class RateLimiter:
+    """
+    Ограничение скорости отправки (token bucket) с AIMD подстройкой.
+
+    Запас burst сообщений пополняется со скоростью rate сообщений в секунду;
+    acquire() ждет, пока запаса хватит на пачку. Скорость подстраивается
+    под коллектор: после быстрой записи пачки растет на increase (до
+    max_rate), после медленной (дольше latency_target) или обрыва
+    соединения умножается на decrease (не ниже min_rate).
+    """
 
-    # PRI: Facility * 8 + Severity
-    severity = priority if priority <= 7 else 7  # Severity должен быть 0-7
-    pri = facility_int * 8 + severity
+    def __init__(
+        self,
+        rate: float,
+        burst: int = SYSLOG_RATE_BURST,
+        min_rate: float = SYSLOG_RATE_MIN,
+        increase: float = SYSLOG_RATE_INCREASE,
+        decrease: float = SYSLOG_RATE_DECREASE,
+        latency_target: float = SYSLOG_RATE_LATENCY_TARGET,
+    ) -> None:
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min(min_rate, rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
 
-    procid = "-"
-    msgid = event.get("event_type", "-")
-    structured_data = "-"
+    def acquire(self, count: int) -> float:
+        """
+        Забирает count сообщений из запаса, при нехватке ждет.
 
-    bom = "\ufeff"  # UTF-8 Byte Order Mark перед MSG если есть не-ASCII символы
-    rfc5424_msg = f"<{pri}>1 {timestamp} {hostname} {app_name} {procid} {msgid} {structured_data} {bom}{msg}\n"
+        Пачка больше burst не ждет накопления всего запаса: запас уходит
+        в минус и следующая пачка ждет, пока он восстановится.
 
-    with socket.create_connection((SYSLOG_HOST, SYSLOG_PORT)) as sock:
-        if SYSLOG_PORT == 6514:
-            context = ssl.create_default_context()
-            with context.wrap_socket(sock, server_hostname=SYSLOG_HOST) as ssock:
-                ssock.sendall(rfc5424_msg.encode("utf-8"))
+        Returns:
+            Время ожидания, сек
+        """
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+        wait = 0.0
+        if self._tokens < min(count, self.burst):
+            wait = (min(count, self.burst) - self._tokens) / self.rate
+            time.sleep(wait)
+            self._tokens += wait * self.rate
+            self._updated = time.monotonic()
+        self._tokens -= count
+        return wait
+
+    def success(self, latency: float) -> None:
+        """Учитывает время записи пачки."""
+        if latency > self.latency_target:
+            self.congestion()
         else:
-            sock.sendall(rfc5424_msg.encode("utf-8"))
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def congestion(self) -> None:
+        """Снижает скорость после медленной записи или обрыва соединения."""
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+
+
+class SyslogSender:
+    """
+    Долгоживущее подключение к syslog серверу.
+
+    Держит одно TCP/TLS соединение на весь запуск, SSL контекст создается
+    один раз, TLS сессия при переподключении возобновляется (счетчики
+    полных и возобновленных handshake и соединений, сессию которых не
+    удалось сохранить, - tls_handshakes). При обрыве
+    соединения (broken pipe, reset) переподключается и повторяет отправку
+    до reconnect_attempts раз с экспоненциальной паузой (backoff_delay).
+    Если задан rate_limit, скорость отправки ограничивается и
+    подстраивается под коллектор (см. RateLimiter).
+
+    send_messages() отправляет готовые сообщения пачками (sendmsg со
+    scatter-gather, для TLS - одним sendall) по max_batch_messages
+    сообщений или max_batch_bytes байт.
+
+    Использование:
+        with SyslogSender() as sender:
+            delivered = sender.send_messages(messages)
+    """
+
+    def __init__(
+        self,
+        host: str = SYSLOG_HOST,
+        port: int = SYSLOG_PORT,
+        use_tls: Optional[bool] = None,
+        timeout: float = SYSLOG_TIMEOUT,
+        framing: str = SYSLOG_FRAMING,
+        max_batch_bytes: int = SYSLOG_BATCH_MAX_BYTES,
+        max_batch_messages: int = SYSLOG_BATCH_MAX_MESSAGES,
+        rate_limit: Optional[float] = SYSLOG_RATE_LIMIT,
+        reconnect_attempts: int = SYSLOG_RECONNECT_ATTEMPTS,
+        tls_resumption: bool = SYSLOG_TLS_SESSION_RESUMPTION,
+        tls_ticket_wait: float = SYSLOG_TLS_TICKET_WAIT,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.use_tls = port == 6514 if use_tls is None else use_tls
+        self.timeout = timeout
+        self.framing = framing
+        self.max_batch_bytes = max_batch_bytes
+        self.max_batch_messages = max_batch_messages
+        self.limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnects = 0
+        self.tls_resumption = tls_resumption
+        self.tls_ticket_wait = tls_ticket_wait
+        # Полные и возобновленные TLS handshake за время жизни отправителя;
+        # missed - соединения, закрытые без сохраненной сессии (следующее
+        # подключение, скорее всего, будет с полным handshake)
+        self.tls_handshakes = {"full": 0, "resumed": 0, "missed": 0}
+        self._sock: Optional[socket.socket] = None
+        self._ssl_context: Optional[ssl.SSLContext] = None
+        self._tls_session: Optional[ssl.SSLSession] = None
+        self._tls_session_pending = False  # сессия соединения еще не сохранена
+        self._tls_ticket_waited = False  # ticket уже ожидался после записи
 
+    def __enter__(self) -> "SyslogSender":
+        return self
 
-def _normalize_timestamp(timestamp: Optional[str]) -> str:
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        self.close()
+
+    def _get_ssl_context(self) -> ssl.SSLContext:
+        if self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        return self._ssl_context
+
+    def connect(self) -> socket.socket:
+        """Открывает соединение, если оно еще не открыто."""
+        if self._sock is None:
+            sock = socket.create_connection(
+                (self.host, self.port), timeout=self.timeout
+            )
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if self.use_tls:
+                try:
+                    sock = self._get_ssl_context().wrap_socket(
+                        sock, server_hostname=self.host, session=self._tls_session
+                    )
+                except Exception:
+                    sock.close()
+                    raise
+                resumed = sock.session_reused
+                self._tls_session_pending = self.tls_resumption
+                self._tls_ticket_waited = False
+                self.tls_handshakes["resumed" if resumed else "full"] += 1
+                logger.debug(
+                    f"TLS соединение с {self.host}:{self.port}: "
+                    f"{'сессия возобновлена' if resumed else 'полный handshake'}"
+                )
+            self._sock = sock
+        return self._sock
+
+    def _remember_tls_session(self, wait: float = 0) -> None:
+        """
+        Запоминает TLS сессию соединения для следующего подключения.
+
+        В TLS 1.3 session ticket приходит от сервера после handshake и
+        обрабатывается только при чтении из соединения, поэтому перед
+        сохранением принятые данные читаются - до прихода ticket, но не
+        дольше wait сек. Пока сессия не сохранена, попытка повторяется
+        после каждой записи.
+        """
+        sock = self._sock
+        if not self._tls_session_pending or not isinstance(sock, ssl.SSLSocket):
+            return
+        try:
+            self._read_tls_tickets(sock, wait)
+            session = sock.session
+        except (OSError, ValueError):
+            return
+        if _tls_session_ready(sock, session):
+            self._tls_session = session
+            self._tls_session_pending = False
+
+    def _read_tls_tickets(self, sock: ssl.SSLSocket, wait: float) -> None:
+        deadline = time.monotonic() + wait
+        sock.settimeout(0)
+        try:
+            while True:
+                try:
+                    # syslog сервер данных не отправляет - читаются только
+                    # служебные записи TLS (NewSessionTicket)
+                    if not sock.recv(1):
+                        return  # сервер закрыл соединение
+                except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                    pass
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or _tls_session_ready(sock, sock.session):
+                    return
+                select.select([sock], [], [], remaining)
+        finally:
+            sock.settimeout(self.timeout)
+
+    def close(self) -> None:
+        """Закрывает соединение."""
+        if self._sock is not None:
+            self._remember_tls_session(self.tls_ticket_wait)
+            if self._tls_session_pending:
+                self._tls_session_pending = False
+                self.tls_handshakes["missed"] += 1
+                logger.debug(
+                    f"TLS сессия соединения с {self.host}:{self.port} не сохранена"
+                )
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def send(
+        self, event: Dict[str, Any], priority: int, facility: Optional[int] = None
+    ) -> None:
+        """Отправляет одно событие сразу."""
+        message = format_syslog_message(event, priority, facility)
+        self.send_raw(self._frame(message))
+
+    def send_raw(self, data: bytes) -> None:
+        """
+        Отправляет готовые байты.
+
+        При обрыве соединения переподключается и повторяет отправку до
+        reconnect_attempts раз (см. _write), затем пробрасывает исключение.
+        """
+        self._write([data])
+
+    def send_messages(self, messages: Sequence[bytes]) -> int:
+        """
+        Отправляет готовые RFC5424 сообщения по порядку пачками.
+
+        Используется для доставки из outbox: при ошибке отправка
+        прекращается, соединение закрывается.
+
+        Returns:
+            Количество сообщений с начала последовательности, записанных
+            в соединение
+        """
+        delivered = 0
+        chunk: List[bytes] = []
+        chunk_bytes = 0
+        for message in messages:
+            frame = self._frame(message)
+            chunk.append(frame)
+            chunk_bytes += len(frame)
+            if (
+                len(chunk) >= self.max_batch_messages
+                or chunk_bytes >= self.max_batch_bytes
+            ):
+                if not self._try_write(chunk):
+                    return delivered
+                delivered += len(chunk)
+                chunk = []
+                chunk_bytes = 0
+        if chunk and self._try_write(chunk):
+            delivered += len(chunk)
+        return delivered
+
+    def _try_write(self, chunks: List[bytes]) -> bool:
+        try:
+            self._write(chunks)
+            return True
+        except OSError as ex:
+            logger.error(f"Ошибка отправки пачки из {len(chunks)} сообщений: {ex}")
+            self.close()
+            return False
+
+    def _frame(self, message: bytes) -> bytes:
+        return frame_message(message, self.framing)
+
+    def _write(self, chunks: List[bytes]) -> None:
+        if self.limiter is not None:
+            self.limiter.acquire(len(chunks))
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                sock = self.connect()
+                self._transmit(sock, chunks)
+                if self._tls_session_pending:
+                    # Сессия нужна на случай обрыва: после первой записи
+                    # ticket ожидается до tls_ticket_wait сек, после
+                    # следующих - проверяются уже принятые данные
+                    wait = 0 if self._tls_ticket_waited else self.tls_ticket_wait
+                    self._tls_ticket_waited = True
+                    self._remember_tls_session(wait)
+                break
+            except _RECONNECT_ERRORS as ex:
+                # Без завершения сессии (RELP close) - соединение уже оборвано
+                SyslogSender.close(self)
+                if self.limiter is not None:
+                    self.limiter.congestion()
+                if attempt >= self.reconnect_attempts:
+                    raise
+                attempt += 1
+                self.reconnects += 1
+                delay = backoff_delay(
+                    SYSLOG_RECONNECT_BACKOFF, attempt, SYSLOG_RECONNECT_BACKOFF_MAX
+                )
+                logger.warning(
+                    f"Ошибка соединения с {self.host}:{self.port} ({ex}), "
+                    f"повтор {attempt}/{self.reconnect_attempts} через {delay:.1f} сек"
+                )
+                time.sleep(delay)
+        if self.limiter is not None:
+            self.limiter.success(time.perf_counter() - start)
+
+    def _transmit(self, sock: socket.socket, chunks: List[bytes]) -> None:
+        """Записывает пачку в соединение (переопределяется транспортами)."""
+        self._write_chunks(sock, chunks)
+
+    @staticmethod
+    def _write_chunks(sock: socket.socket, chunks: List[bytes]) -> None:
+        if isinstance(sock, ssl.SSLSocket) or not hasattr(sock, "sendmsg"):
+            # SSLSocket не поддерживает sendmsg - склеиваем в одну запись
+            sock.sendall(chunks[0] if len(chunks) == 1 else b"".join(chunks))
+            return
+
+        views = [memoryview(c) for c in chunks]
+        i = 0
+        while i < len(views):
+            sent = sock.sendmsg(views[i : i + _IOV_MAX])
+            # sendmsg может записать только часть данных - сдвигаемся
+            while sent and i < len(views):
+                size = len(views[i])
+                if sent >= size:
+                    sent -= size
+                    i += 1
+                else:
+                    views[i] = views[i][sent:]
+                    sent = 0
+
+
+class UdpSender(SyslogSender):
+    """
+    Отправка по UDP (RFC5426): одно сообщение в датаграмме, без фрейминга.
+
+    Доставка не подтверждается - сообщение считается отправленным, если
+    датаграмма записана в сокет. Сообщения длиннее max_message_size
+    обрезаются (по границе символа UTF-8).
+    """
+
+    def __init__(
+        self,
+        host: str = SYSLOG_HOST,
+        port: int = SYSLOG_TRANSPORT_PORTS.get("udp", SYSLOG_PORT),
+        max_message_size: int = SYSLOG_UDP_MAX_MESSAGE_SIZE,
+        **kwargs: Any,
+    ) -> None:
+        kwargs["use_tls"] = False
+        super().__init__(host, port, **kwargs)
+        self.max_message_size = max_message_size
+        self.truncated = 0
+
+    def connect(self) -> socket.socket:
+        if self._sock is None:
+            family, _, _, _, address = socket.getaddrinfo(
+                self.host, self.port, type=socket.SOCK_DGRAM
+            )[0]
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(address)
+            except OSError:
+                sock.close()
+                raise
+            self._sock = sock
+        return self._sock
+
+    def _frame(self, message: bytes) -> bytes:
+        if len(message) <= self.max_message_size:
+            return message
+        self.truncated += 1
+        return (
+            message[: self.max_message_size]
+            .decode("utf-8", "ignore")
+            .encode("utf-8")
+        )
+
+    def _transmit(self, sock: socket.socket, chunks: List[bytes]) -> None:
+        for datagram in chunks:
+            sock.send(datagram)
+
+
+class RelpError(OSError):
+    """Ошибка протокола RELP или отказ сервера принять сообщение."""
+
+
+class RelpSender(SyslogSender):
+    """
+    Отправка по RELP (Reliable Event Logging Protocol, rsyslog imrelp).
+
+    Каждое сообщение подтверждается сервером (rsp 200). Сообщения
+    отправляются скользящим окном: без ожидания подтверждения в сети
+    находится не больше window сообщений. Пачка считается доставленной,
+    когда подтверждены все ее сообщения. Сессия открывается командой
+    open при подключении и закрывается командой close.
+    """
+
+    def __init__(
+        self,
+        host: str = SYSLOG_HOST,
+        port: int = SYSLOG_TRANSPORT_PORTS.get("relp", SYSLOG_PORT),
+        window: int = SYSLOG_RELP_WINDOW,
+        **kwargs: Any,
+    ) -> None:
+        kwargs.setdefault("use_tls", False)
+        super().__init__(host, port, **kwargs)
+        self.window = window
+        self._txnr = 0
+        self._rbuf = b""
+
+    def connect(self) -> socket.socket:
+        if self._sock is None:
+            sock = super().connect()
+            self._txnr = 0
+            self._rbuf = b""
+            try:
+                txnr = self._next_txnr()
+                self._write_chunks(sock, [self._command(txnr, b"open", _RELP_OFFERS)])
+                self._check_response(self._read_response(), {txnr})
+            except Exception:
+                super().close()
+                raise
+        return self._sock
+
+    def close(self) -> None:
+        """Закрывает сессию RELP (если возможно) и соединение."""
+        if self._sock is not None:
+            try:
+                txnr = self._next_txnr()
+                self._write_chunks(self._sock, [self._command(txnr, b"close", b"")])
+                self._read_response()
+            except OSError:
+                pass
+        super().close()
+
+    def _frame(self, message: bytes) -> bytes:
+        return message
+
+    def _read_tls_tickets(self, sock: ssl.SSLSocket, wait: float) -> None:
+        # Ответы RELP читаются из соединения постоянно, ticket уже обработан;
+        # лишнее чтение забрало бы часть ответа
+        pass
+
+    def _transmit(self, sock: socket.socket, messages: List[bytes]) -> None:
+        pending: Set[int] = set()
+        i = 0
+        while i < len(messages) or pending:
+            free = self.window - len(pending)
+            if i < len(messages) and free > 0:
+                frames = []
+                for message in messages[i : i + free]:
+                    txnr = self._next_txnr()
+                    frames.append(self._command(txnr, b"syslog", message))
+                    pending.add(txnr)
+                i += len(frames)
+                self._write_chunks(sock, frames)
+
+            # Ждем хотя бы одно подтверждение и разбираем все уже пришедшие
+            response = self._read_response()
+            while response is not None:
+                self._check_response(response, pending)
+                pending.discard(response[0])
+                response = self._parse_response()
+
+    def _next_txnr(self) -> int:
+        self._txnr = self._txnr % _RELP_MAX_TXNR + 1
+        return self._txnr
+
+    @staticmethod
+    def _command(txnr: int, command: bytes, data: bytes) -> bytes:
+        if data:
+            return b"%d %b %d %b\n" % (txnr, command, len(data), data)
+        return b"%d %b 0\n" % (txnr, command)
+
+    @staticmethod
+    def _check_response(
+        response: Tuple[int, bytes, bytes], pending: Set[int]
+    ) -> None:
+        txnr, command, data = response
+        if command == b"serverclose":
+            raise ConnectionResetError("RELP сервер закрыл сессию")
+        if command != b"rsp" or txnr not in pending:
+            raise RelpError(f"Неожиданный ответ RELP: {txnr} {command!r}")
+        if not data.startswith(b"200"):
+            raise RelpError(f"RELP сервер отклонил сообщение: {data[:100]!r}")
+
+    def _read_response(self) -> Tuple[int, bytes, bytes]:
+        """Читает из соединения следующий фрейм сервера."""
+        response = self._parse_response()
+        while response is None:
+            data = self._sock.recv(65536)
+            if not data:
+                raise ConnectionResetError("RELP сервер закрыл соединение")
+            self._rbuf += data
+            response = self._parse_response()
+        return response
+
+    def _parse_response(self) -> Optional[Tuple[int, bytes, bytes]]:
+        """Извлекает фрейм из буфера чтения (None если он получен не целиком)."""
+        match = _RELP_HEADER.match(self._rbuf)
+        if match is None:
+            if len(self._rbuf) > 64 or b"\n" in self._rbuf:
+                raise RelpError(f"Некорректный фрейм RELP: {self._rbuf[:64]!r}")
+            return None
+
+        datalen = int(match.group(3))
+        if datalen == 0:
+            end = match.end()
+            if match.group(4) == b" ":
+                end += 1  # "0 " перед LF
+        else:
+            end = match.end() + datalen + 1
+        if len(self._rbuf) < end:
+            return None
+
+        data = self._rbuf[match.end() : match.end() + datalen]
+        self._rbuf = self._rbuf[end:]
+        return int(match.group(1)), match.group(2), data
+
+
+TRANSPORTS = {
+    "tcp": SyslogSender,
+    "udp": UdpSender,
+    "relp": RelpSender,
+}
+
+
+class RoutingSender:
+    """
+    Отправка через разные транспорты в зависимости от класса события.
+
+    Транспорт выбирается по facility и severity из PRI сообщения (см.
+    SYSLOG_TRANSPORT_BY_FACILITY), так что для массовых событий можно
+    выбрать быстрый UDP, а для событий аудита - RELP с подтверждением.
+    """
+
+    def __init__(
+        self,
+        senders: Dict[str, SyslogSender],
+        routes: Dict[Any, str],
+        default: str,
+    ) -> None:
+        self.senders = senders
+        self.routes = routes
+        self.default = default
+        self.max_batch_messages = senders[default].max_batch_messages
+
+    def __enter__(self) -> "RoutingSender":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        for sender in self.senders.values():
+            sender.__exit__(exc_type, *exc_info)
+
+    @property
+    def reconnects(self) -> int:
+        return sum(sender.reconnects for sender in self.senders.values())
+
+    @property
+    def tls_handshakes(self) -> Dict[str, int]:
+        handshakes = {"full": 0, "resumed": 0, "missed": 0}
+        for sender in self.senders.values():
+            for result, count in sender.tls_handshakes.items():
+                handshakes[result] += count
+        return handshakes
+
+    def transport_for(self, facility: int, severity: int) -> str:
+        return self.routes.get(
+            (facility, severity), self.routes.get(facility, self.default)
+        )
+
+    def close(self) -> None:
+        for sender in self.senders.values():
+            sender.close()
+
+    def send(
+        self, event: Dict[str, Any], priority: int, facility: Optional[int] = None
+    ) -> None:
+        message = format_syslog_message(event, priority, facility)
+        pri = _parse_pri(message)
+        sender = self.senders[self.transport_for(pri >> 3, pri & 7)]
+        sender.send_raw(sender._frame(message))
+
+    def send_messages(self, messages: Sequence[bytes]) -> int:
+        """
+        Отправляет сообщения, сгруппировав их по транспортам.
+
+        Returns:
+            Количество сообщений с начала последовательности, доставленных
+            (каждое своим транспортом) без ошибок
+        """
+        groups: Dict[str, List[int]] = {}
+        for index, message in enumerate(messages):
+            pri = _parse_pri(message)
+            groups.setdefault(self.transport_for(pri >> 3, pri & 7), []).append(index)
+
+        delivered = len(messages)
+        for transport, indexes in groups.items():
+            sent = self.senders[transport].send_messages(
+                [messages[index] for index in indexes]
+            )
+            if sent < len(indexes):
+                delivered = min(delivered, indexes[sent])
+        return delivered
+
+
+Sender = Union[SyslogSender, RoutingSender]
+
+
+def create_sender(
+    host: str = SYSLOG_HOST,
+    port: Optional[int] = None,
+    transport: str = SYSLOG_TRANSPORT,
+    transport_by_facility: Optional[Dict[Any, str]] = None,
+    transport_ports: Optional[Dict[str, int]] = None,
+    rate_limit: Optional[float] = SYSLOG_RATE_LIMIT,
+) -> Sender:
+    """
+    Создает отправителя по настройкам транспорта (по умолчанию из config.py).
+
+    Если transport_by_facility пуст, возвращается отправитель transport,
+    иначе - RoutingSender с отдельным соединением на каждый используемый
+    транспорт. port относится к основному транспорту, порты остальных
+    берутся из transport_ports. rate_limit - ограничение скорости каждого
+    соединения, сообщений/сек.
+    """
+    if transport_by_facility is None:
+        transport_by_facility = SYSLOG_TRANSPORT_BY_FACILITY
+    if transport_ports is None:
+        transport_ports = SYSLOG_TRANSPORT_PORTS
+
+    transports = {transport, *transport_by_facility.values()}
+    unknown = transports - TRANSPORTS.keys()
+    if unknown:
+        raise ValueError(f"Неизвестный транспорт syslog: {', '.join(sorted(unknown))}")
+
+    ports = dict(transport_ports)
+    if port is not None:
+        ports[transport] = port
+    senders = {
+        name: TRANSPORTS[name](
+            host, ports.get(name, SYSLOG_PORT), rate_limit=rate_limit
+        )
+        for name in transports
+    }
+    if len(senders) == 1 and not transport_by_facility:
+        return senders[transport]
+    return RoutingSender(senders, transport_by_facility, transport)
+
+
+class Destination:
+    """
+    Получатель событий: отправитель и состояние доставки (circuit breaker).
+
+    После ошибки отправки получатель размыкается: отправка ему
+    приостанавливается, сообщения остаются в outbox, чтобы недоступный
+    коллектор не тормозил каждый цикл таймаутами. Пауза начинается с
+    retry_interval и удваивается с каждой ошибкой подряд (до
+    max_retry_interval, с разбросом). После паузы получателю отправляется
+    пробная пачка: успех замыкает его, ошибка - снова размыкает.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        sender: Sender,
+        retry_interval: float = SYSLOG_RETRY_INTERVAL,
+        max_retry_interval: float = SYSLOG_RETRY_MAX_INTERVAL,
+    ) -> None:
+        self.name = name
+        self.sender = sender
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.failures = 0
+        self._retry_at = 0.0
+
+    def __enter__(self) -> "Destination":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        self.sender.__exit__(exc_type, *exc_info)
+
+    @property
+    def ready(self) -> bool:
+        return time.monotonic() >= self._retry_at
+
+    @property
+    def state(self) -> str:
+        """"closed" - отправка идет, "open" - пауза, "half-open" - пробная."""
+        if not self.failures:
+            return "closed"
+        return "half-open" if self.ready else "open"
+
+    def failed(self) -> float:
+        """Размыкает получателя после ошибки, возвращает паузу, сек."""
+        self.failures += 1
+        pause = backoff_delay(
+            self.retry_interval, self.failures, self.max_retry_interval
+        )
+        self._retry_at = time.monotonic() + pause
+        return pause
+
+    def succeeded(self) -> None:
+        """Замыкает получателя после успешной отправки."""
+        self.failures = 0
+        self._retry_at = 0.0
+
+
+def create_destinations() -> List[Destination]:
+    """
+    Создает получателей из SYSLOG_DESTINATIONS.
+
+    Если список пуст, возвращается один получатель "default" с настройками
+    SYSLOG_HOST / SYSLOG_PORT / SYSLOG_TRANSPORT.
+    """
+    if not SYSLOG_DESTINATIONS:
+        return [Destination("default", create_sender())]
+
+    destinations = []
+    for options in SYSLOG_DESTINATIONS:
+        options = dict(options)
+        name = options.pop("name")
+        retry_interval = options.pop("retry_interval", SYSLOG_RETRY_INTERVAL)
+        max_retry_interval = options.pop(
+            "max_retry_interval", SYSLOG_RETRY_MAX_INTERVAL
+        )
+        destinations.append(
+            Destination(
+                name, create_sender(**options), retry_interval, max_retry_interval
+            )
+        )
+    if len({d.name for d in destinations}) != len(destinations):
+        raise ValueError("Имена получателей в SYSLOG_DESTINATIONS должны различаться")
+    return destinations
+
+
+def _tls_session_ready(sock: ssl.SSLSocket, session: Any) -> bool:
+    """Есть ли у соединения сессия, пригодная для возобновления."""
+    if session is None:
+        return False
+    if sock.version() == "TLSv1.3":
+        # До NewSessionTicket у сессии TLS 1.3 нет ticket - возобновить
+        # ее нельзя, хотя session ID заполнен
+        return session.has_ticket
+    return session.has_ticket or bool(session.id)
+
+
+def _parse_pri(message: bytes) -> int:
+    """Возвращает PRI из начала RFC5424 сообщения ("<PRI>1 ...")."""
+    return int(message[1 : message.index(b">")])
+
+
+@lru_cache(maxsize=64)
+def _utc_date(days: int) -> str:
+    # Дата форматируется один раз на сутки событий, время - арифметикой:
+    # быстрее datetime.fromtimestamp().isoformat()
+    return time.strftime("%Y-%m-%d", time.gmtime(days * 86400))
+
+
+def _normalize_timestamp(timestamp: Any) -> str:
     """
     Нормализует timestamp к формату RFC5424 (ISO8601 с timezone).
 
     RFC5424 требует формат: YYYY-MM-DDTHH:MM:SS.ssssss+TZ
     Пример: 2025-10-14T12:34:56.123456+00:00
+
+    Число (или строка из цифр) - время Keycloak в миллисекундах epoch,
+    переводится в UTC с точностью до миллисекунд.
     """
     if not timestamp:
-        timestamp = datetime.now(timezone.utc).isoformat() + "Z"
+        return datetime.now(timezone.utc).isoformat()
+
+    if isinstance(timestamp, str) and timestamp.isdigit():
+        timestamp = int(timestamp)
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        seconds, millis = divmod(int(timestamp), 1000)
+        days, seconds = divmod(seconds, 86400)
+        hours, seconds = divmod(seconds, 3600)
+        minutes, seconds = divmod(seconds, 60)
+        return (
+            f"{_utc_date(days)}T{hours:02d}:{minutes:02d}:{seconds:02d}"
+            f".{millis:03d}+00:00"
+        )
 
     if isinstance(timestamp, str):
         if not (
@@ -91,5 +1140,10 @@ def _normalize_timestamp(timestamp: Optional[str]) -> str:
             timestamp = timestamp + "Z"
         if timestamp.endswith("Z"):
             timestamp = timestamp[:-1] + "+00:00"
+        return timestamp
 
-    return timestamp
+    if isinstance(timestamp, datetime):
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        return timestamp.isoformat()
+    return str(timestamp)